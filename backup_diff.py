@@ -0,0 +1,5373 @@
+#!/usr/bin/env python3
+
+"""
+
+Mike's Backup Diff
+
+A simple script to help compare changes between a backup destination directory, and its source
+
+Copyright 2019 Mike Peralta; All rights reserved
+
+Released under the GNU GENERAL PUBLIC LICENSE v3 (See LICENSE file for more)
+
+"""
+
+
+# Only what every run needs; modules that only some options use (concurrent.futures, cProfile, csv,
+# gzip, hashlib, random, shlex, sqlite3, subprocess) are imported where they're used, and
+# humanfriendly is optional (see load_optional_module)
+import collections
+import datetime
+import heapq
+import importlib
+import json
+import math
+import os
+import queue
+import re
+import stat
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+# Anything that goes wrong on purpose (rather than a bug) raises one of these,
+# so code using this as a library can tell a failed comparison from a crash
+class BackupDiffError(Exception):
+	pass
+
+
+# Bad arguments, options or paths
+class UsageError(BackupDiffError):
+	pass
+
+
+# Plain byte counts, or with a K/M/G/T suffix (powers of 1024)
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+
+# Rsync's itemized changes (like: >f.st...... some/file), and its messages (like: *deleting some/file)
+RSYNC_ITEMIZED_PATTERN = re.compile(r"^(?P<line>(?P<flags>[^\s]{11})(?P<item>.*))$")
+RSYNC_MESSAGE_PATTERN = re.compile(r"^(?P<line>\*(?P<message>[\w]+)(?P<item>.*))$")
+
+# Rsync's --list-only output, like: drwxr-xr-x          4,096 2019/09/22 14:03:51 name
+RSYNC_LISTING_PATTERN = re.compile(r"^(?P<permissions>\S{10})\s+[\d,.]+\s+\S+\s+\S+\s(?P<name>.+)$")
+
+# Characters that make an rsync pattern a wildcard pattern
+RSYNC_WILDCARD_PATTERN = re.compile(r"[*?\[]")
+RSYNC_ESCAPED_PATTERN = re.compile(r"([*?\[\\])")
+
+
+#
+class BackupDiff:
+	
+	def __init__(self):
+		
+		self.__source_path = None
+		self.__source_ssh_host = None
+		self.__source_ssh_user = None
+		
+		self.__backup_path = None
+		self.__backup_ssh_host = None
+		self.__backup_ssh_user = None
+		
+		self.__ssh_key = None
+		self.__ssh_multiplex = True
+		self.__ssh_control_dir = None
+		self.__ssh_pool = None
+		
+		self.__source_path_items = None
+		self.__backup_path_items = None
+		
+		self.__difference_entries = None
+		self.__do_clean_difference_entries = True
+		
+		self.__force_rsync = False
+		self.__rsync_jobs = 1
+		self.__rsync_timeout = None
+		self.__rsync_idle_timeout = None
+		self.__streaming = False
+		
+		self.__watch = False
+		self.__watch_socket_path = None
+		self.__watch_entries = None
+		self.__watch_report_requested = False
+		
+		self.__batch_config_path = None
+		self.__batch_jobs = None
+		
+		self.__remote_manifest = False
+		self.__manifest_shell = None
+		
+		self.__walk_threads = 8
+		
+		self.__path_filter = PathFilter()
+		
+		self.__index_dir = None
+		self.__rebuild_index = False
+		self.__verify_index = False
+		
+		self.__report_limit = None
+		self.__report_format = "text"
+		self.__only_types = None
+		
+		self.__save_result_path = None
+		self.__load_result_path = None
+		self.__since_result_path = None
+		self.__since_result_created = None
+		self.__resolved_entries = None
+		
+		self.__verify_content = False
+		self.__hash_processes = os.cpu_count() or 1
+		self.__content_verifier = None
+		
+		self.__verify_sample = False
+		self.__sample_bytes = None
+		self.__sample_seconds = None
+		self.__sample_candidates = None
+		self.__sample_summary = None
+		
+		self.__progress = ProgressReporter()
+		
+		self.__arguments = []
+		
+		# Set when used as a library, so entries are always collected instead of written out
+		self.__collect_entries = False
+		
+		self.__stats = RunStats()
+		self.__stats_json_path = None
+		self.__profile_path = None
+		
+	def run(self, arguments: list=None):
+		
+		self.consume_arguments(arguments)
+		
+		if self.__batch_config_path is not None:
+			function = self.run_batch
+		elif self.__watch:
+			function = self.watch
+		else:
+			function = self.run_phases
+		
+		self.run_profiled(function)
+	
+	# Everything a run does short of reporting, for use as a library.
+	# Arguments must have been consumed first; output options like --format don't apply.
+	def calculate_result(self):
+		
+		self.__collect_entries = True
+		
+		self.run_profiled(self.run_comparison_phases)
+		
+		return DiffResult(
+			self.__source_path, self.__backup_path,
+			self.__difference_entries, self.__resolved_entries, self.__sample_summary,
+			self.__stats.to_dict()
+		)
+	
+	# The difference entries of calculate_result(), as an iterator. When nothing needs them all
+	# at once (two local trees, no saved or previous results, no type filter), they come from
+	# the streaming walk as they're found; otherwise they're yielded once the result is ready.
+	def iterate_result(self):
+		
+		if self.should_use_rsync() or self.__remote_manifest \
+			or self.__load_result_path is not None or self.__save_result_path is not None \
+			or self.__since_result_path is not None or self.__only_types is not None \
+			or self.__verify_sample or self.__profile_path is not None:
+			return iter(self.calculate_result())
+		
+		# Checked up front, so bad paths raise here rather than on the first entry
+		self.check_source_path()
+		self.check_backup_path()
+		
+		return self.iterate_result_streaming()
+	
+	def iterate_result_streaming(self):
+		
+		if self.__verify_content:
+			self.open_content_verifier()
+		
+		entry_count = 0
+		self.__stats.begin_phase("compare")
+		try:
+			for entry in self.iterate_difference_entries_streaming():
+				entry_count += 1
+				yield entry
+		finally:
+			
+			self.__stats.end_phase()
+			
+			if self.__content_verifier is not None:
+				self.close_content_verifier()
+			
+			self.__stats.set("entries_found", entry_count)
+			self.__stats.finish()
+			if self.__stats_json_path is not None:
+				self.write_stats_json()
+	
+	def run_profiled(self, function):
+		
+		profiler = None
+		if self.__profile_path is not None:
+			import cProfile
+			profiler = cProfile.Profile()
+			profiler.enable()
+		
+		# Stats are written even when a run fails, since that's when they're most wanted
+		try:
+			function()
+		finally:
+			
+			if profiler is not None:
+				profiler.disable()
+				profiler.dump_stats(self.__profile_path)
+				self.log("Wrote profile to: " + self.__profile_path + " (view with: python3 -m pstats " + self.__profile_path + ")")
+			
+			self.__stats.finish()
+			if self.__stats_json_path is not None:
+				self.write_stats_json()
+	
+	def run_phases(self):
+		
+		self.run_comparison_phases()
+		
+		# Already written (and cleaned) as they were found
+		if isinstance(self.__difference_entries, DifferenceRecordWriter):
+			self.run_phase("report", self.__difference_entries.finish)
+		elif self.__report_format == "text":
+			self.run_phase("report", self.print_report)
+		else:
+			self.run_phase("report", self.write_difference_records)
+	
+	def run_comparison_phases(self):
+		
+		if self.__load_result_path is not None:
+			self.run_phase("load", self.load_result)
+		else:
+			
+			try:
+				self.run_phase("compare", self.calculate_difference_entries)
+			finally:
+				# Every rsync and walker is done with them by now
+				self.close_ssh_pool()
+			self.__stats.set("entries_found", len(self.__difference_entries))
+			
+			if isinstance(self.__difference_entries, DifferenceRecordWriter):
+				return
+			
+			if self.__do_clean_difference_entries:
+				self.run_phase("clean", self.clean_difference_entries)
+				self.__stats.set("entries_after_cleaning", len(self.__difference_entries))
+		
+		if self.__save_result_path is not None:
+			self.run_phase("save", self.save_result)
+		
+		if self.__only_types is not None:
+			self.run_phase("filter", self.filter_difference_entries)
+		
+		if self.__since_result_path is not None:
+			self.run_phase("since", self.compare_with_previous_result)
+	
+	def run_phase(self, name, function):
+		
+		self.__stats.begin_phase(name)
+		try:
+			function()
+		finally:
+			self.__stats.end_phase()
+	
+	def write_stats_json(self):
+		
+		stats = self.__stats.to_dict()
+		stats["source"] = self.__source_path
+		stats["backup"] = self.__backup_path
+		stats["arguments"] = self.__arguments
+		
+		with open(self.__stats_json_path, "w") as f:
+			json.dump(stats, f, indent=2)
+		
+		self.log("Wrote stats to: " + self.__stats_json_path)
+	
+	def log(self, s, o=None):
+		
+		to_log = str(s)
+		if o is not None:
+			to_log += " " + str(o)
+		
+		self.__progress.log(to_log)
+	
+	# Command line style arguments, without the program name; defaults to the actual command line
+	def consume_arguments(self, arguments: list=None):
+		
+		if arguments is None:
+			arguments = sys.argv[1:]
+		self.__arguments = list(arguments)
+		
+		# Quiet has to apply before anything else gets logged
+		if "--quiet" in self.__arguments:
+			self.__progress.set_quiet(True)
+		
+		i = -1
+		while i + 1 < len(self.__arguments):
+			
+			i += 1
+			
+			arg = self.__arguments[i]
+			# print("I:", i, "; arg:", arg)
+			
+			if arg == "--source-path":
+				i, one_path = self.consume_argument_companion(i)
+				self.__source_path = os.path.abspath(one_path)
+				self.log("Found source path argument:", self.__source_path)
+			
+			elif arg == "--source-remote-host":
+				i, host = self.consume_argument_companion(i)
+				self.__source_ssh_host = host
+				self.log("Will use source remote host: " + str(self.__source_ssh_host))
+			
+			elif arg == "--source-remote-user":
+				i, user = self.consume_argument_companion(i)
+				self.__source_ssh_user = user
+				self.log("Will use source remote user: " + str(self.__source_ssh_user))
+			
+			elif arg == "--backup-path":
+				i, one_path = self.consume_argument_companion(i)
+				self.__backup_path = os.path.abspath(one_path)
+				self.log("Found backup destination path argument:", self.__backup_path)
+			
+			elif arg == "--backup-remote-host":
+				i, host = self.consume_argument_companion(i)
+				self.__backup_ssh_host = host
+				self.log("Will use backup remote host: " + str(self.__backup_ssh_host))
+			
+			elif arg == "--backup-remote-user":
+				i, user = self.consume_argument_companion(i)
+				self.__backup_ssh_user = user
+				self.log("Will use backup remote user: " + str(self.__backup_ssh_user))
+			
+			elif arg == "--ssh-key":
+				i, key = self.consume_argument_companion(i)
+				self.__ssh_key = key
+				self.log("Will use ssh key: " + str(self.__ssh_key))
+			
+			elif arg == "--no-ssh-multiplex":
+				self.__ssh_multiplex = False
+				self.log("Won't share ssh connections; every rsync and walker connects on its own")
+			
+			elif arg == "--ssh-control-dir":
+				i, control_dir = self.consume_argument_companion(i)
+				self.__ssh_control_dir = os.path.abspath(control_dir)
+				self.log("Will keep (and reuse) shared ssh connections' sockets in: " + str(self.__ssh_control_dir))
+			
+			elif arg == "--use-rsync" or arg == "--rsync":
+				self.__force_rsync = True
+				self.log("Forcing comparison with rsync tool")
+			
+			elif arg == "--rsync-jobs":
+				i, job_count = self.consume_argument_companion(i)
+				if not job_count.isdigit() or int(job_count) < 1:
+					raise UsageError("--rsync-jobs expects a positive number, not: " + str(job_count))
+				self.__rsync_jobs = int(job_count)
+				self.log("Will run up to " + str(self.__rsync_jobs) + " rsync processes at once")
+			
+			elif arg == "--rsync-timeout":
+				i, seconds = self.consume_argument_companion(i)
+				self.__rsync_timeout = self.parse_timeout_seconds(arg, seconds)
+				self.log("Will stop any rsync still running after " + format_timespan(self.__rsync_timeout))
+			
+			elif arg == "--rsync-idle-timeout":
+				i, seconds = self.consume_argument_companion(i)
+				self.__rsync_idle_timeout = self.parse_timeout_seconds(arg, seconds)
+				self.log("Will stop any rsync that goes quiet for " + format_timespan(self.__rsync_idle_timeout))
+			
+			elif arg == "--remote-manifest":
+				self.__remote_manifest = True
+				self.log("Will compare manifests from a walker on each side, instead of using rsync")
+			
+			elif arg == "--manifest-shell":
+				import shlex
+				i, shell_command = self.consume_argument_companion(i)
+				self.__manifest_shell = shlex.split(shell_command)
+				if not self.__manifest_shell:
+					raise UsageError("--manifest-shell expects a command")
+				self.log("Will run remote manifest walkers through: " + str(shell_command))
+			
+			elif arg == "--streaming":
+				self.__streaming = True
+				self.log("Will compare directly, one directory at a time")
+			
+			elif arg == "--batch":
+				i, config_path = self.consume_argument_companion(i)
+				self.__batch_config_path = os.path.abspath(config_path)
+				self.log("Will compare the pairs listed in: " + str(self.__batch_config_path))
+			
+			elif arg == "--batch-jobs":
+				i, job_count = self.consume_argument_companion(i)
+				if not job_count.isdigit() or int(job_count) < 1:
+					raise UsageError("--batch-jobs expects a positive number, not: " + str(job_count))
+				self.__batch_jobs = int(job_count)
+				self.log("Will compare up to " + str(self.__batch_jobs) + " pairs at a time")
+			
+			elif arg == "--watch":
+				self.__watch = True
+				self.log("Will keep watching the source for changes after the first comparison")
+			
+			elif arg == "--watch-socket":
+				i, socket_path = self.consume_argument_companion(i)
+				self.__watch_socket_path = os.path.abspath(socket_path)
+				self.log("Will serve the current report on: " + str(self.__watch_socket_path))
+			
+			elif arg == "--exclude":
+				i, pattern = self.consume_argument_companion(i)
+				self.__path_filter.add_rule(False, pattern)
+				self.log("Will exclude: " + str(pattern))
+			
+			elif arg == "--include":
+				i, pattern = self.consume_argument_companion(i)
+				self.__path_filter.add_rule(True, pattern)
+				self.log("Will include: " + str(pattern))
+			
+			elif arg == "--exclude-from":
+				i, rules_path = self.consume_argument_companion(i)
+				rule_count = self.__path_filter.add_rules_from_file(rules_path)
+				self.log("Will use " + str(rule_count) + " include/exclude rules from: " + str(rules_path))
+			
+			elif arg == "--walk-threads":
+				i, thread_count = self.consume_argument_companion(i)
+				if not thread_count.isdigit() or int(thread_count) < 1:
+					raise UsageError("--walk-threads expects a positive number, not: " + str(thread_count))
+				self.__walk_threads = int(thread_count)
+				self.log("Will walk directories with " + str(self.__walk_threads) + " threads")
+			
+			elif arg == "--quiet":
+				self.__progress.set_quiet(True)
+			
+			elif arg == "--progress-rate":
+				i, rate = self.consume_argument_companion(i)
+				try:
+					rate = float(rate)
+				except ValueError:
+					rate = 0
+				if rate <= 0:
+					raise UsageError("--progress-rate expects a positive number of updates per second")
+				self.__progress.set_updates_per_second(rate)
+				self.log("Will update progress at most " + str(rate) + " times per second")
+			
+			elif arg == "--index-dir":
+				i, index_dir = self.consume_argument_companion(i)
+				self.__index_dir = os.path.abspath(index_dir)
+				self.log("Will keep a manifest index in: " + str(self.__index_dir))
+			
+			elif arg == "--rebuild-index":
+				self.__rebuild_index = True
+				self.log("Will rebuild the manifest index from scratch")
+			
+			elif arg == "--verify-index":
+				self.__verify_index = True
+				self.log("Will verify the manifest index against a full walk")
+			
+			elif arg == "--verify-content":
+				self.__verify_content = True
+				self.log("Will verify the contents of files that otherwise match")
+			
+			elif arg == "--hash-processes":
+				i, process_count = self.consume_argument_companion(i)
+				if not process_count.isdigit() or int(process_count) < 1:
+					raise UsageError("--hash-processes expects a positive number, not: " + str(process_count))
+				self.__hash_processes = int(process_count)
+				self.log("Will hash file contents with " + str(self.__hash_processes) + " processes")
+			
+			elif arg == "--verify-sample":
+				self.__verify_sample = True
+				self.log("Will verify the contents of a sample of files that otherwise match")
+			
+			elif arg == "--sample-bytes":
+				i, size = self.consume_argument_companion(i)
+				self.__sample_bytes = self.parse_size(size)
+				self.log("Will read at most " + str(self.__sample_bytes) + " bytes when sampling contents")
+			
+			elif arg == "--sample-seconds":
+				i, seconds = self.consume_argument_companion(i)
+				try:
+					self.__sample_seconds = float(seconds)
+				except ValueError:
+					raise UsageError("--sample-seconds expects a number of seconds, not: " + str(seconds))
+				self.log("Will spend at most " + str(self.__sample_seconds) + " seconds sampling contents")
+			
+			elif arg == "--report-limit":
+				i, limit = self.consume_argument_companion(i)
+				if not limit.isdigit() or int(limit) < 1:
+					raise UsageError("--report-limit expects a positive number, not: " + str(limit))
+				self.__report_limit = int(limit)
+				self.log("Will print at most " + str(self.__report_limit) + " items per report section")
+			
+			elif arg == "--format":
+				i, report_format = self.consume_argument_companion(i)
+				if report_format not in ["text", "ndjson", "csv"]:
+					raise UsageError("--format expects one of text, ndjson or csv, not: " + str(report_format))
+				self.__report_format = report_format
+				self.log("Will write the report as: " + str(self.__report_format))
+			
+			elif arg == "--only-types":
+				i, type_names = self.consume_argument_companion(i)
+				self.__only_types = set()
+				for type_name in type_names.split(","):
+					type_name = type_name.strip()
+					if type_name not in DifferenceEntry.CONST_TYPE_NAMES:
+						raise UsageError(
+							"--only-types expects a comma separated list of: "
+							+ ", ".join(DifferenceEntry.CONST_TYPE_NAMES) + "; not: " + str(type_name)
+						)
+					self.__only_types.add(DifferenceEntry.CONST_TYPE_NAMES.index(type_name))
+				self.log("Will only report differences of type: " + str(type_names))
+			
+			elif arg == "--save-result":
+				i, result_path = self.consume_argument_companion(i)
+				self.__save_result_path = os.path.abspath(result_path)
+				self.log("Will save the result to: " + str(self.__save_result_path))
+			
+			elif arg == "--load-result":
+				i, result_path = self.consume_argument_companion(i)
+				self.__load_result_path = os.path.abspath(result_path)
+				self.log("Will report a saved result instead of comparing: " + str(self.__load_result_path))
+			
+			elif arg == "--since-result":
+				i, result_path = self.consume_argument_companion(i)
+				self.__since_result_path = os.path.abspath(result_path)
+				self.log("Will only report what changed since the result in: " + str(self.__since_result_path))
+			
+			elif arg == "--stats-json":
+				i, stats_json_path = self.consume_argument_companion(i)
+				self.__stats_json_path = os.path.abspath(stats_json_path)
+				self.log("Will write timing and counters for each phase to: " + str(self.__stats_json_path))
+			
+			elif arg == "--profile":
+				i, profile_path = self.consume_argument_companion(i)
+				self.__profile_path = os.path.abspath(profile_path)
+				self.log("Will write a cProfile profile to: " + str(self.__profile_path))
+			
+			elif arg == "--no-clean":
+				self.__do_clean_difference_entries = False
+				self.log("Won't clean Difference entries")
+			
+			else:
+				raise UsageError("Unsupported argument: " + arg)
+	
+	# Plain byte counts, or with a K/M/G/T suffix (powers of 1024)
+	@staticmethod
+	def parse_size(size):
+		
+		multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+		
+		match = SIZE_PATTERN.match(size)
+		if not match:
+			raise UsageError("Couldn't understand size: " + str(size))
+		
+		return int(float(match.group(1)) * multipliers.get(match.group(2).upper(), 1))
+	
+	def consume_argument_companion(self, arg_index):
+		
+		companion_index = arg_index + 1
+		if companion_index >= len(self.__arguments):
+			raise UsageError("Expected argument after " + str(self.__arguments[arg_index]))
+		
+		return_index = companion_index
+		
+		return return_index, self.__arguments[companion_index]
+	
+	@staticmethod
+	def parse_timeout_seconds(arg, seconds):
+		
+		try:
+			seconds = float(seconds)
+		except ValueError:
+			seconds = 0
+		if seconds <= 0:
+			raise UsageError(arg + " expects a positive number of seconds")
+		
+		return seconds
+	
+	# Called with each progress message, whether or not it's shown
+	def set_progress_callback(self, callback):
+		
+		self.__progress.set_callback(callback)
+	
+	# None when there's nothing to filter, so the walks can skip checking
+	def get_path_filter(self):
+		
+		if not self.__path_filter.has_rules():
+			return None
+		
+		return self.__path_filter
+	
+	def calculate_comparison_items(self):
+		
+		self.check_source_path()
+		self.check_backup_path()
+		
+		self.log("Consuming source path: " + str(self.__source_path))
+		self.log("Consuming backup path: " + str(self.__backup_path))
+		
+		# Walk both trees at the same time
+		self.__source_path_items, self.__backup_path_items = self.consume_dirs([self.__source_path, self.__backup_path])
+		
+		self.log("Done consuming source path items: " + str(len(self.__source_path_items)))
+		self.log("Done consuming backup path items: " + str(len(self.__backup_path_items)))
+	
+	def check_source_path(self):
+	
+		if self.__source_path is None:
+			raise UsageError("Please provide a source path")
+		if not os.path.isdir(self.__source_path):
+			raise UsageError("Source path isn't a valid directory")
+	
+	def should_use_rsync(self):
+		
+		if self.__force_rsync:
+			return True
+		
+		if self.__source_ssh_host or self.__source_ssh_user:
+			return True
+		
+		if self.__backup_ssh_host or self.__backup_ssh_user:
+			return True
+		
+		if self.__ssh_key:
+			return True
+		
+		return False
+	
+	def check_backup_path(self):
+		
+		if self.__backup_path is None:
+			raise UsageError("Please provide a backup destination path")
+		if not os.path.isdir(self.__backup_path):
+			raise UsageError("Backup destination path isn't a valid directory")
+	
+	def consume_dir(self, dir_path):
+		
+		return self.consume_dirs([dir_path])[0]
+	
+	def consume_dirs(self, dir_paths: list):
+		
+		#
+		indexes = self.open_manifest_indexes(dir_paths)
+		
+		#
+		walker = ParallelTreeWalker(self.__walk_threads, self.get_path_filter())
+		stores = walker.walk(
+			dir_paths,
+			lambda count: self.print_progress_message(lambda: "Consuming paths ... " + str(count)),
+			indexes
+		)
+		self.print_progress_message("Consuming paths ... " + str(sum(len(store) for store in stores)), True)
+		
+		self.__stats.count("paths_walked", walker.get_path_count())
+		self.__stats.count("stat_calls", walker.get_stat_count())
+		self.__stats.count("dirs_scanned", walker.get_scanned_dir_count())
+		self.__stats.count("dirs_reused_from_index", walker.get_reused_dir_count())
+		
+		if indexes is not None:
+			self.close_manifest_indexes(indexes)
+		
+		return stores
+	
+	def open_manifest_indexes(self, dir_paths: list):
+		
+		if self.__index_dir is None:
+			if self.__rebuild_index or self.__verify_index:
+				raise UsageError("--rebuild-index and --verify-index need an --index-dir")
+			return None
+		
+		os.makedirs(self.__index_dir, exist_ok=True)
+		
+		indexes = []
+		for dir_path in dir_paths:
+			
+			index = ManifestIndex(self.__index_dir, dir_path)
+			index.open()
+			
+			if self.__rebuild_index:
+				index.clear()
+			index.load(self.__verify_index)
+			
+			self.log(
+				"Loaded manifest index for " + dir_path + ": "
+				+ str(index.get_loaded_dir_count()) + " directories"
+			)
+			
+			indexes.append(index)
+		
+		return indexes
+	
+	def close_manifest_indexes(self, indexes: list):
+		
+		for index in indexes:
+			
+			self.log(
+				"Manifest index for " + index.get_root_path() + ": "
+				+ str(index.get_reused_dir_count()) + " directories reused, "
+				+ str(index.get_scanned_dir_count()) + " rescanned"
+			)
+			if self.__verify_index:
+				self.log(
+					"Manifest index verification for " + index.get_root_path() + ": "
+					+ str(index.get_stale_dir_count()) + " directories had stale entries despite an unchanged mtime"
+				)
+			
+			index.save()
+			index.close()
+	
+	@staticmethod
+	def stat_path(path):
+		
+		# Follows symlinks, so a dangling link looks missing (None)
+		try:
+			return os.stat(path)
+		except (FileNotFoundError, NotADirectoryError):
+			return None
+	
+	@staticmethod
+	def stat_dir_entry(dir_entry):
+		
+		# Same as stat_path, but reuses whatever the directory scan already cached
+		try:
+			return dir_entry.stat()
+		except (FileNotFoundError, NotADirectoryError):
+			return None
+	
+	@staticmethod
+	def dir_entry_is_real_dir(dir_entry):
+		
+		try:
+			return dir_entry.is_dir(follow_symlinks=False)
+		except OSError:
+			return False
+	
+	def calculate_difference_entries(self):
+	
+		if self.__remote_manifest and not self.__force_rsync:
+			if self.__verify_content:
+				self.log("Content verification doesn't apply to manifest comparisons; ignoring --verify-content")
+			self.calculate_difference_entries_with_manifests()
+			return
+		
+		if self.should_use_rsync():
+			if self.__verify_content:
+				self.log("Content verification doesn't apply to rsync comparisons; ignoring --verify-content")
+			self.calculate_difference_entries_with_rsync()
+			return
+		
+		if self.__verify_content:
+			self.open_content_verifier()
+		elif self.__verify_sample:
+			if self.__streaming:
+				self.log("Sampled content verification needs the direct comparison; ignoring --verify-sample")
+			else:
+				self.__sample_candidates = []
+		
+		try:
+			if self.__streaming:
+				self.calculate_difference_entries_streaming()
+			else:
+				self.calculate_difference_entries_directly()
+		finally:
+			if self.__content_verifier is not None:
+				self.close_content_verifier()
+	
+	# Where a comparison collects its entries: a list for the text report, or a writer that
+	# writes records as they're found. Cleaning as they're found needs entries to arrive
+	# parents first; otherwise they're collected, cleaned, and written at the end.
+	def new_difference_entries(self, parents_first: bool):
+		
+		if self.__report_format == "text" or self.__collect_entries:
+			return []
+		
+		if self.__do_clean_difference_entries and not parents_first:
+			return []
+		
+		# Results are saved, filtered or compared as a whole
+		if self.__save_result_path is not None \
+			or self.__only_types is not None \
+			or self.__since_result_path is not None:
+			return []
+		
+		return DifferenceRecordWriter(self.__report_format, clean=self.__do_clean_difference_entries)
+	
+	def open_content_verifier(self):
+		
+		# Hashes are only remembered between runs when there's an index directory to keep them in
+		cache_path = None
+		if self.__index_dir is not None:
+			os.makedirs(self.__index_dir, exist_ok=True)
+			cache_path = os.path.join(self.__index_dir, "content-hashes.sqlite3")
+		
+		self.__content_verifier = ContentVerifier(
+			self.__source_path, self.__backup_path, self.__hash_processes, cache_path
+		)
+		self.__content_verifier.open()
+	
+	def close_content_verifier(self):
+		
+		verifier = self.__content_verifier
+		self.__content_verifier = None
+		
+		verifier.close()
+		
+		self.__stats.count("files_content_verified", verifier.get_verified_count())
+		self.__stats.count("files_hashed", verifier.get_hashed_count())
+		
+		self.log(
+			"Verified contents of " + str(verifier.get_verified_count()) + " files ("
+			+ str(verifier.get_hashed_count()) + " hashed, "
+			+ str(verifier.get_cached_count()) + " from cache); "
+			+ str(verifier.get_mismatch_count()) + " mismatched"
+		)
+	
+	def calculate_difference_entries_with_rsync(self):
+		
+		entries = self.new_difference_entries(False)
+		
+		#
+		self.log("Calculating difference entries ...")
+		
+		if self.__rsync_jobs > 1:
+			stdout_lines = self.execute_rsync_sharded()
+		else:
+			stdout_lines = self.execute_rsync()
+		
+		# Entries are parsed as rsync produces each line
+		for entry in self.iterate_rsync_difference_entries(stdout_lines):
+			entries.append(entry)
+			self.print_progress_message(
+				lambda: "Parsed " + str(len(entries)) + " difference entries from Rsync"
+			)
+		self.print_progress_message("Parsed " + str(len(entries)) + " difference entries from Rsync", True)
+		
+		self.log("Finished calculating difference entries")
+		
+		self.__difference_entries = entries
+	
+	def iterate_rsync_difference_entries(self, stdout_lines):
+		
+		# Iterate over each stdout line
+		line_count = 0
+		for line in stdout_lines:
+			
+			line_count += 1
+			
+			# Try to match regular expressions
+			match_regular = RSYNC_ITEMIZED_PATTERN.match(line)
+			match_message = RSYNC_MESSAGE_PATTERN.match(line)
+			
+			# Regular line (Flags and Path)
+			if match_regular:
+				
+				flags = match_regular.group("flags")
+				change_type_character = flags[0]
+				item_type = flags[1]
+				
+				# Determine which attributes are different
+				attributes_part = flags[2:]
+				different_checksum = "c" in attributes_part
+				different_size = "s" in attributes_part
+				different_modification_time = "t" in attributes_part
+				different_permissions = "p" in attributes_part
+				different_owner = "o" in attributes_part
+				different_group = "g" in attributes_part
+				different_acl = "a" in attributes_part
+				different_extended_attributes = "x" in attributes_part
+				#
+				different_any_attribute = (
+					different_checksum
+					or different_size
+					or different_modification_time
+					or different_permissions
+					or different_owner
+					or different_group
+					or different_acl
+					or different_extended_attributes
+				)
+				
+				item = match_regular.group("item").strip()
+				
+				entry = DifferenceEntry(item)
+				
+				# File folder, whatever
+				if item_type == "d":
+					entry.set_is_dir()
+				elif item_type == "f":
+					entry.set_is_file()
+				
+				# Different attributes
+				# (before 'missing' stuff, because attribute syncs show up as xfers)
+				if different_checksum:
+					entry.set_is_different_checksum()
+				elif different_size:
+					entry.set_is_different_sizes()
+				elif different_modification_time:
+					entry.set_is_different_modification_times()
+				elif different_permissions:
+					entry.set_is_different_permissions()
+				elif different_owner:
+					entry.set_is_different_owner()
+				elif different_group:
+					entry.set_is_different_group()
+				elif different_acl:
+					entry.set_is_different_acl()
+				elif different_extended_attributes:
+					entry.set_is_different_extended_attributes()
+				elif different_any_attribute:
+					entry.set_is_different_attributes()
+				
+				# Missing from backup
+				elif change_type_character == "<":
+					entry.set_is_missing_from_backup()
+				# Missing from ... backup? (confusing symbolstuffs)
+				elif change_type_character == ">":
+					entry.set_is_missing_from_backup()
+				
+				# Local change is occurring
+				elif change_type_character == "c":
+					entry.set_is_missing_from_backup()
+				
+				# Item is a hard link
+				elif change_type_character == "h":
+					entry.set_is_unknown("Rsync says this is a hard link")
+				
+				# "no change / transfer (could still be changing attributes)"
+				elif change_type_character == ".":
+					entry.set_is_unknown("Rsync says no change, but could be changing attributes")
+				
+				#
+				yield entry
+			
+			# Message line
+			elif match_message:
+			
+				message = match_message.group("message").strip()
+				item = match_message.group("item").strip()
+				
+				entry = DifferenceEntry(item)
+				
+				if message == "deleting":
+					entry.set_is_missing_from_source()
+					entry.set_is_dir(item[-1] == "/")
+					entry.set_is_file(not item[-1] == "/")
+				
+				else:
+					self.log("IS UNKNOWN MESSAGE:" + message)
+					entry.set_is_unknown("Unhandled message: " + message)
+				
+				yield entry
+			
+			# Unsupported type of line
+			else:
+				
+				#
+				self.log("Don't know how to parse this line: " + line)
+		
+		self.__stats.count("rsync_lines_parsed", line_count)
+	
+	# Splits the comparison by top level directory, and runs the shards' rsyncs concurrently.
+	# Lines from all shards are handed over as they arrive, in no particular order.
+	def execute_rsync_sharded(self):
+		
+		shards = self.make_rsync_shards()
+		
+		self.log(
+			"Executing rsync in " + str(len(shards)) + " shards, "
+			+ str(self.__rsync_jobs) + " at a time"
+		)
+		
+		commands = [self.make_rsync_command(filter_args) for filter_args in shards]
+		
+		# Every shard's rsync itemizes the root directory itself; only pass that along once
+		root_lines = set()
+		
+		for line in self.make_rsync_runner().iterate_lines(commands):
+			if line.endswith(" ./"):
+				if line in root_lines:
+					continue
+				root_lines.add(line)
+			yield line
+		
+		self.log("All rsync shards have finished executing")
+	
+	def make_rsync_shards(self):
+		
+		source_items = self.list_top_level_items(self.__source_ssh_host, self.__source_ssh_user, self.__source_path)
+		backup_items = self.list_top_level_items(self.__backup_ssh_host, self.__backup_ssh_user, self.__backup_path)
+		
+		names = sorted(source_items.keys() | backup_items.keys())
+		
+		# Names the include/exclude rules leave out are excluded by every shard anyway
+		path_filter = self.get_path_filter()
+		if path_filter is not None:
+			names = [
+				name for name in names
+				if not path_filter.is_excluded(name, bool(source_items.get(name) or backup_items.get(name)))
+			]
+		
+		# A name that's a directory on either side goes in a directory shard,
+		# so a file replacing a directory (or the reverse) stays within one rsync
+		dir_names = [name for name in names if source_items.get(name) or backup_items.get(name)]
+		
+		# The root itself and everything at its top level that isn't a directory goes in the first shard
+		shard_names = [set(names) - set(dir_names)]
+		
+		# More shards than jobs, so one large directory doesn't hold up the rest
+		shard_count = min(len(dir_names), self.__rsync_jobs * 4)
+		for shard_index in range(shard_count):
+			shard_names.append(set(dir_names[shard_index::shard_count]))
+		
+		# Each shard excludes every top level name it doesn't own, ahead of the user's
+		# own rules, so an --include can't pull another shard's items in.
+		# Excluded items aren't deleted, so other shards' items are left alone.
+		shards = []
+		for owned_names in shard_names:
+			shards.append([
+				"--exclude=/" + self.escape_rsync_pattern(name, False)
+				for name in names if name not in owned_names
+			])
+		
+		return shards
+	
+	# Returns top level name -> whether it's a directory (not following symlinks)
+	def list_top_level_items(self, ssh_host, ssh_user, path):
+		
+		import subprocess
+		
+		items = dict()
+		
+		if not ssh_host:
+			try:
+				with os.scandir(path) as scanner:
+					for dir_entry in scanner:
+						items[dir_entry.name] = self.dir_entry_is_real_dir(dir_entry)
+			except FileNotFoundError:
+				pass
+			return items
+		
+		args = ["rsync", "--list-only", "--dirs"]
+		rsh_command = self.make_rsync_rsh_argument(ssh_host, ssh_user)
+		if rsh_command:
+			args.append(rsh_command)
+		args.append(self.make_rsync_path(ssh_host, ssh_user, path))
+		
+		try:
+			result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=self.__rsync_timeout)
+		except subprocess.TimeoutExpired:
+			raise BackupDiffError(
+				"Failed to list " + str(path) + " with Rsync; Still running after " + format_timespan(self.__rsync_timeout)
+			)
+		if result.returncode != 0:
+			for line in result.stderr.decode().splitlines()[-20:]:
+				self.log("Rsync stderr: " + line)
+			raise BackupDiffError("Failed to list " + str(path) + " with Rsync; Exited with code " + str(result.returncode))
+		
+		for line in result.stdout.decode("utf-8", "surrogateescape").splitlines():
+			match = RSYNC_LISTING_PATTERN.match(line)
+			if not match:
+				continue
+			name = match.group("name")
+			if name == ".":
+				continue
+			item_type = match.group("permissions")[0]
+			if item_type == "l":
+				name = name.split(" -> ", 1)[0]
+			items[name] = item_type == "d"
+		
+		return items
+	
+	# Rsync only treats backslashes as escapes in patterns that have wildcards
+	@staticmethod
+	def escape_rsync_pattern(name, has_wildcards: bool):
+		
+		if not has_wildcards and not RSYNC_WILDCARD_PATTERN.search(name):
+			return name
+		
+		return RSYNC_ESCAPED_PATTERN.sub(r"\\\1", name)
+	
+	def execute_rsync(self):
+		
+		self.log("Executing rsync")
+		
+		for line in self.make_rsync_runner().iterate_lines([self.make_rsync_command()]):
+			yield line
+		
+		self.log("Rsync has finished executing")
+	
+	def make_rsync_runner(self):
+		
+		return RsyncRunner(self.__rsync_jobs, self.__rsync_timeout, self.__rsync_idle_timeout, self.log)
+	
+	def make_rsync_command(self, filter_args: list=None):
+		
+		#
+		args = list()
+		
+		# Rsync
+		args.append("rsync")
+		
+		# Dry run!!
+		args.append("--dry-run")
+		
+		# Produces the main output we'll parse
+		args.append("--itemize-changes")
+		
+		# Rsh command (rsync can't have both sides remote, so there's at most one host)
+		if self.__source_ssh_host:
+			rsh_command = self.make_rsync_rsh_argument(self.__source_ssh_host, self.__source_ssh_user)
+		else:
+			rsh_command = self.make_rsync_rsh_argument(self.__backup_ssh_host, self.__backup_ssh_user)
+		if rsh_command:
+			args.append(rsh_command)
+		
+		# Main sync flags
+		args.append("--archive")
+		args.append("--delete")
+		
+		# Limits this rsync to a shard of the tree
+		if filter_args:
+			args.extend(filter_args)
+		
+		# Same include/exclude rules as the other comparisons, in the same order
+		args.extend(self.__path_filter.make_rsync_arguments())
+		
+		# Source path
+		args.append(self.make_rsync_path(self.__source_ssh_host, self.__source_ssh_user, self.__source_path))
+		
+		# Backup path
+		args.append(self.make_rsync_path(self.__backup_ssh_host, self.__backup_ssh_user, self.__backup_path))
+		
+		# self.log("Executing rsync with the following arguments:")
+		# self.log(str(args))
+		# self.log(" ".join(args))
+		
+		return args
+	
+	@staticmethod
+	def drain_stream_lines(stream, lines: list):
+		
+		for line in iter(stream.readline, b''):
+			lines.append(line.decode().strip())
+	
+	@staticmethod
+	def make_rsync_path(ssh_host, ssh_user, path):
+		
+		rsync_path = ""
+		
+		if (not ssh_host) and ssh_user:
+			raise UsageError("ssh_user provided (" + str(ssh_user) + ") without ssh_host")
+		
+		if ssh_user:
+			rsync_path += ssh_user + "@"
+		
+		if ssh_host:
+			rsync_path += ssh_host + ":" + path
+		else:
+			rsync_path += path
+		
+		# Absolute path doesn't have trailing slash, which works well for rsync here
+		rsync_path += "/"
+		
+		return rsync_path
+	
+	def make_rsync_rsh_argument(self, ssh_host, ssh_user):
+		
+		import shlex
+		
+		ssh_args = []
+		
+		if self.__ssh_key:
+			if not os.path.isfile(self.__ssh_key):
+				raise UsageError("SSH key does not exist: " + str(self.__ssh_key))
+			ssh_args.extend(["-i", self.__ssh_key])
+		
+		control_path = self.get_ssh_control_path(ssh_host, ssh_user)
+		if control_path:
+			ssh_args.extend(SshConnectionPool.make_client_args(control_path))
+		
+		if not ssh_args:
+			return None
+		
+		return "--rsh=" + " ".join(shlex.quote(arg) for arg in ["ssh"] + ssh_args)
+	
+	# The shared connection's socket for this host, set up the first time it's needed;
+	# None when sharing is off, the side is local, or the shared connection couldn't be set up
+	def get_ssh_control_path(self, ssh_host, ssh_user):
+		
+		if not ssh_host or not self.__ssh_multiplex:
+			return None
+		
+		if self.__ssh_pool is None:
+			self.__ssh_pool = SshConnectionPool(self.__ssh_control_dir, self.log)
+		
+		return self.__ssh_pool.get_control_path(ssh_host, ssh_user, self.__ssh_key)
+	
+	def close_ssh_pool(self):
+		
+		if self.__ssh_pool is None:
+			return
+		
+		pool = self.__ssh_pool
+		self.__ssh_pool = None
+		
+		pool.close()
+	
+	def calculate_difference_entries_with_manifests(self):
+		
+		if self.__source_path is None:
+			raise UsageError("Please provide a source path")
+		if self.__backup_path is None:
+			raise UsageError("Please provide a backup path")
+		
+		source_manifest = RemoteManifest(
+			self.make_manifest_transport(self.__source_ssh_host, self.__source_ssh_user), self.__source_path,
+			self.get_path_filter()
+		)
+		backup_manifest = RemoteManifest(
+			self.make_manifest_transport(self.__backup_ssh_host, self.__backup_ssh_user), self.__backup_path,
+			self.get_path_filter()
+		)
+		
+		self.log("Comparing manifests of source and backup")
+		
+		entries = self.new_difference_entries(True)
+		item_count = 0
+		
+		# Both walkers run at the same time; each is read as the merge needs it
+		source_manifest.open()
+		try:
+			backup_manifest.open()
+			try:
+				for item, source_stat, backup_stat in self.merge_join_manifests(
+					source_manifest.iterate(), backup_manifest.iterate()
+				):
+					item_count += 1
+					entry = self.calculate_difference_entry_from_stats(item, source_stat, backup_stat)
+					if entry:
+						entries.append(entry)
+					self.print_progress_message(
+						lambda: "Compared " + str(item_count) + " manifest items; "
+						+ str(len(entries)) + " differences"
+					)
+			finally:
+				backup_manifest.close()
+		finally:
+			source_manifest.close()
+		
+		self.__stats.count("paths_walked", item_count)
+		
+		self.log("Done comparing " + str(item_count) + " manifest items: " + str(len(entries)) + " differences")
+		
+		self.__difference_entries = entries
+	
+	def make_manifest_transport(self, ssh_host, ssh_user):
+		
+		if (not ssh_host) and ssh_user:
+			raise UsageError("ssh_user provided (" + str(ssh_user) + ") without ssh_host")
+		
+		if not ssh_host:
+			return LocalTransport()
+		
+		if self.__manifest_shell:
+			return ShellTransport(self.__manifest_shell)
+		
+		return SshTransport(ssh_host, ssh_user, self.__ssh_key, self.get_ssh_control_path(ssh_host, ssh_user))
+	
+	# Both manifests come in the walker's order (depth first, siblings sorted by name),
+	# which sorts the same as the path's components; a side missing an item gets None
+	@staticmethod
+	def merge_join_manifests(source_records, backup_records):
+		
+		def next_record(records):
+			record = next(records, None)
+			if record is None:
+				return None
+			path, path_stat = record
+			return tuple(path.split("/")) if path else (), path, path_stat
+		
+		source_record = next_record(source_records)
+		backup_record = next_record(backup_records)
+		while source_record is not None or backup_record is not None:
+			
+			if backup_record is None or (source_record is not None and source_record[0] < backup_record[0]):
+				yield source_record[1], source_record[2], None
+				source_record = next_record(source_records)
+			
+			elif source_record is None or backup_record[0] < source_record[0]:
+				yield backup_record[1], None, backup_record[2]
+				backup_record = next_record(backup_records)
+			
+			else:
+				yield source_record[1], source_record[2], backup_record[2]
+				source_record = next_record(source_records)
+				backup_record = next_record(backup_records)
+	
+	def calculate_difference_entries_directly(self):
+		
+		self.run_phase("walk", self.calculate_comparison_items)
+		
+		entries = self.new_difference_entries(False)
+		
+		source_items = self.__source_path_items
+		backup_items = self.__backup_path_items
+		
+		# The roots themselves
+		self.compare_item_stats("", source_items.get_root_stat(), backup_items.get_root_stat(), entries)
+		
+		# Pair each source directory with the backup directory at the same path, if there is one.
+		# Parents have lower ids than their children, so a directory's parent is always paired first.
+		# Where the other side has a symlinked directory instead (which the walk doesn't descend into),
+		# that side is "followed": it only stats the items this side has, like the streaming comparison.
+		backup_dir_ids = [None] * source_items.get_dir_count()
+		backup_dir_followed = bytearray(source_items.get_dir_count())
+		source_dir_ids = [None] * backup_items.get_dir_count()
+		source_dir_followed = bytearray(backup_items.get_dir_count())
+		followed_stat_count = 0
+		for source_dir_id in range(source_items.get_dir_count()):
+			
+			self.print_progress_message(
+				lambda: "Looking for differences from source to backup ... directory "
+				+ str(source_dir_id + 1) + " of " + str(source_items.get_dir_count()),
+				source_dir_id + 1 == source_items.get_dir_count()
+			)
+			
+			rel_dir = source_items.make_path(source_dir_id)
+			
+			backup_dir_id = 0
+			if source_dir_id > 0:
+				source_parent_id = source_items.get_parent_id(source_dir_id)
+				backup_parent_id = backup_dir_ids[source_parent_id]
+				backup_dir_id = None
+				backup_dir_stat = None
+				if backup_parent_id is not None:
+					backup_dir_id = backup_items.find_dir(backup_parent_id, source_items.get_name(source_dir_id))
+					backup_dir_stat = backup_items.get_children(backup_parent_id).get(source_items.get_name(source_dir_id))
+				elif backup_dir_followed[source_parent_id]:
+					backup_dir_stat = self.stat_path(os.path.join(self.__backup_path, rel_dir))
+					followed_stat_count += 1
+				if backup_dir_id is None and backup_dir_stat is not None and stat.S_ISDIR(backup_dir_stat.st_mode):
+					backup_dir_followed[source_dir_id] = 1
+			backup_dir_ids[source_dir_id] = backup_dir_id
+			
+			source_children = source_items.get_children(source_dir_id)
+			backup_children = dict()
+			if backup_dir_id is not None:
+				source_dir_ids[backup_dir_id] = source_dir_id
+				backup_children = backup_items.get_children(backup_dir_id)
+			
+			for name, source_stat in source_children.items():
+				item = os.path.join(rel_dir, name) if rel_dir else name
+				if backup_dir_followed[source_dir_id]:
+					backup_stat = self.stat_path(os.path.join(self.__backup_path, item))
+					followed_stat_count += 1
+				else:
+					backup_stat = backup_children.get(name)
+				self.compare_item_stats(item, source_stat, backup_stat, entries)
+			
+			# Only things in the backup directory that weren't in the source directory
+			for name in backup_children.keys() - source_children.keys():
+				self.compare_item_stats(
+					os.path.join(rel_dir, name) if rel_dir else name,
+					None, backup_children[name], entries
+				)
+		
+		# Backup directories with no source directory at the same path; everything in them
+		# is missing from the source, unless the source has a symlinked directory there
+		for backup_dir_id in range(backup_items.get_dir_count()):
+			
+			self.print_progress_message(
+				lambda: "Looking for differences from backup to source ... directory "
+				+ str(backup_dir_id + 1) + " of " + str(backup_items.get_dir_count()),
+				backup_dir_id + 1 == backup_items.get_dir_count()
+			)
+			
+			if source_dir_ids[backup_dir_id] is not None:
+				continue
+			
+			rel_dir = backup_items.make_path(backup_dir_id)
+			
+			# The root is always paired, so there's a parent
+			backup_parent_id = backup_items.get_parent_id(backup_dir_id)
+			source_parent_id = source_dir_ids[backup_parent_id]
+			source_dir_stat = None
+			if source_parent_id is not None:
+				source_dir_stat = source_items.get_children(source_parent_id).get(backup_items.get_name(backup_dir_id))
+			elif source_dir_followed[backup_parent_id]:
+				source_dir_stat = self.stat_path(os.path.join(self.__source_path, rel_dir))
+				followed_stat_count += 1
+			if source_dir_stat is not None and stat.S_ISDIR(source_dir_stat.st_mode):
+				source_dir_followed[backup_dir_id] = 1
+			
+			for name, backup_stat in backup_items.get_children(backup_dir_id).items():
+				item = os.path.join(rel_dir, name) if rel_dir else name
+				source_stat = None
+				if source_dir_followed[backup_dir_id]:
+					source_stat = self.stat_path(os.path.join(self.__source_path, item))
+					followed_stat_count += 1
+				self.compare_item_stats(item, source_stat, backup_stat, entries)
+		
+		self.__stats.count("stat_calls", followed_stat_count)
+		
+		if self.__content_verifier is not None:
+			entries.extend(self.__content_verifier.finish())
+		
+		if self.__sample_candidates is not None:
+			entries.extend(self.verify_content_sample(self.__sample_candidates))
+			self.__sample_candidates = None
+		
+		self.__difference_entries = entries
+	
+	# Compare one walked item, queueing it for content checks if its stats match
+	def compare_item_stats(self, item, source_stat, backup_stat, entries):
+		
+		entry = self.calculate_difference_entry_from_stats(item, source_stat, backup_stat)
+		if entry:
+			entries.append(entry)
+		elif self.__content_verifier is not None:
+			entries.extend(self.__content_verifier.add(item, source_stat, backup_stat))
+		elif self.__sample_candidates is not None \
+			and stat.S_ISREG(source_stat.st_mode) and stat.S_ISREG(backup_stat.st_mode):
+			self.__sample_candidates.append((item, source_stat, backup_stat))
+	
+	# Hash a sample of files that otherwise match, within the byte and time budgets,
+	# rotating through files across runs (when there's an index directory to remember them in)
+	def verify_content_sample(self, candidates: list):
+		
+		history_path = None
+		if self.__index_dir is not None:
+			os.makedirs(self.__index_dir, exist_ok=True)
+			history_path = os.path.join(self.__index_dir, "content-hashes.sqlite3")
+		else:
+			self.log("No --index-dir to remember sampled files in; the sample won't rotate between runs")
+		
+		byte_budget = self.__sample_bytes
+		if byte_budget is None and self.__sample_seconds is None:
+			byte_budget = 1024 ** 3
+		
+		sampler = ContentSampler(self.__source_path, self.__backup_path, history_path, byte_budget)
+		sampler.open()
+		
+		selected = sampler.select(candidates)
+		self.log(
+			"Sampling contents of " + str(len(selected)) + " of " + str(len(candidates)) + " matching files"
+			+ " (" + str(sampler.get_never_verified_count()) + " never verified before)"
+		)
+		
+		deadline = None
+		if self.__sample_seconds is not None:
+			deadline = time.monotonic() + self.__sample_seconds
+		
+		# Rot shows up without any metadata change, so cached digests can't be trusted here
+		verifier = ContentVerifier(
+			self.__source_path, self.__backup_path, self.__hash_processes, history_path,
+			max(16, self.__hash_processes * 4), False, deadline, True
+		)
+		verifier.open()
+		
+		entries = []
+		added_count = 0
+		for item, source_stat, backup_stat in selected:
+			
+			if deadline is not None and time.monotonic() >= deadline:
+				break
+			
+			entries.extend(verifier.add(item, source_stat, backup_stat))
+			added_count += 1
+			
+			self.print_progress_message(
+				lambda: "Sampling contents ... " + str(added_count) + " of " + str(len(selected))
+			)
+		
+		entries.extend(verifier.finish())
+		verifier.close()
+		
+		verified_items = verifier.get_verified_items()
+		if len(verified_items) < len(selected):
+			self.log("Ran out of time for sampling contents")
+		
+		sampler.record_verified(verified_items)
+		sampler.close()
+		
+		estimate = sampler.estimate(
+			verified_items, [entry.get_item() for entry in entries if entry.get_is_different_contents()]
+		)
+		
+		self.__sample_summary = self.make_sample_summary(
+			len(candidates), verifier.get_verified_count(), verifier.get_mismatch_count(), verifier.get_verified_bytes(),
+			sampler.get_never_verified_count() - sampler.get_newly_verified_count(),
+			sampler.get_oversized_count(), estimate
+		)
+		
+		return entries
+	
+	# The estimate is from ContentSampler.estimate(), or None
+	@staticmethod
+	def make_sample_summary(
+		candidate_count, sample_count, mismatch_count, sample_bytes, never_verified_count, oversized_count,
+		estimate=None
+	):
+		
+		summary = []
+		
+		summary.append(
+			"Verified " + str(sample_count) + " of " + str(candidate_count) + " matching files"
+			+ " (" + format_size(sample_bytes) + " read)"
+		)
+		summary.append("Content mismatches found: " + str(mismatch_count))
+		
+		if estimate is not None:
+			
+			population_count, rate, upper_count, uncovered_count = estimate
+			summary.append(
+				"Estimated corruption rate: " + BackupDiff.format_percentage(rate)
+				+ " of the " + str(population_count) + " files the sample was drawn from"
+				+ " (95% confidence it's below " + BackupDiff.format_percentage(upper_count / population_count)
+				+ ", or " + str(upper_count) + " files)"
+			)
+			if uncovered_count:
+				summary.append(
+					"Files the estimate doesn't cover, since they were verified more recently than anything sampled: "
+					+ str(uncovered_count)
+				)
+		
+		summary.append("Files never verified yet: " + str(never_verified_count))
+		if oversized_count:
+			summary.append("Files too large to ever fit in the sample budget: " + str(oversized_count))
+		
+		return summary
+	
+	# Upper end of the Wilson score interval, at 95% confidence
+	@staticmethod
+	def wilson_upper_bound(failure_count, sample_count):
+		
+		z = 1.96
+		rate = failure_count / sample_count
+		
+		denominator = 1 + z * z / sample_count
+		center = rate + z * z / (2 * sample_count)
+		margin = z * math.sqrt(rate * (1 - rate) / sample_count + z * z / (4 * sample_count * sample_count))
+		
+		return min(1.0, (center + margin) / denominator)
+	
+	@staticmethod
+	def format_percentage(fraction):
+		
+		return "{:.4g}%".format(fraction * 100)
+	
+	def calculate_difference_entries_streaming(self):
+		
+		self.check_source_path()
+		self.check_backup_path()
+		
+		self.log("Streaming differences between source and backup")
+		
+		entries = self.new_difference_entries(True)
+		
+		for entry in self.iterate_difference_entries_streaming():
+			
+			entries.append(entry)
+			
+			self.print_progress_message(
+				lambda: "Streaming differences ... " + str(len(entries)) + " found"
+			)
+		
+		self.log("Done streaming differences: " + str(len(entries)))
+		
+		self.__difference_entries = entries
+	
+	# Walk both trees in sorted lockstep, one directory at a time, and yield
+	# a DifferenceEntry for each differing item as soon as it's found.
+	# Memory use depends on how wide directories are, not on the tree size.
+	# Starts from the roots, or from any item under them (the item included).
+	def iterate_difference_entries_streaming(self, rel_root=""):
+		
+		path_filter = self.get_path_filter()
+		
+		# How each side of a directory is read:
+		# "scan" lists it, "stat" only stats items the other side lists
+		# (symlinked directory, like the direct walk), "absent" has nothing in it
+		if not rel_root:
+			
+			# The roots themselves, same as the direct comparison
+			entry = self.calculate_difference_entry("")
+			if entry:
+				yield entry
+			
+			dirs_to_merge = [("", "scan", "scan")]
+		
+		else:
+			
+			# Nothing to compare, not even a dangling link
+			if not self.item_exists(rel_root):
+				return
+			
+			source_stat, source_is_real_dir = self.stat_item(self.__source_path, rel_root)
+			backup_stat, backup_is_real_dir = self.stat_item(self.__backup_path, rel_root)
+			
+			if path_filter is not None and path_filter.is_excluded(rel_root, source_is_real_dir or backup_is_real_dir):
+				return
+			
+			entry = self.calculate_difference_entry_from_stats(rel_root, source_stat, backup_stat)
+			if entry:
+				yield entry
+				if self.__do_clean_difference_entries \
+					and (entry.get_is_missing_from_source() or entry.get_is_missing_from_backup()):
+					return
+			
+			dirs_to_merge = []
+			if source_is_real_dir or backup_is_real_dir:
+				dirs_to_merge.append((
+					rel_root,
+					self.child_side_mode("scan", source_stat, source_is_real_dir),
+					self.child_side_mode("scan", backup_stat, backup_is_real_dir)
+				))
+		
+		while len(dirs_to_merge):
+			
+			rel_dir, source_mode, backup_mode = dirs_to_merge.pop()
+			
+			source_children = self.scan_dir_sorted(self.__source_path, rel_dir, source_mode, path_filter)
+			backup_children = self.scan_dir_sorted(self.__backup_path, rel_dir, backup_mode, path_filter)
+			
+			# Counted once per directory, to keep the lock out of the loop
+			item_count = 0
+			stat_count = len(source_children) + len(backup_children)
+			
+			subdirs = []
+			for name, source_child, backup_child in self.merge_join_children(source_children, backup_children):
+				
+				item = os.path.join(rel_dir, name) if rel_dir else name
+				item_count += 1
+				
+				if source_child is None:
+					source_child = self.stat_child(self.__source_path, item, source_mode)
+					stat_count += source_mode == "stat"
+				if backup_child is None:
+					backup_child = self.stat_child(self.__backup_path, item, backup_mode)
+					stat_count += backup_mode == "stat"
+				
+				source_stat, source_is_real_dir = source_child
+				backup_stat, backup_is_real_dir = backup_child
+				
+				entry = self.calculate_difference_entry_from_stats(item, source_stat, backup_stat)
+				if entry:
+					yield entry
+					# Cleaning would remove everything under a missing directory anyway
+					if self.__do_clean_difference_entries \
+						and (entry.get_is_missing_from_source() or entry.get_is_missing_from_backup()):
+						continue
+				elif self.__content_verifier is not None:
+					for content_entry in self.__content_verifier.add(item, source_stat, backup_stat):
+						yield content_entry
+				
+				if source_is_real_dir or backup_is_real_dir:
+					subdirs.append((
+						item,
+						self.child_side_mode(source_mode, source_stat, source_is_real_dir),
+						self.child_side_mode(backup_mode, backup_stat, backup_is_real_dir)
+					))
+			
+			self.__stats.count("paths_walked", item_count)
+			self.__stats.count("stat_calls", stat_count)
+			self.__stats.count("dirs_scanned", (source_mode == "scan") + (backup_mode == "scan"))
+			
+			# Deepest last, so directories are merged in sorted order
+			subdirs.reverse()
+			dirs_to_merge.extend(subdirs)
+		
+		if self.__content_verifier is not None:
+			for content_entry in self.__content_verifier.finish():
+				yield content_entry
+	
+	@staticmethod
+	def scan_dir_sorted(root_path, rel_dir, mode, path_filter=None):
+		
+		children = []
+		
+		if mode != "scan":
+			return children
+		
+		try:
+			scanner = os.scandir(os.path.join(root_path, rel_dir))
+		except OSError:
+			return children
+		
+		with scanner:
+			for dir_entry in scanner:
+				
+				is_real_dir = BackupDiff.dir_entry_is_real_dir(dir_entry)
+				
+				# Excluded items aren't stat'ed, and excluded directories aren't descended
+				if path_filter is not None and path_filter.is_excluded(
+					os.path.join(rel_dir, dir_entry.name) if rel_dir else dir_entry.name, is_real_dir
+				):
+					continue
+				
+				children.append((dir_entry.name, (BackupDiff.stat_dir_entry(dir_entry), is_real_dir)))
+		
+		children.sort(key=lambda child: child[0])
+		
+		return children
+	
+	@staticmethod
+	def merge_join_children(source_children: list, backup_children: list):
+		
+		# Both lists are sorted by name; a side missing a name gets None
+		source_index = 0
+		backup_index = 0
+		while source_index < len(source_children) or backup_index < len(backup_children):
+			
+			if backup_index >= len(backup_children):
+				name, source_child = source_children[source_index]
+				source_index += 1
+				yield name, source_child, None
+			
+			elif source_index >= len(source_children):
+				name, backup_child = backup_children[backup_index]
+				backup_index += 1
+				yield name, None, backup_child
+			
+			else:
+				source_name, source_child = source_children[source_index]
+				backup_name, backup_child = backup_children[backup_index]
+				if source_name == backup_name:
+					source_index += 1
+					backup_index += 1
+					yield source_name, source_child, backup_child
+				elif source_name < backup_name:
+					source_index += 1
+					yield source_name, source_child, None
+				else:
+					backup_index += 1
+					yield backup_name, None, backup_child
+	
+	@staticmethod
+	def stat_child(root_path, item, mode):
+		
+		# A scanned side that didn't list the item doesn't have it
+		if mode == "stat":
+			return BackupDiff.stat_path(os.path.join(root_path, item)), False
+		
+		return None, False
+	
+	@staticmethod
+	def child_side_mode(mode, child_stat, child_is_real_dir):
+		
+		if mode == "scan" and child_is_real_dir:
+			return "scan"
+		
+		if mode != "absent" and child_stat is not None and stat.S_ISDIR(child_stat.st_mode):
+			return "stat"
+		
+		return "absent"
+	
+	# Same as a directory scan would give: (stat, is a real directory)
+	@staticmethod
+	def stat_item(root_path, item):
+		
+		path = os.path.join(root_path, item)
+		
+		try:
+			is_real_dir = stat.S_ISDIR(os.lstat(path).st_mode)
+		except OSError:
+			is_real_dir = False
+		
+		return BackupDiff.stat_path(path), is_real_dir
+	
+	def item_exists(self, item):
+		
+		return os.path.lexists(os.path.join(self.__source_path, item)) \
+			or os.path.lexists(os.path.join(self.__backup_path, item))
+	
+	# Compare once, then keep the differences up to date from inotify events on the source,
+	# comparing again only the paths that changed. The current report is printed on SIGUSR1,
+	# and sent to anything that connects to the --watch-socket.
+	def watch(self):
+		
+		import select
+		import signal
+		
+		if not sys.platform.startswith("linux"):
+			raise UsageError("--watch needs Linux, for inotify")
+		if self.should_use_rsync() or self.__remote_manifest:
+			raise UsageError("--watch needs a local source and backup")
+		
+		self.check_source_path()
+		self.check_backup_path()
+		
+		if self.__verify_content or self.__verify_sample:
+			self.log("Content verification doesn't apply to --watch; ignoring it")
+		
+		watcher = InotifyWatcher(self.__source_path, self.get_path_filter())
+		watcher.open()
+		
+		server = None
+		try:
+			
+			self.__watch_entries = dict()
+			self.update_watched_entries(watcher, set(), {""}, False)
+			self.log(
+				"Watching " + str(watcher.get_watch_count()) + " directories; the first comparison found "
+				+ str(len(self.__watch_entries)) + " differences"
+			)
+			
+			if self.__watch_socket_path is not None:
+				server = self.open_watch_socket()
+			
+			signal.signal(signal.SIGUSR1, self.request_watch_report)
+			# So a plain kill still closes the socket
+			signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+			self.log("Send SIGUSR1 to process " + str(os.getpid()) + " to print the current report")
+			
+			while True:
+				
+				if self.__watch_report_requested:
+					self.__watch_report_requested = False
+					self.report_watched_entries()
+					sys.stdout.flush()
+				
+				# Signals don't interrupt select, so wake up often enough to notice them
+				readable = select.select([watcher] + ([server] if server is not None else []), [], [], 0.5)[0]
+				
+				if watcher in readable:
+					items, trees, overflowed = watcher.read_changes()
+					if overflowed:
+						self.log("Missed some changes (the inotify queue overflowed); comparing everything again")
+						watcher.remove_tree("")
+						items, trees = set(), {""}
+					self.update_watched_entries(watcher, items, trees, True)
+				
+				if server is not None and server in readable:
+					self.serve_watch_report(server)
+		
+		finally:
+			
+			watcher.close()
+			
+			if server is not None:
+				server.close()
+				try:
+					os.unlink(self.__watch_socket_path)
+				except FileNotFoundError:
+					pass
+	
+	def request_watch_report(self, signum, frame):
+		
+		self.__watch_report_requested = True
+	
+	# Items only need a fresh stat; trees were created, deleted or moved, so everything under them
+	# is compared again (and watched, if it's a directory in the source now)
+	def update_watched_entries(self, watcher, items: set, trees: set, log_changes: bool):
+		
+		# A tree under another one is already covered by it
+		trees = set(
+			tree for tree in trees
+			if not tree or not self.is_in_trees(os.path.dirname(tree), trees)
+		)
+		
+		# Anything could have changed what a symlink points to
+		items = items | watcher.get_links()
+		
+		old_entries = dict()
+		new_entries = dict()
+		
+		if trees:
+			
+			for item in [item for item in self.__watch_entries if self.is_in_trees(item, trees)]:
+				old_entries[item] = self.__watch_entries.pop(item)
+			
+			for tree in trees:
+				# Watched before it's compared, so nothing that changes in between is missed
+				watcher.add_tree(tree)
+				for entry in self.iterate_difference_entries_streaming(tree):
+					new_entries[entry.get_item()] = entry
+		
+		path_filter = self.get_path_filter()
+		for item in items:
+			
+			if self.is_in_trees(item, trees):
+				continue
+			
+			if item in self.__watch_entries:
+				old_entries[item] = self.__watch_entries.pop(item)
+			
+			if not self.item_exists(item):
+				continue
+			
+			source_stat, source_is_real_dir = self.stat_item(self.__source_path, item)
+			backup_stat, backup_is_real_dir = self.stat_item(self.__backup_path, item)
+			if item and path_filter is not None and path_filter.is_excluded(item, source_is_real_dir or backup_is_real_dir):
+				continue
+			
+			entry = self.calculate_difference_entry_from_stats(item, source_stat, backup_stat)
+			if entry:
+				new_entries[item] = entry
+		
+		self.__watch_entries.update(new_entries)
+		
+		if not log_changes:
+			return
+		
+		for item, entry in new_entries.items():
+			old_entry = old_entries.get(item)
+			if old_entry is None or old_entry.get_type() != entry.get_type():
+				self.log("Found: " + self.make_report_line(entry))
+		for item, old_entry in old_entries.items():
+			if item not in new_entries:
+				self.log("Resolved: " + self.make_report_line(old_entry))
+	
+	# Whether the item, or any directory it's in, is one of the trees ("" being the root)
+	@staticmethod
+	def is_in_trees(item, trees: set):
+		
+		while True:
+			if item in trees:
+				return True
+			if not item:
+				return False
+			item = os.path.dirname(item)
+	
+	# Cleaned and reported like a normal run, to standard output
+	def report_watched_entries(self):
+		
+		entries = sorted(self.__watch_entries.values(), key=lambda entry: entry.get_item())
+		
+		self.__difference_entries = entries
+		if self.__do_clean_difference_entries:
+			self.clean_difference_entries()
+		if self.__only_types is not None:
+			self.filter_difference_entries()
+		
+		if self.__report_format == "text":
+			self.print_report()
+		else:
+			self.write_difference_records()
+	
+	def open_watch_socket(self):
+		
+		import socket
+		
+		# Left behind by a run that didn't get to clean up
+		if os.path.exists(self.__watch_socket_path) and stat.S_ISSOCK(os.lstat(self.__watch_socket_path).st_mode):
+			os.unlink(self.__watch_socket_path)
+		
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		server.bind(self.__watch_socket_path)
+		os.chmod(self.__watch_socket_path, 0o600)
+		server.listen(8)
+		server.setblocking(False)
+		
+		return server
+	
+	# Compare every pair in a batch config, several at a time, and report them all together
+	def run_batch(self):
+		
+		runner = BatchRunner(self.__batch_config_path, self.__batch_jobs, self.__report_format == "text", self.log)
+		runner.load_config()
+		
+		self.run_phase("batch", runner.run)
+		
+		pairs = runner.get_pairs()
+		failed_pairs = [pair for pair in pairs if pair.get_error() is not None]
+		self.__stats.set("pairs", len(pairs))
+		self.__stats.set("pairs_failed", len(failed_pairs))
+		
+		self.run_phase("report", lambda: self.report_batch(pairs))
+		
+		if failed_pairs:
+			raise BackupDiffError(str(len(failed_pairs)) + " of " + str(len(pairs)) + " pairs failed")
+	
+	# A summary line per pair, then each pair's own report; or one stream of records,
+	# each with the name of its pair
+	def report_batch(self, pairs: list):
+		
+		if self.__report_format != "text":
+			writer = DifferenceRecordWriter(self.__report_format, with_pair=True)
+			for pair in pairs:
+				result = pair.get_result()
+				if result is None:
+					continue
+				writer.set_pair(pair.get_name())
+				if result.get_resolved_entries() is None:
+					writer.extend(result.get_entries())
+				else:
+					writer.extend(result.get_entries(), "new")
+					writer.extend(result.get_resolved_entries(), "resolved")
+			writer.finish()
+			return
+		
+		self.__progress.finish()
+		print()
+		self.print_report_heading("Mike's Backup Diff Batch Report", True)
+		
+		for pair in pairs:
+			if pair.get_error() is not None:
+				outcome = "Failed: " + str(pair.get_error())
+			elif len(pair.get_result()):
+				outcome = pluralize(len(pair.get_result()), "difference")
+			else:
+				outcome = "Everything seems to match"
+			print(pair.get_name() + ": " + outcome + " (" + format_timespan(pair.get_seconds()) + ")")
+		
+		for pair in pairs:
+			if pair.get_report() is not None:
+				print(pair.get_report(), end="")
+	
+	# Each connection gets the current report, in the chosen --format, and is then closed
+	def serve_watch_report(self, server):
+		
+		import contextlib
+		import io
+		
+		try:
+			connection, address = server.accept()
+		except BlockingIOError:
+			return
+		
+		with connection:
+			
+			output = io.StringIO()
+			with contextlib.redirect_stdout(output):
+				self.report_watched_entries()
+			
+			connection.settimeout(5)
+			try:
+				connection.sendall(output.getvalue().encode("utf-8", "surrogateescape"))
+			except OSError as e:
+				self.log("Couldn't send the report: " + str(e))
+	
+	# Results are gzipped ndjson: a header line, then one record per entry (see DifferenceRecordWriter)
+	def save_result(self):
+		
+		import gzip
+		
+		self.log("Saving " + str(len(self.__difference_entries)) + " difference entries to: " + str(self.__save_result_path))
+		
+		# Written next to the old result and then moved over it, so a failed save doesn't lose it
+		temp_path = self.__save_result_path + ".tmp"
+		with gzip.open(temp_path, "wt", encoding="utf-8", errors="surrogateescape", compresslevel=6) as f:
+			f.write(json.dumps({
+				"backup_diff_result": 1,
+				"source": self.__source_path,
+				"backup": self.__backup_path,
+				"created": int(time.time()),
+			}) + "\n")
+			writer = DifferenceRecordWriter("ndjson", stream=f)
+			writer.extend(self.__difference_entries)
+			writer.finish()
+		os.replace(temp_path, self.__save_result_path)
+	
+	def load_result(self):
+		
+		header, entries = self.read_result(self.__load_result_path)
+		
+		# Paths given on the command line win, but are only used for the report's heading
+		if self.__source_path is None:
+			self.__source_path = header.get("source")
+		if self.__backup_path is None:
+			self.__backup_path = header.get("backup")
+		
+		self.log("Loaded " + str(len(entries)) + " difference entries from: " + str(self.__load_result_path))
+		
+		self.__difference_entries = entries
+	
+	@staticmethod
+	def read_result(result_path):
+		
+		import gzip
+		
+		entries = []
+		
+		with gzip.open(result_path, "rt", encoding="utf-8", errors="surrogateescape") as f:
+			
+			header = json.loads(f.readline() or "{}")
+			if header.get("backup_diff_result") != 1:
+				raise BackupDiffError("Not a saved result: " + str(result_path))
+			
+			for line in f:
+				entries.append(DifferenceEntry.from_record(json.loads(line)))
+		
+		return header, entries
+	
+	def filter_difference_entries(self):
+		
+		entries = self.__difference_entries
+		entries[:] = [entry for entry in entries if entry.get_type() in self.__only_types]
+		
+		self.log("Kept " + str(len(entries)) + " difference entries of the requested types")
+	
+	# Leaves only the differences that weren't in the previous result, and keeps the ones
+	# that were, but aren't anymore, to report as resolved
+	def compare_with_previous_result(self):
+		
+		header, previous_entries = self.read_result(self.__since_result_path)
+		if self.__only_types is not None:
+			previous_entries = [entry for entry in previous_entries if entry.get_type() in self.__only_types]
+		
+		self.__since_result_created = header.get("created")
+		
+		entries = self.__difference_entries
+		
+		current_keys = set(self.difference_entry_identity(entry) for entry in entries)
+		previous_keys = set(self.difference_entry_identity(entry) for entry in previous_entries)
+		
+		entries[:] = [entry for entry in entries if self.difference_entry_identity(entry) not in previous_keys]
+		self.__resolved_entries = [
+			entry for entry in previous_entries if self.difference_entry_identity(entry) not in current_keys
+		]
+		
+		self.log(
+			"Compared with the previous result: " + str(len(entries)) + " new, "
+			+ str(len(self.__resolved_entries)) + " resolved"
+		)
+	
+	# An item that changes from one kind of difference to another counts as both new and resolved
+	@staticmethod
+	def difference_entry_identity(entry):
+		
+		return BackupDiff.item_path_components(entry.get_item()), entry.get_type()
+	
+	def clean_difference_entries(self, entries: list=None):
+		
+		if entries is None:
+			entries = self.__difference_entries
+		
+		self.log("Cleaning " + str(len(entries)) + " difference entries")
+		
+		# Index every entry that refers to a missing directory, by path components
+		# (if an item shows up more than once, the first entry is the one kept)
+		missing_dirs = dict()
+		for entry in entries:
+			if entry.get_is_missing_from_source() or entry.get_is_missing_from_backup():
+				if entry.get_is_dir():
+					missing_dirs.setdefault(self.item_path_components(entry.get_item()), entry)
+		
+		# Keep only entries that aren't inside (or a duplicate of) a missing directory
+		cleaned_entries = []
+		entry_iteration = 0
+		for entry in entries:
+			
+			entry_iteration += 1
+			
+			components = self.item_path_components(entry.get_item())
+			
+			if missing_dirs.get(components, entry) is entry \
+				and not self.has_missing_ancestor(components, missing_dirs):
+				cleaned_entries.append(entry)
+			
+			self.print_progress_message(
+				lambda: "Cleaning difference entries; "
+				+ str(entry_iteration) + " of " + str(len(entries)) + " examined; "
+				+ str(entry_iteration - len(cleaned_entries)) + " removed",
+				entry_iteration == len(entries)
+			)
+		
+		entries[:] = cleaned_entries
+		
+		self.__difference_entries = entries
+	
+	@staticmethod
+	def item_path_components(item):
+		
+		# Rsync items may have "./" or a trailing slash
+		return tuple(component for component in item.split("/") if component and component != ".")
+	
+	@staticmethod
+	def has_missing_ancestor(components: tuple, missing_dirs: dict):
+		
+		for depth in range(len(components)):
+			if components[:depth] in missing_dirs:
+				return True
+		
+		return False
+	
+	#
+	def calculate_difference_entry(self, comparison_item):
+		
+		path_source = os.path.join(self.__source_path, comparison_item)
+		path_backup = os.path.join(self.__backup_path, comparison_item)
+		
+		return self.calculate_difference_entry_from_stats(
+			comparison_item,
+			self.stat_path(path_source), self.stat_path(path_backup)
+		)
+	
+	# Compare one item using only a stat result for each side
+	# (None means the item doesn't exist on that side)
+	@staticmethod
+	def calculate_difference_entry_from_stats(comparison_item, source_stat, backup_stat):
+		
+		entry = DifferenceEntry(comparison_item)
+		
+		# In source but not backup
+		if source_stat is not None and backup_stat is None:
+			entry.set_is_dir(stat.S_ISDIR(source_stat.st_mode))
+			entry.set_is_missing_from_backup()
+		
+		# In backup but not source
+		elif backup_stat is not None and source_stat is None:
+			entry.set_is_dir(stat.S_ISDIR(backup_stat.st_mode))
+			entry.set_is_missing_from_source()
+		
+		# In neither
+		# Possible if a bad symlink is present
+		elif source_stat is None and backup_stat is None:
+			entry.set_is_missing_from_both()
+		
+		else:
+			
+			source_is_dir = stat.S_ISDIR(source_stat.st_mode)
+			source_is_file = stat.S_ISREG(source_stat.st_mode)
+			backup_is_dir = stat.S_ISDIR(backup_stat.st_mode)
+			backup_is_file = stat.S_ISREG(backup_stat.st_mode)
+			
+			# Whole seconds, same as before
+			source_mtime = source_stat.st_mtime_ns // 1000000000
+			backup_mtime = backup_stat.st_mtime_ns // 1000000000
+			
+			# Type mismatch
+			if source_is_dir and backup_is_file:
+				entry.set_is_type_mismatch("Source is a directory, but backup is a file")
+			elif source_is_file and backup_is_dir:
+				entry.set_is_type_mismatch("Source is a file, but backup is a directory")
+			
+			# Compare props
+			else:
+				
+				entry.set_is_dir(source_is_dir)
+				
+				# Different file sizes
+				if source_is_file and backup_is_file and (source_stat.st_size != backup_stat.st_size):
+					entry.set_is_different_sizes(source_stat.st_size, backup_stat.st_size)
+				
+				# Source modification time is newer
+				elif source_mtime > backup_mtime:
+					entry.set_source_is_newer(source_mtime, backup_mtime)
+				# Backup modification time is newer
+				elif backup_mtime > source_mtime:
+					entry.set_backup_is_newer(source_mtime, backup_mtime)
+				
+				# No difference
+				else:
+					entry = None
+		
+		return entry
+	
+	@staticmethod
+	def sort_difference_entries(entries):
+		
+		entries.sort(key=BackupDiff.difference_entry_sort_key)
+	
+	# Directories first, then alphabetically by item
+	@staticmethod
+	def difference_entry_sort_key(entry):
+		
+		return not entry.get_is_dir(), entry.get_item()
+	
+	def generate_report(self):
+		
+		# Start report structure
+		report = {
+			"missing_from_source": {
+				"label": "Items missing from the source",
+				"entries": []
+			},
+			"missing_from_backup": {
+				"label": "Items missing from the backup",
+				"entries": []
+			},
+			"missing_from_both": {
+				"label": "Items missing from both source and backup (bad link?)",
+				"entries": []
+			},
+			"newer_source": {
+				"label": "Items newer in the source",
+				"entries": []
+			},
+			"newer_backup": {
+				"label": "Items newer in the backup",
+				"entries": []
+			},
+			"type_mismatch": {
+				"label": "Directory/File type mismatch",
+				"entries": []
+			},
+			"size_difference": {
+				"label": "Items with different file sizes",
+				"entries": []
+			},
+			"content_difference": {
+				"label": "Items with different contents",
+				"entries": []
+			},
+			"different_attributes": {
+				"label": "Items with different attributes",
+				"entries": []
+			},
+			"unknown": {
+				"label": "Differences of an unknown type",
+				"entries": []
+			}
+		}
+		
+		# Which section each type of entry belongs in
+		section_keys_by_type = {
+			DifferenceEntry.CONST_TYPE_MISSING_IN_SOURCE: "missing_from_source",
+			DifferenceEntry.CONST_TYPE_MISSING_IN_BACKUP: "missing_from_backup",
+			DifferenceEntry.CONST_TYPE_MISSING_IN_BOTH: "missing_from_both",
+			DifferenceEntry.CONST_TYPE_TYPE_MISMATCH: "type_mismatch",
+			DifferenceEntry.CONST_TYPE_SOURCE_IS_NEWER: "newer_source",
+			DifferenceEntry.CONST_TYPE_BACKUP_IS_NEWER: "newer_backup",
+			DifferenceEntry.CONST_TYPE_DIFFERENT_SIZES: "size_difference",
+			DifferenceEntry.CONST_TYPE_DIFFERENT_CONTENTS: "content_difference",
+			DifferenceEntry.CONST_TYPE_DIFFERENT_ATTRIBUTES: "different_attributes",
+			DifferenceEntry.CONST_TYPE_UNKNOWN: "unknown",
+		}
+		
+		# Put each entry in its section, in one pass
+		for entry in self.__difference_entries:
+			report[section_keys_by_type[entry.get_type()]]["entries"].append(entry)
+		
+		# Sort all entries; when the report is limited, only pick out the first few of each section
+		for section_key in report:
+			
+			section = report[section_key]
+			section["count"] = len(section["entries"])
+			
+			if self.__report_limit is not None and section["count"] > self.__report_limit:
+				section["entries"] = heapq.nsmallest(
+					self.__report_limit, section["entries"], key=self.difference_entry_sort_key
+				)
+			else:
+				self.sort_difference_entries(section["entries"])
+		
+		return report
+	
+	def write_difference_records(self):
+		
+		writer = DifferenceRecordWriter(self.__report_format)
+		
+		if self.__resolved_entries is None:
+			writer.extend(self.__difference_entries)
+		else:
+			writer.extend(self.__difference_entries, "new")
+			writer.extend(self.__resolved_entries, "resolved")
+		
+		writer.finish()
+	
+	# Rate limited; pass a callable to skip building messages that won't be shown,
+	# and force the last update of a loop so its final count is visible
+	def print_progress_message(self, s, force: bool=False):
+		
+		self.__progress.progress(s, force)
+	
+	@staticmethod
+	def print_report_heading(s, hooded: bool=False):
+		
+		star_count = 5
+		stars = "*" * star_count
+		
+		title = stars + " " + s + " " + stars
+		
+		print("")
+		if hooded:
+			print("*" * len(title))
+		print(title)
+		
+	def print_report(self):
+		
+		report = self.generate_report()
+		section_order = [
+			"type_mismatch",
+			"missing_from_both",
+			"missing_from_source", "newer_source",
+			"missing_from_backup", "newer_backup",
+			"size_difference",
+			"content_difference",
+			"different_attributes",
+			"unknown"
+		]
+		
+		#
+		self.__progress.finish()
+		print()
+		self.print_report_heading("Mike's Backup Diff Report", True)
+		print("Source:", self.__source_path)
+		print("Backup:", self.__backup_path)
+		if self.__since_result_path is not None:
+			print("Since:", self.__since_result_path, self.format_result_created(self.__since_result_created))
+		
+		# Print each non-empty report section
+		found_anything = False
+		for section_key in section_order:
+			if len(report[section_key]["entries"]):
+				found_anything = True
+				print("")
+				self.print_report_heading(report[section_key]["label"])
+				for entry in report[section_key]["entries"]:
+					print(self.make_report_line(entry))
+				
+				hidden_count = report[section_key]["count"] - len(report[section_key]["entries"])
+				if hidden_count > 0:
+					print("... and " + str(hidden_count) + " more")
+		
+		# Lil debebuggin'
+		for section_key in report:
+			if section_key not in section_order:
+				raise Exception("Report key " + section_key + " wasn't found in the section_order ... whoopsies")
+		
+		if self.__resolved_entries:
+			found_anything = True
+			print("")
+			self.print_report_heading("Resolved since the previous result")
+			if self.__report_limit is not None and len(self.__resolved_entries) > self.__report_limit:
+				resolved_entries = heapq.nsmallest(
+					self.__report_limit, self.__resolved_entries, key=self.difference_entry_sort_key
+				)
+			else:
+				resolved_entries = self.__resolved_entries
+				self.sort_difference_entries(resolved_entries)
+			for entry in resolved_entries:
+				print(self.make_report_line(entry) + " [was " + entry.get_type_name() + "]")
+			hidden_count = len(self.__resolved_entries) - len(resolved_entries)
+			if hidden_count > 0:
+				print("... and " + str(hidden_count) + " more")
+		
+		if self.__sample_summary is not None:
+			print("")
+			self.print_report_heading("Sampled content verification")
+			for line in self.__sample_summary:
+				print(line)
+		
+		if not found_anything:
+			print()
+			if self.__since_result_path is not None:
+				print("Nothing has changed since the previous result !")
+			else:
+				print("Everything seems to match !")
+	
+	@staticmethod
+	def make_report_line(entry):
+		
+		if entry.get_is_dir():
+			prefix = "Directory: "
+		elif entry.get_is_file():
+			prefix = "File: "
+		else:
+			prefix = ""
+		
+		message = entry.get_message()
+		if message:
+			suffix = " (" + message + ")"
+		else:
+			suffix = ""
+		
+		# The roots themselves are the empty item
+		return prefix + (entry.get_item() or ".") + suffix
+	
+	@staticmethod
+	def format_result_created(created):
+		
+		if created is None:
+			return ""
+		
+		return "(" + datetime.datetime.fromtimestamp(created).strftime("%b-%d-%Y %I:%M%p") + ")"
+
+
+# Writes difference entries as machine readable records (ndjson or csv), one per entry, as they're added
+class DifferenceRecordWriter:
+	
+	CONST_FIELDS = (
+		"path",
+		"type",
+		"type_name",
+		"is_dir",
+		"source_size",
+		"backup_size",
+		"source_mtime",
+		"backup_mtime",
+		"message",
+		"change",
+	)
+	
+	# With pairs, every record starts with a "pair" field (see set_pair)
+	def __init__(self, record_format, stream=None, clean: bool=False, with_pair: bool=False):
+		
+		import csv
+		
+		self.__format = record_format
+		self.__stream = stream if stream is not None else sys.stdout
+		
+		self.__clean = clean
+		self.__missing_dirs = dict()
+		
+		self.__fields = (("pair",) if with_pair else ()) + self.CONST_FIELDS
+		self.__pair_values = (None,) if with_pair else ()
+		
+		self.__count = 0
+		self.__last_flush_time = None
+		
+		self.__csv_writer = None
+		if self.__format == "csv":
+			self.__csv_writer = csv.writer(self.__stream)
+			self.__csv_writer.writerow(self.__fields)
+	
+	def __len__(self):
+		return self.__count
+	
+	# The pair that records appended from now on belong to
+	def set_pair(self, pair):
+		
+		self.__pair_values = (pair,)
+	
+	# The change is only given when comparing with a previous result ("new" or "resolved")
+	def append(self, entry, change=None):
+		
+		if self.__clean and not self.keep_entry(entry):
+			return
+		
+		values = self.__pair_values + (
+			entry.get_item(),
+			entry.get_type(),
+			entry.get_type_name(),
+			entry.get_is_dir(),
+			entry.get_source_size(),
+			entry.get_backup_size(),
+			entry.get_source_mtime(),
+			entry.get_backup_mtime(),
+			entry.get_detail(),
+			change,
+		)
+		
+		if self.__csv_writer is not None:
+			self.__csv_writer.writerow(values)
+		else:
+			self.__stream.write(json.dumps(dict(zip(self.__fields, values))) + "\n")
+		
+		self.__count += 1
+		
+		# Flush the first record right away, then every so often, so readers downstream don't wait on a buffer
+		now = time.monotonic()
+		if self.__last_flush_time is None or now - self.__last_flush_time >= 0.5:
+			self.__stream.flush()
+			self.__last_flush_time = now
+	
+	def extend(self, entries, change=None):
+		
+		for entry in entries:
+			self.append(entry, change)
+	
+	def finish(self):
+		
+		self.__stream.flush()
+	
+	# Same rules as BackupDiff.clean_difference_entries, but entries have to arrive
+	# parents first, so a missing directory is always seen before anything inside it
+	def keep_entry(self, entry):
+		
+		components = BackupDiff.item_path_components(entry.get_item())
+		
+		if BackupDiff.has_missing_ancestor(components, self.__missing_dirs):
+			return False
+		
+		if entry.get_is_missing_from_source() or entry.get_is_missing_from_backup():
+			if entry.get_is_dir():
+				if components in self.__missing_dirs:
+					return False
+				self.__missing_dirs[components] = True
+		
+		return True
+
+
+# Wall and CPU time, and peak memory, for each phase of a run, plus counters kept along the way
+class RunStats:
+	
+	def __init__(self):
+		
+		self.__lock = threading.Lock()
+		self.__counters = dict()
+		
+		self.__phases = []
+		self.__open_phases = []
+		
+		self.__start = self.measure()
+		self.__total = None
+	
+	# Safe to call from any thread
+	def count(self, name, amount=1):
+		
+		with self.__lock:
+			self.__counters[name] = self.__counters.get(name, 0) + amount
+	
+	def set(self, name, value):
+		
+		with self.__lock:
+			self.__counters[name] = value
+	
+	# Phases can nest; a nested phase is named after its parents too, like "compare.walk",
+	# and is listed right after its parent
+	def begin_phase(self, name):
+		
+		if self.__open_phases:
+			name = self.__open_phases[-1][0] + "." + name
+		
+		self.__open_phases.append((name, len(self.__phases), self.measure()))
+		self.__phases.append(None)
+	
+	def end_phase(self):
+		
+		name, phase_index, start = self.__open_phases.pop()
+		
+		self.__phases[phase_index] = self.make_phase(name, start, self.measure())
+	
+	def finish(self):
+		
+		self.__total = self.make_phase("total", self.__start, self.measure())
+	
+	def to_dict(self):
+		
+		with self.__lock:
+			counters = dict(self.__counters)
+		
+		return {
+			"phases": list(self.__phases),
+			"total": self.__total,
+			"counters": counters,
+		}
+	
+	# CPU time of child processes (rsync, walkers, hashing workers) only counts once they've exited.
+	# Without the resource module (on Windows), there's no child CPU time or peak memory.
+	@staticmethod
+	def measure():
+		
+		child_cpu_seconds = None
+		resource = load_optional_module("resource")
+		if resource is not None:
+			children = resource.getrusage(resource.RUSAGE_CHILDREN)
+			child_cpu_seconds = children.ru_utime + children.ru_stime
+		
+		return time.perf_counter(), time.process_time(), child_cpu_seconds
+	
+	@staticmethod
+	def make_phase(name, start, end):
+		
+		child_cpu_seconds = None
+		if start[2] is not None and end[2] is not None:
+			child_cpu_seconds = round(end[2] - start[2], 6)
+		
+		return {
+			"name": name,
+			"wall_seconds": round(end[0] - start[0], 6),
+			"cpu_seconds": round(end[1] - start[1], 6),
+			"child_cpu_seconds": child_cpu_seconds,
+			# The peak so far, since the process started
+			"peak_rss_bytes": RunStats.get_peak_rss_bytes(),
+		}
+	
+	@staticmethod
+	def get_peak_rss_bytes():
+		
+		resource = load_optional_module("resource")
+		if resource is None:
+			return None
+		
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		
+		# Kilobytes, except on macOS
+		if sys.platform == "darwin":
+			return peak
+		
+		return peak * 1024
+
+
+#
+class ProgressReporter:
+	
+	def __init__(self, stream=None, updates_per_second: float=4):
+		
+		self.__stream = stream if stream is not None else sys.stderr
+		self.__is_tty = self.__stream.isatty()
+		self.__quiet = False
+		self.__callback = None
+		
+		self.__min_interval = None
+		self.set_updates_per_second(updates_per_second)
+		self.__last_progress_time = None
+		self.__progress_line_active = False
+		
+		self.__prefix_second = None
+		self.__prefix = None
+		
+		self.__lock = threading.Lock()
+	
+	def set_quiet(self, quiet: bool=True):
+		
+		self.__quiet = quiet
+	
+	# Gets every progress message that gets past the rate limit, even when quiet
+	def set_callback(self, callback):
+		
+		self.__callback = callback
+	
+	def set_updates_per_second(self, updates_per_second: float):
+		
+		# Redirected output ends up in a log, where a line every few seconds is plenty
+		if self.__is_tty:
+			self.__min_interval = 1.0 / updates_per_second
+		else:
+			self.__min_interval = max(1.0 / updates_per_second, 10.0)
+	
+	def log(self, s):
+		
+		if self.__quiet:
+			return
+		
+		with self.__lock:
+			self.__end_progress_line()
+			self.__stream.write(self.make_prefix() + s + "\n")
+			self.__stream.flush()
+	
+	def progress(self, s, force: bool=False):
+		
+		if self.__quiet and self.__callback is None:
+			return
+		
+		now = time.monotonic()
+		if not force \
+			and self.__last_progress_time is not None \
+			and now - self.__last_progress_time < self.__min_interval:
+			return
+		
+		with self.__lock:
+			
+			self.__last_progress_time = now
+			
+			if callable(s):
+				s = s()
+			
+			if self.__callback is not None:
+				self.__callback(s)
+			if self.__quiet:
+				return
+			
+			# Terminals get one line, rewritten in place; anything else gets plain lines
+			if self.__is_tty:
+				self.__stream.write("\r\033[K" + self.make_prefix() + s)
+				self.__progress_line_active = True
+			else:
+				self.__stream.write(self.make_prefix() + s + "\n")
+			self.__stream.flush()
+	
+	def finish(self):
+		
+		with self.__lock:
+			self.__end_progress_line()
+			self.__last_progress_time = None
+	
+	def __end_progress_line(self):
+		
+		if self.__progress_line_active:
+			self.__stream.write("\n")
+			self.__progress_line_active = False
+	
+	# The timestamp only changes once per second, so only format it that often
+	def make_prefix(self):
+		
+		now = int(time.time())
+		if now != self.__prefix_second:
+			now_s = datetime.datetime.fromtimestamp(now).strftime("%b-%d-%Y %I:%M%p")
+			self.__prefix = "[" + now_s + "][Mike's Backup Diff] "
+			self.__prefix_second = now
+		
+		return self.__prefix
+
+
+# Rsync style include/exclude rules: the first rule to match an item decides, and items no rule matches
+# are included. A pattern starting with "/" is anchored to the root, otherwise it matches the end of
+# the path; a trailing "/" only matches directories; "*" and "?" don't match "/", "**" does, and a
+# trailing "/***" matches a directory and everything in it. Excluded directories aren't descended.
+class PathFilter:
+	
+	def __init__(self):
+		
+		# (include, pattern), in the order given
+		self.__rules = []
+		
+		self.__matcher = None
+	
+	def has_rules(self):
+		return len(self.__rules) > 0
+	
+	def add_rule(self, include: bool, pattern):
+		
+		if not pattern:
+			raise UsageError("Include/exclude patterns can't be empty")
+		
+		self.__rules.append((include, pattern))
+		self.__matcher = None
+	
+	# One pattern per line, excluded unless it starts with "+ " ("- " also excludes);
+	# blank lines, and lines starting with "#" or ";", are skipped
+	def add_rules_from_file(self, rules_path):
+		
+		rule_count = 0
+		
+		with open(rules_path) as f:
+			for line in f:
+				
+				line = line.rstrip("\r\n")
+				if not line.strip() or line[0] in "#;":
+					continue
+				
+				if line.startswith("+ "):
+					self.add_rule(True, line[2:])
+				elif line.startswith("- "):
+					self.add_rule(False, line[2:])
+				else:
+					self.add_rule(False, line)
+				
+				rule_count += 1
+		
+		return rule_count
+	
+	def is_excluded(self, rel_path, is_dir: bool):
+		
+		match = self.get_matcher().fullmatch("/" + rel_path + ("/" if is_dir else ""))
+		if match is None:
+			return False
+		
+		return not self.__rules[int(match.lastgroup[4:])][0]
+	
+	# All rules in one expression, one named group per rule; alternatives are tried in order,
+	# so the group that matched is the first rule to match
+	def get_matcher(self):
+		
+		if self.__matcher is None:
+			self.__matcher = re.compile(self.make_pattern_source(), re.DOTALL)
+		
+		return self.__matcher
+	
+	def make_pattern_source(self):
+		
+		return "|".join(
+			"(?P<rule" + str(rule_index) + ">" + self.translate_pattern(pattern) + ")"
+			for rule_index, (include, pattern) in enumerate(self.__rules)
+		)
+	
+	def make_rsync_arguments(self):
+		
+		return [
+			("--include=" if include else "--exclude=") + pattern
+			for include, pattern in self.__rules
+		]
+	
+	# For the manifest walker, which can't import this class
+	def make_walker_arguments(self):
+		
+		return [
+			self.make_pattern_source(),
+			"".join("+" if include else "-" for include, pattern in self.__rules),
+		]
+	
+	# Matched against "/" + the relative path, with another "/" on the end for directories.
+	# Like rsync's, wildcards and character classes never match that last "/".
+	@staticmethod
+	def translate_pattern(pattern):
+		
+		anchored = pattern.startswith("/")
+		pattern = pattern.lstrip("/")
+		
+		everything_under = False
+		dir_only = False
+		if pattern.endswith("/***"):
+			everything_under = True
+			pattern = pattern[:-4]
+		elif pattern.endswith("/"):
+			dir_only = True
+			pattern = pattern.rstrip("/")
+		
+		regex = "/" if anchored else "/(?:.*/)?"
+		
+		i = 0
+		while i < len(pattern):
+			
+			c = pattern[i]
+			
+			# Ending the pattern right after a "/", a wildcard needs something to match,
+			# so "cache/**" is only what's under cache, and not cache itself
+			at_end_after_slash = i > 0 and pattern[i - 1] == "/" and not pattern[i:].strip("*")
+			
+			if pattern.startswith("**", i):
+				regex += ".+" if at_end_after_slash else ".*"
+				while i < len(pattern) and pattern[i] == "*":
+					i += 1
+				continue
+			
+			if c == "*":
+				regex += "[^/]+" if at_end_after_slash else "[^/]*"
+			elif c == "?":
+				regex += "[^/]"
+			elif c == "[" and pattern.find("]", i + 2) != -1:
+				end = pattern.find("]", i + 2)
+				members = pattern[i + 1:end]
+				if members.startswith("!"):
+					members = "^" + members[1:]
+				# Not even a range or a negated class matches "/"
+				regex += "(?!/)[" + members.replace("\\", "\\\\") + "]"
+				i = end
+			elif c == "\\" and i + 1 < len(pattern):
+				i += 1
+				regex += re.escape(pattern[i])
+			else:
+				regex += re.escape(c)
+			
+			i += 1
+		
+		if everything_under:
+			return regex + "(?:/.*)?"
+		
+		if dir_only:
+			return regex + "/"
+		
+		return regex + "/?"
+
+
+# Everything one walk found under a root. Each directory is interned once, as its parent's id and its name,
+# and keeps a dict of its children's names to their stats, so long path prefixes aren't repeated
+# for every item. Relative paths are only built when something needs one.
+class PathStore:
+	
+	def __init__(self, root_stat):
+		
+		self.__root_stat = root_stat
+		
+		# Indexed by directory id; the root is 0, and parents always get lower ids than their children
+		self.__dir_parent_ids = [None]
+		self.__dir_names = [""]
+		self.__dir_children = [dict()]
+		
+		# (parent id, name) to directory id
+		self.__dir_ids = dict()
+		
+		self.__item_count = 1
+	
+	def __len__(self):
+		return self.__item_count
+	
+	def get_root_stat(self):
+		return self.__root_stat
+	
+	def get_dir_count(self):
+		return len(self.__dir_names)
+	
+	def get_parent_id(self, dir_id):
+		return self.__dir_parent_ids[dir_id]
+	
+	def get_name(self, dir_id):
+		return self.__dir_names[dir_id]
+	
+	def get_children(self, dir_id):
+		return self.__dir_children[dir_id]
+	
+	def find_dir(self, parent_id, name):
+		return self.__dir_ids.get((parent_id, name))
+	
+	# Not thread safe; the walker holds its lock while adding
+	def add_dir(self, parent_id, name):
+		
+		dir_id = len(self.__dir_names)
+		self.__dir_parent_ids.append(parent_id)
+		self.__dir_names.append(name)
+		self.__dir_children.append(dict())
+		self.__dir_ids[(parent_id, name)] = dir_id
+		
+		return dir_id
+	
+	# Not thread safe either
+	def set_children(self, dir_id, children: dict):
+		
+		self.__dir_children[dir_id] = children
+		self.__item_count += len(children)
+	
+	# The directory's path relative to the root ("" for the root itself)
+	def make_path(self, dir_id):
+		
+		names = []
+		while dir_id:
+			names.append(self.__dir_names[dir_id])
+			dir_id = self.__dir_parent_ids[dir_id]
+		
+		return os.path.join(*reversed(names)) if names else ""
+
+
+#
+class ParallelTreeWalker:
+	
+	def __init__(self, thread_count: int=8, path_filter=None):
+		
+		self.__thread_count = max(1, thread_count)
+		self.__path_filter = path_filter
+		
+		# Directories waiting to be scanned; whichever thread is idle takes the next one,
+		# whichever tree it belongs to
+		self.__queue = queue.Queue()
+		
+		self.__condition = threading.Condition()
+		self.__pending_count = 0
+		self.__path_count = 0
+		self.__stat_count = 0
+		self.__scanned_dir_count = 0
+		self.__reused_dir_count = 0
+		self.__error = None
+	
+	def get_path_count(self):
+		return self.__path_count
+	
+	def get_stat_count(self):
+		return self.__stat_count
+	
+	def get_scanned_dir_count(self):
+		return self.__scanned_dir_count
+	
+	def get_reused_dir_count(self):
+		return self.__reused_dir_count
+	
+	# Walk each root (like os.walk without following symlinks), returning a list
+	# with one PathStore per root, holding every item's stat result by relative path.
+	# An optional ManifestIndex per root lets unchanged directories skip their stats.
+	def walk(self, root_paths: list, progress_callback=None, indexes: list=None):
+		
+		stores = []
+		for root_index, root_path in enumerate(root_paths):
+			store = PathStore(BackupDiff.stat_path(root_path))
+			stores.append(store)
+			self.__path_count += 1
+			self.__stat_count += 1
+			index = indexes[root_index] if indexes is not None else None
+			self.__push_dirs(store, index, [(root_path, "", 0, store.get_root_stat())])
+		
+		threads = []
+		for i in range(self.__thread_count):
+			thread = threading.Thread(target=self.__work, daemon=True)
+			thread.start()
+			threads.append(thread)
+		
+		# Wait for the queue to drain, reporting progress along the way
+		with self.__condition:
+			while self.__pending_count > 0:
+				self.__condition.wait(0.25)
+				if progress_callback:
+					progress_callback(self.__path_count)
+		
+		for thread in threads:
+			self.__queue.put(None)
+		for thread in threads:
+			thread.join()
+		
+		if self.__error is not None:
+			raise self.__error
+		
+		return stores
+	
+	# Each directory is (path, path relative to its root, id in the store, stat)
+	def __push_dirs(self, store, index, dirs: list):
+		
+		with self.__condition:
+			self.__pending_count += len(dirs)
+		
+		for dir_path, rel_dir, dir_id, dir_stat in dirs:
+			self.__queue.put((store, index, dir_path, rel_dir, dir_id, dir_stat))
+	
+	def __work(self):
+		
+		while True:
+			
+			task = self.__queue.get()
+			if task is None:
+				return
+			
+			store, index, dir_path, rel_dir, dir_id, dir_stat = task
+			try:
+				self.__scan_dir(store, index, dir_path, rel_dir, dir_id, dir_stat)
+			except Exception as e:
+				if self.__error is None:
+					self.__error = e
+			finally:
+				with self.__condition:
+					self.__pending_count -= 1
+					if self.__pending_count == 0:
+						self.__condition.notify_all()
+	
+	def __scan_dir(self, store, index, dir_path, rel_dir, dir_id, dir_stat):
+		
+		path_filter = self.__path_filter
+		
+		# Each child is (name, stat, is a real directory)
+		children = None
+		if index is not None:
+			children = index.lookup(dir_path, dir_stat)
+		
+		reused = children is not None
+		if not reused:
+			
+			children = []
+			
+			# Unreadable directories are skipped, same as os.walk
+			try:
+				scanner = os.scandir(dir_path)
+			except OSError:
+				return
+			
+			with scanner:
+				for dir_entry in scanner:
+					
+					# Like os.walk, don't descend into symlinked directories
+					is_real_dir = BackupDiff.dir_entry_is_real_dir(dir_entry)
+					
+					# Without an index to keep the full listing in, excluded items aren't even stat'ed
+					if path_filter is not None and index is None and path_filter.is_excluded(
+						os.path.join(rel_dir, dir_entry.name) if rel_dir else dir_entry.name, is_real_dir
+					):
+						continue
+					
+					children.append((dir_entry.name, BackupDiff.stat_dir_entry(dir_entry), is_real_dir))
+			
+			if index is not None:
+				index.record(dir_path, dir_stat, children)
+		
+		found_children = dict()
+		found_dirs = []
+		for name, child_stat, child_is_real_dir in children:
+			if path_filter is not None and index is not None and path_filter.is_excluded(
+				os.path.join(rel_dir, name) if rel_dir else name, child_is_real_dir
+			):
+				continue
+			found_children[name] = child_stat
+			if child_is_real_dir:
+				found_dirs.append((name, child_stat))
+		
+		# Subdirectories get their ids here, after their parent's, whichever thread scans them
+		with self.__condition:
+			store.set_children(dir_id, found_children)
+			child_dirs = [
+				(
+					os.path.join(dir_path, name), os.path.join(rel_dir, name) if rel_dir else name,
+					store.add_dir(dir_id, name), child_stat
+				)
+				for name, child_stat in found_dirs
+			]
+			self.__path_count += len(found_children)
+			if reused:
+				self.__reused_dir_count += 1
+				self.__stat_count += len(found_dirs)
+			else:
+				self.__scanned_dir_count += 1
+				self.__stat_count += len(found_children)
+		
+		self.__push_dirs(store, index, child_dirs)
+
+
+# The parts of a stat result the comparison needs, as stored in a ManifestIndex
+IndexedStat = collections.namedtuple("IndexedStat", ["st_mode", "st_size", "st_mtime_ns", "st_ino", "st_dev"])
+
+
+#
+class ManifestIndex:
+	
+	def __init__(self, index_dir, root_path):
+		
+		import hashlib
+		
+		self.__root_path = root_path
+		
+		# One database per tree, named after its path
+		root_hash = hashlib.sha1(root_path.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+		self.__db_path = os.path.join(index_dir, "manifest-" + root_hash + ".sqlite3")
+		
+		self.__connection = None
+		
+		# Relative directory path -> (mtime_ns, [(name, stat, is a real directory), ...])
+		self.__loaded_dirs = dict()
+		self.__verify = False
+		
+		self.__lock = threading.Lock()
+		self.__seen_dirs = set()
+		self.__scanned_dirs = dict()
+		self.__reused_dir_count = 0
+		self.__stale_dir_count = 0
+	
+	def get_root_path(self):
+		return self.__root_path
+	
+	def get_loaded_dir_count(self):
+		return len(self.__loaded_dirs)
+	
+	def get_reused_dir_count(self):
+		return self.__reused_dir_count
+	
+	def get_scanned_dir_count(self):
+		return len(self.__scanned_dirs)
+	
+	def get_stale_dir_count(self):
+		return self.__stale_dir_count
+	
+	def open(self):
+		
+		import sqlite3
+		
+		self.__connection = sqlite3.connect(self.__db_path, check_same_thread=False)
+		self.__connection.execute("PRAGMA journal_mode=WAL")
+		self.__connection.execute("PRAGMA synchronous=NORMAL")
+		
+		with self.__connection:
+			self.__connection.execute(
+				"CREATE TABLE IF NOT EXISTS dirs ("
+				"path TEXT PRIMARY KEY, mtime_ns INTEGER, entry_count INTEGER)"
+			)
+			self.__connection.execute(
+				"CREATE TABLE IF NOT EXISTS entries ("
+				"dir TEXT, name TEXT, mode INTEGER, size INTEGER, mtime_ns INTEGER,"
+				" ino INTEGER, dev INTEGER, is_real_dir INTEGER, PRIMARY KEY (dir, name))"
+			)
+			self.__connection.execute("CREATE TEMP TABLE seen_dirs (path TEXT PRIMARY KEY)")
+	
+	def close(self):
+		
+		self.__connection.close()
+		self.__connection = None
+	
+	def clear(self):
+		
+		with self.__connection:
+			self.__connection.execute("DELETE FROM entries")
+			self.__connection.execute("DELETE FROM dirs")
+	
+	# When verifying, nothing is reused; every directory is rescanned and checked against the index
+	def load(self, verify: bool=False):
+		
+		self.__verify = verify
+		
+		loaded_dirs = dict()
+		for path, mtime_ns, entry_count in self.__connection.execute("SELECT path, mtime_ns, entry_count FROM dirs"):
+			loaded_dirs[path] = (mtime_ns, [])
+		
+		for dir_path, name, mode, size, mtime_ns, ino, dev, is_real_dir in self.__connection.execute(
+			"SELECT dir, name, mode, size, mtime_ns, ino, dev, is_real_dir FROM entries"
+		):
+			if dir_path not in loaded_dirs:
+				continue
+			if mode is None:
+				child_stat = None
+			else:
+				child_stat = IndexedStat(mode, size, mtime_ns, ino, dev)
+			loaded_dirs[dir_path][1].append((name, child_stat, bool(is_real_dir)))
+		
+		self.__loaded_dirs = loaded_dirs
+	
+	def make_relative_path(self, dir_path):
+		
+		if dir_path == self.__root_path:
+			return ""
+		
+		return dir_path[len(self.__root_path) + 1:]
+	
+	# A directory whose mtime and entry count haven't changed gets its stored entries back,
+	# without stat'ing each one besides its subdirectories (None means it has to be scanned).
+	# Directory mtimes don't change when a file inside is rewritten in place,
+	# which is what --verify-index is for.
+	def lookup(self, dir_path, dir_stat):
+		
+		rel_path = self.make_relative_path(dir_path)
+		
+		with self.__lock:
+			self.__seen_dirs.add(rel_path)
+		
+		if self.__verify or dir_stat is None:
+			return None
+		
+		loaded = self.__loaded_dirs.get(rel_path)
+		if loaded is None or loaded[0] != dir_stat.st_mtime_ns:
+			return None
+		
+		# Listing names is much cheaper than stat'ing every entry
+		try:
+			entry_count = len(os.listdir(dir_path))
+		except OSError:
+			return None
+		if entry_count != len(loaded[1]):
+			return None
+		
+		# Something changing inside a subdirectory doesn't touch this directory's mtime,
+		# so subdirectories get a fresh stat, for their own lookups and for the comparison
+		children = []
+		for name, child_stat, is_real_dir in loaded[1]:
+			if is_real_dir:
+				try:
+					child_stat = os.lstat(os.path.join(dir_path, name))
+				except OSError:
+					return None
+				if not stat.S_ISDIR(child_stat.st_mode):
+					return None
+			children.append((name, child_stat, is_real_dir))
+		
+		with self.__lock:
+			self.__reused_dir_count += 1
+		
+		return children
+	
+	def record(self, dir_path, dir_stat, children: list):
+		
+		rel_path = self.make_relative_path(dir_path)
+		mtime_ns = dir_stat.st_mtime_ns if dir_stat is not None else None
+		
+		with self.__lock:
+			
+			self.__seen_dirs.add(rel_path)
+			self.__scanned_dirs[rel_path] = (mtime_ns, children)
+			
+			if self.__verify:
+				loaded = self.__loaded_dirs.get(rel_path)
+				if loaded is not None and loaded[0] == mtime_ns \
+					and self.make_comparable_children(loaded[1]) != self.make_comparable_children(children):
+					self.__stale_dir_count += 1
+	
+	@staticmethod
+	def make_comparable_children(children: list):
+		
+		comparable = set()
+		for name, child_stat, is_real_dir in children:
+			if child_stat is None:
+				comparable.add((name, None, is_real_dir))
+			else:
+				comparable.add((name, child_stat.st_mode, child_stat.st_size, child_stat.st_mtime_ns, is_real_dir))
+		
+		return comparable
+	
+	# Write back rescanned directories, and forget directories that are gone
+	def save(self):
+		
+		with self.__connection:
+			
+			self.__connection.executemany(
+				"INSERT OR IGNORE INTO seen_dirs (path) VALUES (?)",
+				((path,) for path in self.__seen_dirs)
+			)
+			self.__connection.execute("DELETE FROM dirs WHERE path NOT IN (SELECT path FROM seen_dirs)")
+			self.__connection.execute("DELETE FROM entries WHERE dir NOT IN (SELECT path FROM seen_dirs)")
+			self.__connection.execute("DELETE FROM seen_dirs")
+			
+			for rel_path, (mtime_ns, children) in self.__scanned_dirs.items():
+				
+				self.__connection.execute("DELETE FROM entries WHERE dir = ?", (rel_path,))
+				self.__connection.execute(
+					"INSERT OR REPLACE INTO dirs (path, mtime_ns, entry_count) VALUES (?, ?, ?)",
+					(rel_path, mtime_ns, len(children))
+				)
+				self.__connection.executemany(
+					"INSERT INTO entries (dir, name, mode, size, mtime_ns, ino, dev, is_real_dir)"
+					" VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+					(self.make_entry_row(rel_path, child) for child in children)
+				)
+	
+	@staticmethod
+	def make_entry_row(rel_path, child):
+		
+		name, child_stat, is_real_dir = child
+		
+		if child_stat is None:
+			return rel_path, name, None, None, None, None, None, int(is_real_dir)
+		
+		return (
+			rel_path, name,
+			child_stat.st_mode, child_stat.st_size, child_stat.st_mtime_ns, child_stat.st_ino, child_stat.st_dev,
+			int(is_real_dir)
+		)
+
+
+#
+class ContentVerifier:
+	
+	def __init__(
+		self, source_path, backup_path, process_count: int=1, cache_path=None, batch_size: int=256,
+		trust_cache: bool=True, deadline: float=None, keep_verified_items: bool=False
+	):
+		
+		self.__source_path = source_path
+		self.__backup_path = backup_path
+		
+		# Without trusting the cache, everything is hashed again (and the cache refreshed)
+		self.__trust_cache = trust_cache
+		
+		# A time.monotonic() time after which nothing more gets hashed; queued hashes are cancelled,
+		# and items that didn't get both sides hashed aren't verified
+		self.__deadline = deadline
+		
+		self.__process_count = max(1, process_count)
+		self.__executor = None
+		
+		# (dev, inode, size, mtime_ns) -> digest; kept in memory only without a cache path
+		self.__cache_path = cache_path if cache_path is not None else ":memory:"
+		self.__connection = None
+		
+		# Files are hashed in batches, so memory stays bounded while streaming
+		self.__batch_size = batch_size
+		self.__pending = []
+		
+		self.__verified_count = 0
+		self.__hashed_count = 0
+		self.__cached_count = 0
+		self.__mismatch_count = 0
+		
+		# Which items got verified, for when not everything added does (like with a deadline)
+		self.__keep_verified_items = keep_verified_items
+		self.__verified_items = []
+		self.__verified_bytes = 0
+	
+	def get_verified_count(self):
+		return self.__verified_count
+	
+	def get_verified_items(self):
+		return self.__verified_items
+	
+	def get_verified_bytes(self):
+		return self.__verified_bytes
+	
+	def get_hashed_count(self):
+		return self.__hashed_count
+	
+	def get_cached_count(self):
+		return self.__cached_count
+	
+	def get_mismatch_count(self):
+		return self.__mismatch_count
+	
+	def open(self):
+		
+		import concurrent.futures
+		import sqlite3
+		
+		if self.__process_count > 1:
+			self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.__process_count)
+		
+		self.__connection = sqlite3.connect(self.__cache_path)
+		self.__connection.execute("PRAGMA journal_mode=WAL")
+		with self.__connection:
+			self.__connection.execute(
+				"CREATE TABLE IF NOT EXISTS hashes ("
+				"dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT,"
+				" PRIMARY KEY (dev, ino, size, mtime_ns))"
+			)
+	
+	def close(self):
+		
+		if self.__executor is not None:
+			self.__executor.shutdown()
+			self.__executor = None
+		
+		self.__connection.close()
+		self.__connection = None
+	
+	# Queue an item whose size and mtime already match; returns any entries for
+	# mismatched contents, whenever a batch gets verified
+	def add(self, item, source_stat, backup_stat):
+		
+		if not stat.S_ISREG(source_stat.st_mode) or not stat.S_ISREG(backup_stat.st_mode):
+			return []
+		
+		self.__pending.append((item, source_stat, backup_stat))
+		
+		if len(self.__pending) >= self.__batch_size:
+			return self.__verify_pending()
+		
+		return []
+	
+	# Verify whatever is still queued
+	def finish(self):
+		
+		return self.__verify_pending()
+	
+	def __verify_pending(self):
+		
+		pending = self.__pending
+		self.__pending = []
+		
+		# Look up cached digests, and hash everything else (each file only once)
+		digests = dict()
+		paths_to_hash = dict()
+		keys_to_hash = set()
+		for item, source_stat, backup_stat in pending:
+			for root_path, item_stat in ((self.__source_path, source_stat), (self.__backup_path, backup_stat)):
+				key = self.make_cache_key(item_stat)
+				if key in digests or key in keys_to_hash:
+					continue
+				digest = self.lookup_digest(key) if self.__trust_cache else None
+				if digest is not None:
+					digests[key] = (digest, None)
+					self.__cached_count += 1
+				else:
+					paths_to_hash[os.path.join(root_path, item)] = key
+					keys_to_hash.add(key)
+		
+		paths = list(paths_to_hash.keys())
+		if self.__deadline is not None:
+			results = self.hash_until_deadline(paths)
+		elif self.__executor is not None:
+			results = self.__executor.map(hash_file_contents, paths, chunksize=8)
+		else:
+			results = map(hash_file_contents, paths)
+		
+		new_rows = []
+		for path, result in zip(paths, results):
+			if result is None:
+				continue
+			key = paths_to_hash[path]
+			digests[key] = result
+			self.__hashed_count += 1
+			if result[0] is not None:
+				new_rows.append(key + (result[0],))
+		
+		with self.__connection:
+			self.__connection.executemany(
+				"INSERT OR REPLACE INTO hashes (dev, ino, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+				new_rows
+			)
+		
+		# Compare
+		entries = []
+		for item, source_stat, backup_stat in pending:
+			
+			source_key = self.make_cache_key(source_stat)
+			backup_key = self.make_cache_key(backup_stat)
+			if source_key not in digests or backup_key not in digests:
+				continue
+			
+			self.__verified_count += 1
+			self.__verified_bytes += source_stat.st_size + backup_stat.st_size
+			if self.__keep_verified_items:
+				self.__verified_items.append(item)
+			
+			source_digest, source_error = digests[source_key]
+			backup_digest, backup_error = digests[backup_key]
+			
+			entry = None
+			if source_error is not None or backup_error is not None:
+				entry = DifferenceEntry(item)
+				entry.set_is_unknown("Couldn't read contents to verify them: " + str(source_error or backup_error))
+			elif source_digest != backup_digest:
+				entry = DifferenceEntry(item)
+				entry.set_is_different_contents()
+				self.__mismatch_count += 1
+			
+			if entry is not None:
+				entry.set_is_file()
+				entries.append(entry)
+		
+		return entries
+	
+	# Hashes whatever it can before the deadline; None for the rest.
+	# Queued hashes are cancelled when it passes, and running ones give up at their next read.
+	def hash_until_deadline(self, paths: list):
+		
+		import concurrent.futures
+		
+		# Worker processes get the deadline as wall clock time
+		wall_deadline = time.time() + (self.__deadline - time.monotonic())
+		
+		if self.__executor is None:
+			return [hash_file_contents(path, wall_deadline) for path in paths]
+		
+		futures = [self.__executor.submit(hash_file_contents, path, wall_deadline) for path in paths]
+		done, not_done = concurrent.futures.wait(futures, timeout=max(0, self.__deadline - time.monotonic()))
+		for future in not_done:
+			future.cancel()
+		
+		return [future.result() if future in done else None for future in futures]
+	
+	@staticmethod
+	def make_cache_key(item_stat):
+		
+		return item_stat.st_dev, item_stat.st_ino, item_stat.st_size, item_stat.st_mtime_ns
+	
+	def lookup_digest(self, key):
+		
+		row = self.__connection.execute(
+			"SELECT digest FROM hashes WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?", key
+		).fetchone()
+		
+		return row[0] if row is not None else None
+
+
+#
+class ContentSampler:
+	
+	def __init__(self, source_path, backup_path, history_path=None, byte_budget=None):
+		
+		import hashlib
+		
+		# The same index directory may serve several source/backup pairs
+		self.__pair = hashlib.sha1(
+			(source_path + "\0" + backup_path).encode("utf-8", "surrogateescape")
+		).hexdigest()
+		
+		self.__history_path = history_path if history_path is not None else ":memory:"
+		self.__connection = None
+		
+		self.__byte_budget = byte_budget
+		
+		# Item -> when it was last verified (0 for never), for every candidate that fits the budget
+		self.__strata = dict()
+		
+		self.__never_verified = set()
+		self.__never_verified_count = 0
+		self.__newly_verified_count = 0
+		self.__oversized_count = 0
+	
+	def get_never_verified_count(self):
+		return self.__never_verified_count
+	
+	def get_newly_verified_count(self):
+		return self.__newly_verified_count
+	
+	def get_oversized_count(self):
+		return self.__oversized_count
+	
+	def open(self):
+		
+		import sqlite3
+		
+		self.__connection = sqlite3.connect(self.__history_path)
+		self.__connection.execute("PRAGMA journal_mode=WAL")
+		with self.__connection:
+			self.__connection.execute(
+				"CREATE TABLE IF NOT EXISTS samples ("
+				"pair TEXT, item TEXT, verified_at INTEGER, PRIMARY KEY (pair, item))"
+			)
+	
+	def close(self):
+		
+		self.__connection.close()
+		self.__connection = None
+	
+	# Candidates are grouped by when they were last verified (never first), and shuffled within each group,
+	# so the sample is a random one from the groups it reaches, and the estimate holds for them.
+	# Takes candidates in that order until the next one doesn't fit the byte budget (both sides get read);
+	# skipping it for smaller ones would leave large files out of the sample.
+	def select(self, candidates: list):
+		
+		import random
+		
+		verified_at = dict(self.__connection.execute(
+			"SELECT item, verified_at FROM samples WHERE pair = ?", (self.__pair,)
+		))
+		
+		shuffler = random.Random()
+		prioritized = []
+		for candidate in candidates:
+			
+			last_verified = verified_at.get(candidate[0])
+			if last_verified is None:
+				self.__never_verified_count += 1
+				last_verified = 0
+			
+			# These could never be sampled, so they're left out of the estimate too
+			if self.__byte_budget is not None and candidate[1].st_size + candidate[2].st_size > self.__byte_budget:
+				self.__oversized_count += 1
+				continue
+			
+			self.__strata[candidate[0]] = last_verified
+			prioritized.append((last_verified, shuffler.random(), candidate))
+		prioritized.sort(key=lambda prioritized_candidate: prioritized_candidate[:2])
+		
+		selected = []
+		remaining_bytes = self.__byte_budget
+		for last_verified, tie_breaker, candidate in prioritized:
+			
+			if remaining_bytes is not None:
+				
+				candidate_bytes = candidate[1].st_size + candidate[2].st_size
+				if candidate_bytes > remaining_bytes:
+					break
+				
+				remaining_bytes -= candidate_bytes
+			
+			selected.append(candidate)
+		
+		self.__never_verified = {candidate[0] for candidate in candidates if candidate[0] not in verified_at}
+		
+		return selected
+	
+	# Estimates how many files are corrupt among those in the groups the sample reached, from
+	# the items actually verified and the ones that mismatched. Fully verified groups count exactly;
+	# the rest get a Wilson upper bound each, and the bounds add up. Returns (population count,
+	# estimated rate, upper bound on the corrupt file count at 95% confidence, count not covered),
+	# or None if nothing was verified.
+	def estimate(self, verified_items: list, mismatched_items: list):
+		
+		if not verified_items:
+			return None
+		
+		reached = max(self.__strata[item] for item in verified_items)
+		
+		# Stratum -> [files, verified, mismatched]
+		counts = collections.defaultdict(lambda: [0, 0, 0])
+		for item, last_verified in self.__strata.items():
+			if last_verified <= reached:
+				counts[last_verified][0] += 1
+		for item in verified_items:
+			counts[self.__strata[item]][1] += 1
+		for item in mismatched_items:
+			counts[self.__strata[item]][2] += 1
+		
+		population_count = 0
+		estimated_count = 0.0
+		upper_count = 0.0
+		for file_count, verified_count, mismatched_count in counts.values():
+			population_count += file_count
+			if verified_count == file_count:
+				estimated_count += mismatched_count
+				upper_count += mismatched_count
+			elif verified_count == 0:
+				upper_count += file_count
+			else:
+				unverified_count = file_count - verified_count
+				estimated_count += mismatched_count + unverified_count * mismatched_count / verified_count
+				upper_count += mismatched_count + unverified_count * BackupDiff.wilson_upper_bound(mismatched_count, verified_count)
+		
+		return (
+			population_count, estimated_count / population_count, math.ceil(upper_count),
+			len(self.__strata) - population_count
+		)
+	
+	def record_verified(self, items: list):
+		
+		now = int(time.time())
+		
+		for item in items:
+			if item in self.__never_verified:
+				self.__newly_verified_count += 1
+		
+		with self.__connection:
+			self.__connection.executemany(
+				"INSERT OR REPLACE INTO samples (pair, item, verified_at) VALUES (?, ?, ?)",
+				((self.__pair, item, now) for item in items)
+			)
+
+
+# Runs rsync commands as asyncio subprocesses, up to a number at once in one event loop,
+# and hands over their stdout lines as they arrive. Stdout and stderr are read at the same time,
+# so a chatty stderr can't stall rsync. A command that runs longer than the run timeout,
+# or goes longer than the idle timeout without any output, is killed and fails the run;
+# so does any command exiting with something other than success or a partial transfer.
+class RsyncRunner:
+	
+	# Success (0), and Partial Transfer Codes (23 and 24)
+	CONST_ACCEPTED_EXIT_CODES = [0, 23, 24]
+	
+	def __init__(self, job_count: int=1, run_timeout: float=None, idle_timeout: float=None, log=None):
+		
+		self.__job_count = job_count
+		self.__run_timeout = run_timeout
+		self.__idle_timeout = idle_timeout
+		self.__log = log if log is not None else (lambda s: None)
+		
+		# When iterate_lines last handed the thread back to the event loop
+		self.__resumed_time = None
+	
+	# Runs its own event loop on this thread, between lines. Stopping early (or Ctrl+C) kills whatever's still running.
+	def iterate_lines(self, commands: list):
+		
+		import asyncio
+		
+		loop = asyncio.new_event_loop()
+		lines = loop.run_until_complete(self.make_queue())
+		task = loop.create_task(self.run_commands(commands, lines.put))
+		task.add_done_callback(lambda t: lines.put_nowait(None))
+		
+		try:
+			while True:
+				# Nothing gets read while the consumer has the thread, so that time isn't idle time
+				self.__resumed_time = loop.time()
+				batch = loop.run_until_complete(self.get_batch(lines))
+				for line in batch:
+					if line is None:
+						task.result()
+						return
+					yield line
+		finally:
+			if not task.done():
+				task.cancel()
+				loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+			# Like a batch that was still being waited for, if this was interrupted
+			pending = asyncio.all_tasks(loop)
+			if pending:
+				for pending_task in pending:
+					pending_task.cancel()
+				loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+			loop.run_until_complete(loop.shutdown_asyncgens())
+			loop.close()
+	
+	# Queues belong to the loop that's running when they're made
+	@staticmethod
+	async def make_queue():
+		
+		import asyncio
+		
+		return asyncio.Queue()
+	
+	# Waits for at least one line, and takes whatever else is already there
+	@staticmethod
+	async def get_batch(lines):
+		
+		batch = [await lines.get()]
+		while not lines.empty():
+			batch.append(lines.get_nowait())
+		
+		return batch
+	
+	# Runs every command, awaiting put_line (a coroutine function) with each stdout line.
+	# The first failure cancels (and kills) the rest, then gets raised.
+	async def run_commands(self, commands: list, put_line):
+		
+		import asyncio
+		
+		slots = asyncio.Semaphore(self.__job_count)
+		
+		async def run_in_slot(args):
+			async with slots:
+				await self.run_command(args, put_line)
+		
+		tasks = [asyncio.ensure_future(run_in_slot(args)) for args in commands]
+		try:
+			await asyncio.gather(*tasks)
+		finally:
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+	
+	async def run_command(self, args: list, put_line):
+		
+		import asyncio
+		
+		loop = asyncio.get_running_loop()
+		
+		process = await asyncio.create_subprocess_exec(
+			*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+		)
+		
+		started = loop.time()
+		last_output = [started]
+		stderr_lines = collections.deque(maxlen=20)
+		
+		async def read_stdout():
+			partial = b""
+			while True:
+				chunk = await process.stdout.read(65536)
+				if not chunk:
+					break
+				last_output[0] = loop.time()
+				chunk_lines = (partial + chunk).split(b"\n")
+				partial = chunk_lines.pop()
+				for line in chunk_lines:
+					await put_line(line.decode().strip())
+			if partial:
+				await put_line(partial.decode().strip())
+		
+		async def read_stderr():
+			while True:
+				line = await process.stderr.readline()
+				if not line:
+					break
+				last_output[0] = loop.time()
+				stderr_lines.append(line.decode(errors="replace").strip())
+		
+		readers = asyncio.ensure_future(asyncio.gather(read_stdout(), read_stderr()))
+		
+		try:
+			
+			# Wakes up at whichever timeout could be next, to check them both
+			while True:
+				
+				now = loop.time()
+				
+				wait_seconds = None
+				if self.__run_timeout is not None:
+					if now - started >= self.__run_timeout:
+						raise BackupDiffError(
+							"Rsync was still running after " + format_timespan(self.__run_timeout)
+							+ self.describe_stderr(stderr_lines)
+						)
+					wait_seconds = started + self.__run_timeout - now
+				if self.__idle_timeout is not None:
+					idle_since = last_output[0]
+					if self.__resumed_time is not None:
+						idle_since = max(idle_since, self.__resumed_time)
+					if now - idle_since >= self.__idle_timeout:
+						raise BackupDiffError(
+							"Rsync had no output for " + format_timespan(self.__idle_timeout)
+							+ self.describe_stderr(stderr_lines)
+						)
+					idle_seconds = idle_since + self.__idle_timeout - now
+					wait_seconds = idle_seconds if wait_seconds is None else min(wait_seconds, idle_seconds)
+				
+				done, pending = await asyncio.wait([readers], timeout=wait_seconds)
+				if done:
+					readers.result()
+					break
+			
+			await process.wait()
+		
+		finally:
+			# Don't leave rsync running if it's timed out, failed, or been cancelled
+			if process.returncode is None:
+				process.kill()
+				await process.wait()
+			if not readers.done():
+				readers.cancel()
+				await asyncio.gather(readers, return_exceptions=True)
+		
+		if process.returncode not in self.CONST_ACCEPTED_EXIT_CODES:
+			for line in stderr_lines:
+				self.__log("Rsync stderr: " + line)
+			raise BackupDiffError("Failed to execute Rsync; Exited with code " + str(process.returncode))
+	
+	@staticmethod
+	def describe_stderr(stderr_lines):
+		
+		if not stderr_lines:
+			return ""
+		
+		return ": " + " / ".join(stderr_lines)
+
+
+# Runs commands on this machine
+class LocalTransport:
+	
+	def get_python_command(self):
+		return [sys.executable]
+	
+	def make_command(self, args: list):
+		return list(args)
+	
+	def describe(self):
+		return "local"
+
+
+# Runs commands through a shell-like command that takes one command string, like ssh or "sh -c"
+class ShellTransport:
+	
+	def __init__(self, shell_args: list, python_command="python3"):
+		
+		self.__shell_args = list(shell_args)
+		self.__python_command = python_command
+	
+	def get_python_command(self):
+		return [self.__python_command]
+	
+	def make_command(self, args: list):
+		
+		import shlex
+		
+		return self.__shell_args + [" ".join(shlex.quote(arg) for arg in args)]
+	
+	def describe(self):
+		return " ".join(self.__shell_args)
+
+
+#
+class SshTransport(ShellTransport):
+	
+	def __init__(self, ssh_host, ssh_user=None, ssh_key=None, control_path=None):
+		
+		args = ["ssh"]
+		
+		if ssh_key:
+			if not os.path.isfile(ssh_key):
+				raise UsageError("SSH key does not exist: " + str(ssh_key))
+			args.extend(["-i", ssh_key])
+		
+		if control_path:
+			args.extend(SshConnectionPool.make_client_args(control_path))
+		
+		args.append(SshConnectionPool.make_destination(ssh_host, ssh_user))
+		
+		super().__init__(args)
+
+
+# Keeps one ssh connection open per host (an OpenSSH ControlMaster), so every rsync and
+# manifest walker for that host shares it instead of connecting and authenticating again.
+# Sockets live in a temporary directory unless a control directory is given; connections
+# already listening there (like ones a batch set up for its workers) are reused, not started.
+# Connections this started are closed by close(), or at exit.
+class SshConnectionPool:
+	
+	# How long to wait for a connection to come up (including any password prompt)
+	CONST_CONNECT_SECONDS = 60
+	
+	def __init__(self, control_dir=None, log=None):
+		
+		import atexit
+		
+		self.__control_dir = control_dir
+		self.__owns_control_dir = False
+		self.__log = log if log is not None else (lambda s: None)
+		
+		self.__lock = threading.Lock()
+		
+		# (Destination, key) -> future control path, or None if it couldn't be set up
+		self.__control_paths = dict()
+		
+		# Control path -> the ssh process holding the connection, for the ones started here
+		self.__masters = dict()
+		
+		atexit.register(self.close)
+	
+	def get_control_dir(self):
+		
+		import tempfile
+		
+		if self.__control_dir is None:
+			self.__control_dir = tempfile.mkdtemp(prefix="backup-diff-ssh-")
+			self.__owns_control_dir = True
+		
+		return self.__control_dir
+	
+	# Safe to call from any thread. Connections to different destinations open at the same time,
+	# and callers wanting one that's still opening wait for it.
+	def get_control_path(self, ssh_host, ssh_user=None, ssh_key=None):
+		
+		import concurrent.futures
+		
+		destination = self.make_destination(ssh_host, ssh_user)
+		
+		# Different keys may log in as someone else, so they don't share a connection
+		with self.__lock:
+			control_path = self.__control_paths.get((destination, ssh_key))
+			is_opening = control_path is None
+			if is_opening:
+				control_path = concurrent.futures.Future()
+				self.__control_paths[(destination, ssh_key)] = control_path
+				# Made here, so threads opening at the same time don't each make one
+				self.get_control_dir()
+		
+		if is_opening:
+			try:
+				control_path.set_result(self.open_master(destination, ssh_key))
+			except BaseException as e:
+				control_path.set_exception(e)
+				raise
+		
+		return control_path.result()
+	
+	def open_master(self, destination, ssh_key):
+		
+		import hashlib
+		import subprocess
+		
+		# Sockets' paths are limited to around 100 characters, so the name is kept short
+		control_path = os.path.join(
+			self.get_control_dir(),
+			hashlib.sha1((destination + "\0" + (ssh_key or "")).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+		)
+		
+		if self.is_listening(control_path):
+			self.__log("Reusing the shared ssh connection to " + destination)
+			return control_path
+		
+		# Left behind by a connection that didn't close cleanly
+		if os.path.exists(control_path):
+			os.unlink(control_path)
+		
+		args = ["ssh", "-M", "-S", control_path, "-N", "-o", "ControlPersist=no"]
+		if ssh_key:
+			args.extend(["-i", ssh_key])
+		args.append(destination)
+		
+		self.__log("Opening a shared ssh connection to " + destination)
+		process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+		
+		# The socket shows up once the connection is authenticated
+		deadline = time.monotonic() + self.CONST_CONNECT_SECONDS
+		while not self.is_listening(control_path):
+			
+			if process.poll() is not None:
+				stderr = process.stderr.read().decode(errors="replace").strip()
+				process.stderr.close()
+				self.__log(
+					"Couldn't open a shared ssh connection to " + destination + " (exited with code "
+					+ str(process.returncode) + (": " + stderr if stderr else "") + "); connecting separately instead"
+				)
+				return None
+			
+			if time.monotonic() > deadline:
+				self.stop_master(process)
+				self.__log(
+					"Shared ssh connection to " + destination + " wasn't up after "
+					+ format_timespan(self.CONST_CONNECT_SECONDS) + "; connecting separately instead"
+				)
+				return None
+			
+			time.sleep(0.05)
+		
+		with self.__lock:
+			self.__masters[control_path] = process
+		
+		return control_path
+	
+	def close(self):
+		
+		import atexit
+		
+		atexit.unregister(self.close)
+		
+		with self.__lock:
+			masters = self.__masters
+			self.__masters = dict()
+			self.__control_paths = dict()
+		
+		for control_path, process in masters.items():
+			self.stop_master(process)
+			if os.path.exists(control_path):
+				os.unlink(control_path)
+		
+		if self.__owns_control_dir:
+			self.__owns_control_dir = False
+			try:
+				os.rmdir(self.__control_dir)
+			except OSError as e:
+				self.__log("Couldn't remove the ssh control directory " + str(self.__control_dir) + ": " + str(e))
+			self.__control_dir = None
+	
+	@staticmethod
+	def stop_master(process):
+		
+		import subprocess
+		
+		if process.poll() is None:
+			process.terminate()
+			try:
+				process.wait(5)
+			except subprocess.TimeoutExpired:
+				process.kill()
+				process.wait()
+		process.stderr.close()
+	
+	@staticmethod
+	def is_listening(control_path):
+		
+		import socket
+		
+		try:
+			if not stat.S_ISSOCK(os.stat(control_path).st_mode):
+				return False
+		except OSError:
+			return False
+		
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			client.connect(control_path)
+		except OSError:
+			return False
+		finally:
+			client.close()
+		
+		return True
+	
+	# Extra ssh arguments to go through the shared connection. Ssh connects separately
+	# if the socket isn't there anymore, and never starts a shared connection of its own.
+	@staticmethod
+	def make_client_args(control_path):
+		return ["-S", control_path, "-o", "ControlMaster=no"]
+	
+	@staticmethod
+	def make_destination(ssh_host, ssh_user=None):
+		
+		if ssh_user:
+			return ssh_user + "@" + ssh_host
+		
+		return ssh_host
+
+
+# Each record is (path length, mode, size, mtime_ns) and then the path relative to the root;
+# a mode of zero means the item couldn't be stat'ed (like a dangling symlink)
+MANIFEST_RECORD = struct.Struct("<IIQq")
+
+
+# Sent to the walker's python on stdin, so nothing needs installing on the far side.
+# Keep it to the standard library, and compatible with older python 3 versions.
+MANIFEST_WALKER_SOURCE = r"""
+import os
+import struct
+import sys
+import zlib
+
+RECORD = struct.Struct("<IIQq")
+
+
+def stat_dir_entry(dir_entry):
+	try:
+		return dir_entry.stat()
+	except (FileNotFoundError, NotADirectoryError):
+		return None
+
+
+def is_real_dir(dir_entry):
+	try:
+		return dir_entry.is_dir(follow_symlinks=False)
+	except OSError:
+		return False
+
+
+def list_dir(root, rel_dir, is_excluded):
+	children = []
+	try:
+		with os.scandir(os.path.join(root, rel_dir)) as scanner:
+			for e in scanner:
+				child_is_real_dir = is_real_dir(e)
+				if is_excluded(rel_dir + "/" + e.name if rel_dir else e.name, child_is_real_dir):
+					continue
+				children.append((e.name, stat_dir_entry(e), child_is_real_dir))
+	except OSError:
+		return iter(())
+	children.sort(key=lambda child: child[0])
+	return iter(children)
+
+
+# Optional rules, as compiled by PathFilter: one pattern with a group per rule, and "+" or "-" for each
+def make_is_excluded():
+	if len(sys.argv) < 4:
+		return lambda rel_path, is_dir: False
+	import re
+	matcher = re.compile(sys.argv[2], re.DOTALL)
+	rule_kinds = sys.argv[3]
+	def is_excluded(rel_path, is_dir):
+		match = matcher.fullmatch("/" + rel_path + ("/" if is_dir else ""))
+		return match is not None and rule_kinds[int(match.lastgroup[4:])] == "-"
+	return is_excluded
+
+
+def main():
+	
+	root = sys.argv[1]
+	if not os.path.isdir(root):
+		sys.stderr.write("Not a valid directory: " + root + "\n")
+		sys.exit(2)
+	
+	out = sys.stdout.buffer
+	compressor = zlib.compressobj(1)
+	buffer = bytearray()
+	
+	def emit(rel_path, item_stat):
+		path = rel_path.encode("utf-8", "surrogateescape")
+		if item_stat is None:
+			buffer.extend(RECORD.pack(len(path), 0, 0, 0))
+		else:
+			buffer.extend(RECORD.pack(len(path), item_stat.st_mode, item_stat.st_size, item_stat.st_mtime_ns))
+		buffer.extend(path)
+		if len(buffer) >= 65536:
+			out.write(compressor.compress(bytes(buffer)))
+			del buffer[:]
+	
+	emit("", os.stat(root))
+	
+	is_excluded = make_is_excluded()
+	
+	# Depth first, so every directory's subtree comes right after it
+	stack = [("", list_dir(root, "", is_excluded))]
+	while stack:
+		rel_dir, children = stack[-1]
+		child = next(children, None)
+		if child is None:
+			stack.pop()
+			continue
+		name, child_stat, child_is_real_dir = child
+		rel_path = rel_dir + "/" + name if rel_dir else name
+		emit(rel_path, child_stat)
+		if child_is_real_dir and child_stat is not None:
+			stack.append((rel_path, list_dir(root, rel_path, is_excluded)))
+	
+	out.write(compressor.compress(bytes(buffer)))
+	out.write(compressor.flush())
+	out.flush()
+
+
+main()
+"""
+
+
+# A manifest of one tree, streamed from a walker run through a transport
+class RemoteManifest:
+	
+	def __init__(self, transport, root_path, path_filter=None):
+		
+		self.__transport = transport
+		self.__root_path = root_path
+		self.__path_filter = path_filter
+		
+		self.__process = None
+		self.__stderr_lines = None
+		self.__stderr_thread = None
+	
+	def open(self):
+		
+		import subprocess
+		
+		walker_args = ["-", self.__root_path]
+		if self.__path_filter is not None:
+			walker_args.extend(self.__path_filter.make_walker_arguments())
+		
+		args = self.__transport.make_command(self.__transport.get_python_command() + walker_args)
+		
+		self.__process = subprocess.Popen(
+			args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+		)
+		
+		self.__stderr_lines = []
+		self.__stderr_thread = threading.Thread(
+			target=BackupDiff.drain_stream_lines, args=(self.__process.stderr, self.__stderr_lines), daemon=True
+		)
+		self.__stderr_thread.start()
+		
+		# The walker is small enough to fit in the pipe, so this won't block
+		self.__process.stdin.write(MANIFEST_WALKER_SOURCE.encode())
+		self.__process.stdin.close()
+	
+	def close(self):
+		
+		# Don't leave the walker running if the consumer stopped early
+		if self.__process.poll() is None:
+			self.__process.kill()
+			self.__process.wait()
+		self.__stderr_thread.join()
+		self.__process.stdout.close()
+		self.__process.stderr.close()
+	
+	# Yields (relative path, stat) for the root and everything under it; stat is None for dangling items
+	def iterate(self):
+		
+		record_size = MANIFEST_RECORD.size
+		decompressor = zlib.decompressobj()
+		
+		buffer = b""
+		for chunk in iter(lambda: self.__process.stdout.read1(65536), b""):
+			
+			buffer += decompressor.decompress(chunk)
+			
+			offset = 0
+			while len(buffer) - offset >= record_size:
+				path_length, mode, size, mtime_ns = MANIFEST_RECORD.unpack_from(buffer, offset)
+				path_end = offset + record_size + path_length
+				if path_end > len(buffer):
+					break
+				path = buffer[offset + record_size:path_end].decode("utf-8", "surrogateescape")
+				offset = path_end
+				if mode:
+					yield path, IndexedStat(mode, size, mtime_ns, 0, 0)
+				else:
+					yield path, None
+			
+			buffer = buffer[offset:]
+		
+		self.__process.wait()
+		if self.__process.returncode != 0:
+			self.__stderr_thread.join()
+			raise BackupDiffError(
+				"Failed to read the manifest of " + str(self.__root_path)
+				+ " (" + self.__transport.describe() + "); Exited with code " + str(self.__process.returncode)
+				+ ": " + " / ".join(self.__stderr_lines[-20:])
+			)
+		if buffer or not decompressor.eof:
+			raise BackupDiffError("The manifest of " + str(self.__root_path) + " ended early")
+
+
+# Watches a directory tree with Linux's inotify (through ctypes), and turns its events into
+# which items changed, and which subtrees were created, deleted or moved
+class InotifyWatcher:
+	
+	CONST_IN_MODIFY = 0x00000002
+	CONST_IN_ATTRIB = 0x00000004
+	CONST_IN_CLOSE_WRITE = 0x00000008
+	CONST_IN_MOVED_FROM = 0x00000040
+	CONST_IN_MOVED_TO = 0x00000080
+	CONST_IN_CREATE = 0x00000100
+	CONST_IN_DELETE = 0x00000200
+	CONST_IN_DELETE_SELF = 0x00000400
+	CONST_IN_MOVE_SELF = 0x00000800
+	CONST_IN_Q_OVERFLOW = 0x00004000
+	CONST_IN_IGNORED = 0x00008000
+	CONST_IN_ONLYDIR = 0x01000000
+	CONST_IN_DONT_FOLLOW = 0x02000000
+	CONST_IN_EXCL_UNLINK = 0x04000000
+	CONST_IN_ISDIR = 0x40000000
+	
+	CONST_WATCH_MASK = (
+		CONST_IN_MODIFY | CONST_IN_ATTRIB | CONST_IN_CLOSE_WRITE
+		| CONST_IN_MOVED_FROM | CONST_IN_MOVED_TO | CONST_IN_CREATE | CONST_IN_DELETE
+		| CONST_IN_DELETE_SELF | CONST_IN_MOVE_SELF
+		| CONST_IN_ONLYDIR | CONST_IN_DONT_FOLLOW | CONST_IN_EXCL_UNLINK
+	)
+	
+	# struct inotify_event is (watch descriptor, mask, cookie, name length), then the name padded with NULs
+	CONST_EVENT_HEADER = struct.Struct("iIII")
+	
+	def __init__(self, root_path, path_filter=None):
+		
+		self.__root_path = root_path
+		self.__path_filter = path_filter
+		
+		self.__libc = None
+		self.__fd = None
+		
+		# Watch descriptor to directory (relative to the root), and back
+		self.__dirs = dict()
+		self.__descriptors = dict()
+		
+		# Symlinks under the watched directories; what they point to can change without an event for them
+		self.__links = set()
+	
+	def open(self):
+		
+		import ctypes
+		
+		# The running program's own symbols include libc's
+		self.__libc = ctypes.CDLL(None, use_errno=True)
+		self.__libc.inotify_init1.argtypes = [ctypes.c_int]
+		self.__libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		self.__libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+		
+		fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if fd < 0:
+			raise BackupDiffError("Couldn't start inotify: " + os.strerror(ctypes.get_errno()))
+		
+		self.__fd = fd
+	
+	def close(self):
+		
+		if self.__fd is not None:
+			os.close(self.__fd)
+			self.__fd = None
+		
+		self.__dirs.clear()
+		self.__descriptors.clear()
+		self.__links.clear()
+	
+	def fileno(self):
+		return self.__fd
+	
+	def get_watch_count(self):
+		return len(self.__dirs)
+	
+	def get_links(self):
+		return self.__links
+	
+	# Watch a directory and every real directory under it that isn't excluded;
+	# anything that isn't a directory (anymore) is skipped
+	def add_tree(self, rel_dir):
+		
+		import ctypes
+		import errno
+		
+		if rel_dir and self.__path_filter is not None and self.__path_filter.is_excluded(rel_dir, True):
+			return
+		
+		dirs = [rel_dir]
+		while len(dirs):
+			
+			rel_dir = dirs.pop()
+			path = os.path.join(self.__root_path, rel_dir)
+			
+			if os.path.islink(path):
+				self.__links.add(rel_dir)
+			
+			wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), self.CONST_WATCH_MASK)
+			if wd < 0:
+				error = ctypes.get_errno()
+				# Gone or replaced since it was listed; its parent gets an event for that
+				if error in (errno.ENOENT, errno.ENOTDIR):
+					continue
+				if error == errno.ENOSPC:
+					raise BackupDiffError(
+						"Ran out of inotify watches at: " + path + " (see the fs.inotify.max_user_watches sysctl)"
+					)
+				raise BackupDiffError("Couldn't watch " + path + ": " + os.strerror(error))
+			
+			# Watching a directory again gives the same descriptor, even under a new name
+			old_rel_dir = self.__dirs.get(wd)
+			if old_rel_dir is not None and old_rel_dir != rel_dir:
+				self.__descriptors.pop(old_rel_dir, None)
+			self.__dirs[wd] = rel_dir
+			self.__descriptors[rel_dir] = wd
+			
+			try:
+				scanner = os.scandir(path)
+			except OSError:
+				continue
+			
+			with scanner:
+				for dir_entry in scanner:
+					child_rel_dir = os.path.join(rel_dir, dir_entry.name) if rel_dir else dir_entry.name
+					if dir_entry.is_symlink():
+						self.__links.add(child_rel_dir)
+					if not BackupDiff.dir_entry_is_real_dir(dir_entry):
+						continue
+					if self.__path_filter is not None and self.__path_filter.is_excluded(child_rel_dir, True):
+						continue
+					dirs.append(child_rel_dir)
+	
+	# Stop watching a directory and everything under it ("" for everything)
+	def remove_tree(self, rel_dir):
+		
+		prefix = rel_dir + "/"
+		for watched_rel_dir in list(self.__descriptors.keys()):
+			if rel_dir and watched_rel_dir != rel_dir and not watched_rel_dir.startswith(prefix):
+				continue
+			wd = self.__descriptors.pop(watched_rel_dir)
+			self.__dirs.pop(wd, None)
+			self.__libc.inotify_rm_watch(self.__fd, wd)
+		
+		self.__links = set(
+			link for link in self.__links
+			if rel_dir and link != rel_dir and not link.startswith(prefix)
+		)
+	
+	# Everything that happened since the last call, as (changed items, changed trees, overflowed).
+	# Creating, deleting or moving an item changes its tree, and its directory's modification time.
+	def read_changes(self):
+		
+		items = set()
+		trees = set()
+		overflowed = False
+		
+		header = self.CONST_EVENT_HEADER
+		
+		while True:
+			
+			try:
+				data = os.read(self.__fd, 65536)
+			except BlockingIOError:
+				break
+			
+			offset = 0
+			while offset < len(data):
+				
+				wd, mask, cookie, name_length = header.unpack_from(data, offset)
+				offset += header.size
+				name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+				offset += name_length
+				
+				if mask & self.CONST_IN_Q_OVERFLOW:
+					overflowed = True
+					continue
+				
+				# Events can still arrive for directories that were just removed
+				rel_dir = self.__dirs.get(wd)
+				if rel_dir is None:
+					continue
+				
+				if mask & self.CONST_IN_IGNORED:
+					self.__dirs.pop(wd)
+					if self.__descriptors.get(rel_dir) == wd:
+						self.__descriptors.pop(rel_dir)
+					continue
+				
+				# The watched directory itself
+				if not name:
+					if not rel_dir and mask & (self.CONST_IN_DELETE_SELF | self.CONST_IN_MOVE_SELF):
+						raise BackupDiffError("The source path was deleted or moved: " + self.__root_path)
+					if mask & self.CONST_IN_ATTRIB:
+						items.add(rel_dir)
+					continue
+				
+				item = os.path.join(rel_dir, name) if rel_dir else name
+				
+				if mask & (self.CONST_IN_CREATE | self.CONST_IN_DELETE | self.CONST_IN_MOVED_FROM | self.CONST_IN_MOVED_TO):
+					if mask & (self.CONST_IN_DELETE | self.CONST_IN_MOVED_FROM):
+						if mask & self.CONST_IN_ISDIR:
+							self.remove_tree(item)
+						self.__links.discard(item)
+					trees.add(item)
+					items.add(rel_dir)
+				else:
+					items.add(item)
+		
+		return items, trees, overflowed
+
+
+#
+class DifferenceEntry:
+	
+	# Millions of these can exist at once, so keep each one small: no per-instance dict,
+	# an int type code, and raw numbers instead of prebuilt messages
+	__slots__ = (
+		"__item",
+		"__item_is_dir",
+		"__type",
+		"__message",
+		"__source_size",
+		"__backup_size",
+		"__source_mtime",
+		"__backup_mtime",
+	)
+	
+	CONST_TYPE_TYPE_MISMATCH = 0
+	CONST_TYPE_MISSING_IN_SOURCE = 1
+	CONST_TYPE_MISSING_IN_BACKUP = 2
+	CONST_TYPE_MISSING_IN_BOTH = 3
+	CONST_TYPE_SOURCE_IS_NEWER = 4
+	CONST_TYPE_BACKUP_IS_NEWER = 5
+	CONST_TYPE_DIFFERENT_SIZES = 6
+	CONST_TYPE_DIFFERENT_ATTRIBUTES = 7
+	CONST_TYPE_UNKNOWN = 8
+	CONST_TYPE_DIFFERENT_CONTENTS = 9
+	
+	# Indexed by type code
+	CONST_TYPE_NAMES = (
+		"type_mismatch",
+		"missing_in_source",
+		"missing_in_backup",
+		"missing_in_both",
+		"source_is_newer",
+		"backup_is_newer",
+		"different_sizes",
+		"different_attributes",
+		"unknown",
+		"different_contents",
+	)
+	
+	def __init__(self, item):
+		
+		self.__item = None
+		self.__item_is_dir = None
+		self.__type = None
+		self.__message = None
+		
+		self.__source_size = None
+		self.__backup_size = None
+		self.__source_mtime = None
+		self.__backup_mtime = None
+		
+		self.set_is_unknown("DEFAULT MESSAGE")
+		
+		# The roots themselves are the empty item
+		if item is not None:
+			self.set_item(item)
+	
+	# Rebuilds an entry from a record written by DifferenceRecordWriter
+	@staticmethod
+	def from_record(record: dict):
+		
+		entry_type = record["type"]
+		if entry_type not in range(len(DifferenceEntry.CONST_TYPE_NAMES)):
+			raise BackupDiffError("Unknown difference type in record: " + str(entry_type))
+		
+		entry = DifferenceEntry(record["path"])
+		
+		if record["is_dir"] is not None:
+			entry.set_is_dir(record["is_dir"])
+		
+		entry.__type = entry_type
+		entry.__message = record["message"]
+		entry.__source_size = record["source_size"]
+		entry.__backup_size = record["backup_size"]
+		entry.__source_mtime = record["source_mtime"]
+		entry.__backup_mtime = record["backup_mtime"]
+		
+		return entry
+	
+	def __str__(self):
+	
+		s = ""
+		
+		s += "--- DifferenceEntry ---"
+		s += "\nItem: " + str(self.__item)
+		s += "\nType: " + self.get_type_name()
+		s += "\nMessage: " + str(self.get_message())
+		
+		return s
+	
+	def set_item(self, i):
+		
+		self.__item = i
+	
+	def get_item(self):
+		
+		return self.__item
+	
+	def get_type(self):
+		
+		return self.__type
+	
+	def get_type_name(self):
+		
+		return self.CONST_TYPE_NAMES[self.__type]
+	
+	def set_message(self, m):
+		self.__message = m
+	
+	# Messages built from raw values are only formatted when asked for
+	def get_message(self):
+		
+		if self.__type == self.CONST_TYPE_SOURCE_IS_NEWER:
+			return "Item has been modified more recently in source (" + str(self.__source_mtime) + ")" \
+				+ " than in backup (" + str(self.__backup_mtime) + ")" \
+				+ "; Difference is " + str(self.friendly_time_difference(self.__source_mtime, self.__backup_mtime))
+		
+		if self.__type == self.CONST_TYPE_BACKUP_IS_NEWER:
+			return "Item has been modified more recently in backup (" + str(self.__backup_mtime) + ")" \
+				+ " than in source (" + str(self.__source_mtime) + ")" \
+				+ "; Difference is " + str(self.friendly_time_difference(self.__source_mtime, self.__backup_mtime))
+		
+		if self.__type == self.CONST_TYPE_DIFFERENT_SIZES:
+			if self.__source_size and self.__backup_size:
+				return "Source has a file size of " + str(self.__source_size) \
+					+ ", but backup has a file size of " + str(self.__backup_size)
+			return None
+		
+		return self.__message
+	
+	# Only what was given along with the type; get_message also builds messages from sizes and times
+	def get_detail(self):
+		
+		return self.__message
+	
+	def set_is_dir(self, is_dir: bool=True):
+		
+		self.__item_is_dir = bool(is_dir)
+	
+	def get_is_dir(self):
+		
+		return self.__item_is_dir
+	
+	def set_is_file(self, is_file: bool=True):
+		
+		self.set_is_dir(not is_file)
+	
+	def get_is_file(self):
+		
+		if self.__item_is_dir is None:
+			return None
+		
+		return not self.__item_is_dir
+	
+	def get_source_size(self):
+		return self.__source_size
+	
+	def get_backup_size(self):
+		return self.__backup_size
+	
+	def get_source_mtime(self):
+		return self.__source_mtime
+	
+	def get_backup_mtime(self):
+		return self.__backup_mtime
+	
+	def set_is_type_mismatch(self, message):
+		
+		self.__type = self.CONST_TYPE_TYPE_MISMATCH
+		self.__message = message
+	
+	def get_is_type_mismatch(self):
+		return self.__type == self.CONST_TYPE_TYPE_MISMATCH
+	
+	def set_is_missing_from_source(self):
+		
+		self.__type = self.CONST_TYPE_MISSING_IN_SOURCE
+		self.__message = None
+	
+	def get_is_missing_from_source(self):
+		return self.__type == self.CONST_TYPE_MISSING_IN_SOURCE
+	
+	def set_is_missing_from_backup(self):
+		self.__type = self.CONST_TYPE_MISSING_IN_BACKUP
+		self.__message = None
+	
+	def get_is_missing_from_backup(self):
+		return self.__type == self.CONST_TYPE_MISSING_IN_BACKUP
+	
+	def set_is_missing_from_both(self):
+		self.__type = self.CONST_TYPE_MISSING_IN_BOTH
+		self.__message = "Item isn't in source or backup (bad link?)"
+	
+	def get_is_missing_from_both(self):
+		return self.__type == self.CONST_TYPE_MISSING_IN_BOTH
+	
+	def set_source_is_newer(self, stamp_source, stamp_backup):
+		self.__type = self.CONST_TYPE_SOURCE_IS_NEWER
+		self.__message = None
+		self.__source_mtime = stamp_source
+		self.__backup_mtime = stamp_backup
+	
+	def get_source_is_newer(self):
+		return self.__type == self.CONST_TYPE_SOURCE_IS_NEWER
+	
+	def set_backup_is_newer(self, stamp_source, stamp_backup):
+		self.__type = self.CONST_TYPE_BACKUP_IS_NEWER
+		self.__message = None
+		self.__source_mtime = stamp_source
+		self.__backup_mtime = stamp_backup
+	
+	def get_backup_is_newer(self):
+		return self.__type == self.CONST_TYPE_BACKUP_IS_NEWER
+	
+	def set_is_different_sizes(self, source_item_size=None, backup_item_size=None):
+		self.__type = self.CONST_TYPE_DIFFERENT_SIZES
+		self.__message = None
+		self.__source_size = source_item_size
+		self.__backup_size = backup_item_size
+	
+	def get_is_different_sizes(self):
+		return self.__type == self.CONST_TYPE_DIFFERENT_SIZES
+	
+	def set_is_different_contents(self):
+		self.__type = self.CONST_TYPE_DIFFERENT_CONTENTS
+		self.__message = "Same size and modification time, but different contents"
+	
+	def get_is_different_contents(self):
+		return self.__type == self.CONST_TYPE_DIFFERENT_CONTENTS
+	
+	def set_is_different_attributes(self, message=None):
+		self.__type = self.CONST_TYPE_DIFFERENT_ATTRIBUTES
+		self.__message = message
+	
+	def get_is_different_attributes(self):
+		return self.__type == self.CONST_TYPE_DIFFERENT_ATTRIBUTES
+	
+	def set_is_different_checksum(self):
+		self.set_is_different_attributes("Different checksums")
+	
+	def set_is_different_modification_times(self):
+		self.set_is_different_attributes("Different modification times")
+	
+	def set_is_different_permissions(self):
+		self.set_is_different_attributes("Different permissions")
+	
+	def set_is_different_owner(self):
+		self.set_is_different_attributes("Different owners")
+	
+	def set_is_different_group(self):
+		self.set_is_different_attributes("Different groups")
+	
+	def set_is_different_acl(self):
+		self.set_is_different_attributes("Different ACLs")
+	
+	def set_is_different_extended_attributes(self):
+		self.set_is_different_attributes("Different extended attributes")
+	
+	def set_is_unknown(self, message):
+		self.__type = self.CONST_TYPE_UNKNOWN
+		self.__message = message
+	
+	def get_is_unknown(self):
+		return self.__type == self.CONST_TYPE_UNKNOWN
+	
+	@staticmethod
+	def friendly_time_difference(stamp1, stamp2):
+		delta = abs(stamp1 - stamp2)
+		friendly = format_timespan(delta)
+		return friendly
+
+
+# Module level, so worker processes can run it; returns (digest, error).
+# With a deadline (wall clock time), returns None if it passes before the file is fully read.
+def hash_file_contents(path, deadline=None):
+	
+	import hashlib
+	
+	digest = hashlib.blake2b(digest_size=32)
+	
+	# Large reads into one reused buffer
+	buffer = bytearray(1024 * 1024)
+	view = memoryview(buffer)
+	try:
+		with open(path, "rb", buffering=0) as f:
+			while True:
+				read_count = f.readinto(buffer)
+				if not read_count:
+					break
+				if deadline is not None and time.time() >= deadline:
+					return None
+				digest.update(view[:read_count])
+	except OSError as e:
+		return None, str(e)
+	
+	return digest.hexdigest(), None
+
+
+# One source/backup pair in a batch, and how its comparison went
+class BatchPair:
+	
+	def __init__(self, name, arguments: list, resources: set):
+		
+		self.__name = name
+		self.__arguments = arguments
+		
+		# Devices and hosts the comparison reads from, which limit how many pairs run at once
+		self.__resources = resources
+		
+		self.__start_time = None
+		self.__seconds = None
+		
+		self.__result = None
+		self.__report = None
+		self.__error = None
+	
+	def get_name(self):
+		return self.__name
+	
+	def get_arguments(self):
+		return self.__arguments
+	
+	def get_resources(self):
+		return self.__resources
+	
+	def get_seconds(self):
+		return self.__seconds
+	
+	def get_result(self):
+		return self.__result
+	
+	# Only made for the text report
+	def get_report(self):
+		return self.__report
+	
+	def get_error(self):
+		return self.__error
+	
+	def start(self):
+		
+		self.__start_time = time.monotonic()
+	
+	def finish(self, result, report, error):
+		
+		self.__seconds = time.monotonic() - self.__start_time
+		self.__result = result
+		self.__report = report
+		self.__error = error
+
+
+# Compares the pairs listed in a batch config (JSON), in worker processes. Pairs run in the order listed,
+# except that one whose device or host is already busy enough waits, and later pairs go ahead of it.
+#
+#   {
+#     "jobs": 8, "per_device": 1, "per_host": 2,
+#     "options": {"walk_threads": 4},
+#     "pairs": [{"name": "photos", "source": "/data/photos", "backup": "/mnt/backup/photos", "options": {...}}]
+#   }
+#
+# Options are the same as for compare(); a pair's own options win over the shared ones.
+class BatchRunner:
+	
+	def __init__(self, config_path, job_count=None, text_reports: bool=True, log=None):
+		
+		self.__config_path = config_path
+		self.__job_count = job_count
+		self.__text_reports = text_reports
+		self.__log = log if log is not None else (lambda s: None)
+		
+		self.__per_device = 1
+		self.__per_host = 2
+		
+		self.__pairs = []
+		
+		# Pair name -> (host, user, key) of each remote side that shares an ssh connection
+		self.__ssh_destinations = dict()
+		self.__ssh_pool = None
+	
+	def get_pairs(self):
+		return self.__pairs
+	
+	def load_config(self):
+		
+		try:
+			with open(self.__config_path) as f:
+				config = json.load(f)
+		except (OSError, ValueError) as e:
+			raise UsageError("Couldn't read the batch config " + str(self.__config_path) + ": " + str(e))
+		
+		if not isinstance(config, dict) or not isinstance(config.get("pairs"), list) or not config["pairs"]:
+			raise UsageError("The batch config needs a list of pairs: " + str(self.__config_path))
+		
+		if self.__job_count is None:
+			self.__job_count = config.get("jobs", os.cpu_count() or 1)
+		self.__per_device = config.get("per_device", self.__per_device)
+		self.__per_host = config.get("per_host", self.__per_host)
+		for name, value in (("jobs", self.__job_count), ("per_device", self.__per_device), ("per_host", self.__per_host)):
+			if not isinstance(value, int) or value < 1:
+				raise UsageError("The batch config's " + name + " should be a positive number, not: " + str(value))
+		
+		shared_options = config.get("options", dict())
+		
+		names = set()
+		for pair_index, pair_config in enumerate(config["pairs"]):
+			
+			source_path = pair_config.get("source")
+			backup_path = pair_config.get("backup")
+			if not source_path or not backup_path:
+				raise UsageError("Pair " + str(pair_index + 1) + " in the batch config needs a source and a backup")
+			
+			name = str(pair_config.get("name") or source_path)
+			if name in names:
+				raise UsageError("More than one pair in the batch config is named: " + name)
+			names.add(name)
+			
+			options = dict(shared_options)
+			options.update(pair_config.get("options", dict()))
+			options = dict((option_name.replace("-", "_"), value) for option_name, value in options.items())
+			for option_name in ("batch", "batch_jobs", "watch", "watch_socket", "source_path", "backup_path"):
+				if option_name in options:
+					raise UsageError("Pairs in a batch can't have the " + option_name + " option: " + name)
+			
+			# Workers share one terminal, so only the batch itself logs
+			options["quiet"] = True
+			
+			source_host = options.get("source_remote_host")
+			backup_host = options.get("backup_remote_host")
+			
+			# Workers reuse the batch's ssh connections, which it opens as pairs need them
+			if (source_host or backup_host) and not options.get("no_ssh_multiplex") and not options.get("ssh_control_dir"):
+				if self.__ssh_pool is None:
+					self.__ssh_pool = SshConnectionPool(None, self.__log)
+				options["ssh_control_dir"] = self.__ssh_pool.get_control_dir()
+				self.__ssh_destinations[name] = [
+					(host, options.get(user_option), options.get("ssh_key"))
+					for host, user_option in ((source_host, "source_remote_user"), (backup_host, "backup_remote_user"))
+					if host
+				]
+			
+			# Local paths are relative to the config file
+			config_dir = os.path.dirname(self.__config_path)
+			if not source_host:
+				source_path = os.path.join(config_dir, source_path)
+			if not backup_host:
+				backup_path = os.path.join(config_dir, backup_path)
+			
+			self.__pairs.append(BatchPair(
+				name,
+				["--source-path", str(source_path), "--backup-path", str(backup_path)] + make_arguments(options),
+				self.make_resources(source_path, source_host) | self.make_resources(backup_path, backup_host)
+			))
+		
+		self.__log(
+			"Loaded " + str(len(self.__pairs)) + " pairs; comparing up to " + str(self.__job_count)
+			+ " at a time, " + str(self.__per_device) + " per device and " + str(self.__per_host) + " per host"
+		)
+	
+	# What a side of a comparison keeps busy: its device when it's local, or its host
+	@staticmethod
+	def make_resources(path, host):
+		
+		if host:
+			return {("host", host)}
+		
+		# Missing paths fail in the worker, with the usual error
+		try:
+			return {("device", os.stat(path).st_dev)}
+		except OSError:
+			return set()
+	
+	def run(self):
+		
+		import concurrent.futures
+		import multiprocessing
+		
+		# Workers forked while a connector thread starts ssh would hold on to the pipe that
+		# subprocess uses to see the exec through, stalling it until they exit
+		context = None
+		if self.__ssh_destinations and "forkserver" in multiprocessing.get_all_start_methods():
+			context = multiprocessing.get_context("forkserver")
+		
+		busy = collections.Counter()
+		waiting = list(self.__pairs)
+		connecting = dict()
+		running = dict()
+		finished_count = 0
+		
+		try:
+			# Opening an ssh connection can take up to a minute, so it's done on a thread of its own,
+			# and the pair only goes to a worker once its connections are up
+			with concurrent.futures.ThreadPoolExecutor(max_workers=self.__job_count) as connector, \
+				concurrent.futures.ProcessPoolExecutor(max_workers=self.__job_count, mp_context=context) as executor:
+				
+				while len(waiting) or len(connecting) or len(running):
+					
+					for pair in list(waiting):
+						if len(connecting) + len(running) >= self.__job_count:
+							break
+						if not self.has_room(pair, busy):
+							continue
+						for resource in pair.get_resources():
+							busy[resource] += 1
+						waiting.remove(pair)
+						pair.start()
+						if pair.get_name() in self.__ssh_destinations:
+							connecting[connector.submit(self.open_ssh_connections, pair)] = pair
+						else:
+							running[executor.submit(compare_batch_pair, pair.get_arguments(), self.__text_reports)] = pair
+					
+					done, not_done = concurrent.futures.wait(
+						list(connecting) + list(running), return_when=concurrent.futures.FIRST_COMPLETED
+					)
+					for future in done:
+						
+						if future in connecting:
+							pair = connecting.pop(future)
+							try:
+								future.result()
+							except Exception as e:
+								pair.finish(None, None, e)
+							else:
+								running[executor.submit(compare_batch_pair, pair.get_arguments(), self.__text_reports)] = pair
+								continue
+						else:
+							pair = running.pop(future)
+							try:
+								result, report = future.result()
+								pair.finish(result, report, None)
+							except Exception as e:
+								pair.finish(None, None, e)
+						
+						for resource in pair.get_resources():
+							busy[resource] -= 1
+						
+						finished_count += 1
+						self.__log(
+							"Finished " + pair.get_name() + " (" + str(finished_count) + " of " + str(len(self.__pairs)) + "): "
+							+ ("failed: " + str(pair.get_error()) if pair.get_error() is not None else pluralize(len(pair.get_result()), "difference"))
+						)
+		
+		finally:
+			# Workers are done with the batch's ssh connections
+			if self.__ssh_pool is not None:
+				self.__ssh_pool.close()
+	
+	# Runs on a connector thread; the pool shares connections already open (or still opening)
+	def open_ssh_connections(self, pair):
+		
+		for ssh_host, ssh_user, ssh_key in self.__ssh_destinations[pair.get_name()]:
+			self.__ssh_pool.get_control_path(ssh_host, ssh_user, ssh_key)
+	
+	def has_room(self, pair, busy):
+		
+		for resource in pair.get_resources():
+			limit = self.__per_device if resource[0] == "device" else self.__per_host
+			if busy[resource] >= limit:
+				return False
+		
+		return True
+
+
+# Runs in a batch worker process: compares one pair, and makes its text report there too
+def compare_batch_pair(arguments: list, text_report: bool):
+	
+	import contextlib
+	import io
+	
+	bd = BackupDiff()
+	bd.consume_arguments(arguments)
+	result = bd.calculate_result()
+	
+	report = None
+	if text_report:
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			bd.print_report()
+		report = output.getvalue()
+	
+	return result, report
+
+
+# What a comparison found, for use as a library. Iterating goes through the difference entries.
+class DiffResult:
+	
+	def __init__(self, source_path, backup_path, entries: list, resolved_entries: list, sample_summary: list, stats: dict):
+		
+		self.__source_path = source_path
+		self.__backup_path = backup_path
+		
+		self.__entries = entries
+		self.__resolved_entries = resolved_entries
+		self.__sample_summary = sample_summary
+		
+		self.__stats = stats
+	
+	def __iter__(self):
+		return iter(self.__entries)
+	
+	def __len__(self):
+		return len(self.__entries)
+	
+	def get_source_path(self):
+		return self.__source_path
+	
+	def get_backup_path(self):
+		return self.__backup_path
+	
+	def get_entries(self):
+		return self.__entries
+	
+	# Entries from the --since-result that are gone now; None without one
+	def get_resolved_entries(self):
+		return self.__resolved_entries
+	
+	# Report lines about --verify-sample; None without it
+	def get_sample_summary(self):
+		return self.__sample_summary
+	
+	# Same as --stats-json writes
+	def get_stats(self):
+		return self.__stats
+
+
+# Options are the command line arguments without their dashes, with underscores allowed for dashes:
+# True for flags, a value for the rest, or a list of values for options that can repeat
+def make_arguments(options: dict=None):
+	
+	arguments = []
+	
+	for name, value in (options or dict()).items():
+		
+		arg = "--" + name.replace("_", "-")
+		
+		if value is None or value is False:
+			continue
+		if value is True:
+			arguments.append(arg)
+		elif isinstance(value, (list, tuple)):
+			for item in value:
+				arguments.extend([arg, str(item)])
+		else:
+			arguments.extend([arg, str(value)])
+	
+	return arguments
+
+
+# Compare a source and backup directory without printing a report, returning a DiffResult.
+# The progress callback gets each progress message as a string.
+def compare(source_path, backup_path, options: dict=None, progress_callback=None):
+	
+	arguments = ["--source-path", str(source_path), "--backup-path", str(backup_path)] + make_arguments(options)
+	
+	bd = BackupDiff()
+	if progress_callback is not None:
+		bd.set_progress_callback(progress_callback)
+	bd.consume_arguments(arguments)
+	
+	return bd.calculate_result()
+
+
+# Same as compare(), but just the difference entries, streamed as they're found where possible
+def diff(source_path, backup_path, options: dict=None, progress_callback=None):
+	
+	arguments = ["--source-path", str(source_path), "--backup-path", str(backup_path)] + make_arguments(options)
+	
+	bd = BackupDiff()
+	if progress_callback is not None:
+		bd.set_progress_callback(progress_callback)
+	bd.consume_arguments(arguments)
+	
+	return bd.iterate_result()
+
+
+# Optional modules, by name, once they've been looked for; None when they aren't installed
+OPTIONAL_MODULES = dict()
+
+
+def load_optional_module(name):
+	
+	if name not in OPTIONAL_MODULES:
+		try:
+			OPTIONAL_MODULES[name] = importlib.import_module(name)
+		except ImportError:
+			OPTIONAL_MODULES[name] = None
+	
+	return OPTIONAL_MODULES[name]
+
+
+# (name, seconds), largest first; a year is 52 weeks, like humanfriendly's
+TIME_UNITS = [
+	("year", 60 * 60 * 24 * 7 * 52),
+	("week", 60 * 60 * 24 * 7),
+	("day", 60 * 60 * 24),
+	("hour", 60 * 60),
+	("minute", 60),
+	("second", 1),
+]
+
+
+# Like humanfriendly.format_size(byte_count, binary=True), which is used when it's installed
+def format_size(byte_count):
+	
+	humanfriendly = load_optional_module("humanfriendly")
+	if humanfriendly is not None:
+		return humanfriendly.format_size(byte_count, binary=True)
+	
+	for exponent, symbol in reversed(list(enumerate(["KiB", "MiB", "GiB", "TiB", "PiB"], 1))):
+		if byte_count >= 1024 ** exponent:
+			return format_number(byte_count / 1024 ** exponent) + " " + symbol
+	
+	return pluralize(byte_count, "byte")
+
+
+# Like humanfriendly.format_timespan(seconds), which is used when it's installed:
+# the three largest units that aren't zero, like "1 year, 2 days and 3 hours"
+def format_timespan(seconds):
+	
+	humanfriendly = load_optional_module("humanfriendly")
+	if humanfriendly is not None:
+		return humanfriendly.format_timespan(seconds)
+	
+	if seconds < 60:
+		return pluralize(format_number(seconds), "second")
+	
+	parts = []
+	for name, unit_seconds in TIME_UNITS:
+		count = seconds / unit_seconds
+		seconds %= unit_seconds
+		# Only seconds keep their fraction
+		count = format_number(count) if unit_seconds == 1 else int(count)
+		if count not in (0, "0"):
+			parts.append(pluralize(count, name))
+	
+	if len(parts) == 1:
+		return parts[0]
+	
+	parts = parts[:3]
+	
+	return ", ".join(parts[:-1]) + " and " + parts[-1]
+
+
+# Up to two decimals, without trailing zeros
+def format_number(number):
+	
+	return ("%.2f" % float(number)).rstrip("0").rstrip(".")
+
+
+def pluralize(count, singular):
+	
+	if float(count) == 1:
+		return str(count) + " " + singular
+	
+	return str(count) + " " + singular + "s"
+
+
+#
+def main():
+
+	bd = BackupDiff()
+	try:
+		bd.run()
+	except UsageError as e:
+		sys.stderr.write(str(e) + "\n")
+		sys.exit(2)
+	except BackupDiffError as e:
+		sys.stderr.write(str(e) + "\n")
+		sys.exit(1)
+
+
+#
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+
+Entry memory benchmark for Mike's Backup Diff
+
+Measures how many bytes each DifferenceEntry takes, next to the dict-based entry it replaced
+(kept here for comparison), and fails when the current one goes over budget
+
+"""
+
+
+#
+import os
+import sys
+import tracemalloc
+
+
+#
+CONST_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+#
+class EntryMemoryBenchmark:
+	
+	def __init__(self):
+		
+		self.__entry_count = 100000
+		
+		# Bytes per entry, not counting its path
+		self.__budget_bytes = 160
+		
+		self.__module = None
+	
+	def run(self):
+		
+		self.consume_arguments()
+		
+		self.__module = self.load_backup_diff()
+		
+		# Paths are made up front, so they're the same for both and not counted
+		items = ["dir-{:04d}/file-{:08d}".format(i // 1000, i) for i in range(self.__entry_count)]
+		
+		old_bytes = self.measure_bytes_per_entry(OldDifferenceEntry, items)
+		new_bytes = self.measure_bytes_per_entry(self.__module.DifferenceEntry, items)
+		
+		print("{:>24} {:>16}".format("Entry", "Bytes per entry"))
+		print("{:>24} {:>16.1f}".format("old (dict based)", old_bytes))
+		print("{:>24} {:>16.1f}".format("current", new_bytes))
+		print("")
+		
+		if new_bytes > self.__budget_bytes:
+			print("Over budget: {:.1f} bytes per entry; the budget is {:.1f}".format(new_bytes, self.__budget_bytes))
+			return 1
+		
+		print("Within budget: {:.1f} bytes per entry, of {:.1f}".format(new_bytes, self.__budget_bytes))
+		
+		return 0
+	
+	def consume_arguments(self):
+		
+		i = 1
+		while i < len(sys.argv):
+			
+			arg = sys.argv[i]
+			
+			if arg == "--entries":
+				i, entry_count = self.consume_argument_companion(i)
+				self.__entry_count = int(entry_count)
+			
+			elif arg == "--budget-bytes":
+				i, budget_bytes = self.consume_argument_companion(i)
+				self.__budget_bytes = float(budget_bytes)
+			
+			else:
+				raise Exception("Unsupported argument: " + arg)
+			
+			i += 1
+	
+	@staticmethod
+	def consume_argument_companion(arg_index):
+		
+		companion_index = arg_index + 1
+		if companion_index >= len(sys.argv):
+			raise Exception("Expected argument after " + sys.argv[arg_index])
+		
+		return companion_index, sys.argv[companion_index]
+	
+	# Always the copy next to these benchmarks, not whatever else might be installed
+	@staticmethod
+	def load_backup_diff():
+		
+		sys.path.insert(0, CONST_PACKAGE_DIR)
+		import backup_diff
+		
+		return backup_diff
+	
+	# Traced memory held by one entry per item: half files newer in the source,
+	# half directories missing from the backup
+	@staticmethod
+	def measure_bytes_per_entry(entry_class, items: list):
+		
+		# Whatever either class loads lazily gets loaded before measuring
+		entry_class(items[0]).set_source_is_newer(1000000000, 999999000)
+		
+		tracemalloc.start()
+		before_bytes = tracemalloc.get_traced_memory()[0]
+		
+		entries = []
+		for item_index, item in enumerate(items):
+			entry = entry_class(item)
+			if item_index % 2 == 0:
+				entry.set_source_is_newer(1000000000 + item_index, 999999000)
+				entry.set_is_file()
+			else:
+				entry.set_is_missing_from_backup()
+				entry.set_is_dir()
+			entries.append(entry)
+		
+		after_bytes = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+		
+		return (after_bytes - before_bytes) / len(entries)
+
+
+# The parts of DifferenceEntry before it had slots that decide its size: an instance dict holding
+# the type names as well as the entry, and messages built up front
+class OldDifferenceEntry:
+	
+	def __init__(self, item):
+		
+		self.__item = None
+		self.__item_is_file = None
+		self.__item_is_dir = None
+		self.__type = None
+		self.__message = None
+		
+		self.CONST_TYPE_TYPE_MISMATCH = "type_mismatch"
+		self.CONST_TYPE_MISSING_IN_SOURCE = "missing_in_source"
+		self.CONST_TYPE_MISSING_IN_BACKUP = "missing_in_backup"
+		self.CONST_TYPE_MISSING_IN_BOTH = "missing_in_both"
+		self.CONST_TYPE_SOURCE_IS_NEWER = "source_is_newer"
+		self.CONST_TYPE_BACKUP_IS_NEWER = "backup_is_newer"
+		self.CONST_TYPE_DIFFERENT_SIZES = "different_sizes"
+		self.CONST_TYPE_DIFFERENT_ATTRIBUTES = "different_attributes"
+		self.CONST_TYPE_UNKNOWN = "unknown"
+		
+		self.set_is_unknown("DEFAULT MESSAGE")
+		
+		if item:
+			self.__item = item
+	
+	def set_is_dir(self, is_dir: bool=True):
+		
+		if is_dir:
+			self.__item_is_dir = True
+			self.__item_is_file = False
+		else:
+			self.__item_is_dir = False
+			self.__item_is_file = True
+	
+	def set_is_file(self, is_file: bool=True):
+		
+		self.set_is_dir(not is_file)
+	
+	def set_is_missing_from_backup(self):
+		self.__type = self.CONST_TYPE_MISSING_IN_BACKUP
+		self.__message = None
+	
+	def set_source_is_newer(self, stamp_source, stamp_backup):
+		time_difference = self.friendly_time_difference(stamp_source, stamp_backup)
+		self.__type = self.CONST_TYPE_SOURCE_IS_NEWER
+		self.__message = "Item has been modified more recently in source (" + str(stamp_source) + ")" \
+			+ " than in backup (" + str(stamp_backup) + ")" \
+			+ "; Difference is " + str(time_difference)
+	
+	def set_is_unknown(self, message):
+		self.__type = self.CONST_TYPE_UNKNOWN
+		self.__message = message
+	
+	@staticmethod
+	def friendly_time_difference(stamp1, stamp2):
+		
+		import backup_diff
+		
+		return backup_diff.format_timespan(abs(stamp1 - stamp2))
+
+
+#
+def main():
+	
+	benchmark = EntryMemoryBenchmark()
+	sys.exit(benchmark.run())
+
+
+#
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""
+
+Synthetic source/backup trees for benchmarking Mike's Backup Diff
+
+The same parameters always generate the same trees
+
+"""
+
+
+#
+import json
+import os
+import random
+import sys
+
+
+# Every file and directory gets this modification time, unless it's been "modified"
+CONST_STAMP = 1500000000
+
+
+#
+class TreeGenerator:
+	
+	def __init__(self):
+		
+		self.__file_count = 10000
+		self.__depth = 3
+		self.__fanout = 8
+		
+		self.__missing_fraction = 0.01
+		self.__modified_fraction = 0.01
+		self.__missing_subtree_fraction = 0.005
+		
+		self.__seed = 0
+	
+	def set_file_count(self, file_count: int):
+		self.__file_count = file_count
+	
+	def set_depth(self, depth: int):
+		self.__depth = depth
+	
+	def set_fanout(self, fanout: int):
+		self.__fanout = fanout
+	
+	def set_missing_fraction(self, fraction: float):
+		self.__missing_fraction = fraction
+	
+	def set_modified_fraction(self, fraction: float):
+		self.__modified_fraction = fraction
+	
+	def set_missing_subtree_fraction(self, fraction: float):
+		self.__missing_subtree_fraction = fraction
+	
+	def set_seed(self, seed: int):
+		self.__seed = seed
+	
+	def get_params(self):
+		
+		return {
+			"file_count": self.__file_count,
+			"depth": self.__depth,
+			"fanout": self.__fanout,
+			"missing_fraction": self.__missing_fraction,
+			"modified_fraction": self.__modified_fraction,
+			"missing_subtree_fraction": self.__missing_subtree_fraction,
+			"seed": self.__seed,
+		}
+	
+	# Generates <root>/source and <root>/backup, unless they're already there with the same parameters.
+	# Returns the paths of both trees, and how many of each difference were made.
+	def generate(self, root):
+		
+		source_path = os.path.join(root, "source")
+		backup_path = os.path.join(root, "backup")
+		params_path = os.path.join(root, "params.json")
+		
+		params = self.get_params()
+		
+		if os.path.isfile(params_path):
+			with open(params_path) as f:
+				saved = json.load(f)
+			if saved.get("params") == params:
+				return source_path, backup_path, saved["counts"]
+			raise Exception("A tree with different parameters is already in: " + str(root))
+		
+		rnd = random.Random(self.__seed)
+		
+		dirs = self.make_dirs()
+		
+		# Whole directories left out of the backup; anything under them goes too
+		missing_subtrees = set(
+			rel_dir for rel_dir in dirs[1:] if rnd.random() < self.__missing_subtree_fraction
+		)
+		
+		counts = {
+			"dirs": len(dirs),
+			"files": self.__file_count,
+			"missing_subtrees": 0,
+			"missing_from_backup": 0,
+			"missing_from_source": 0,
+			"different_sizes": 0,
+			"newer_source": 0,
+		}
+		
+		for rel_dir in dirs:
+			
+			in_missing_subtree = self.is_in_subtrees(rel_dir, missing_subtrees)
+			if rel_dir in missing_subtrees and not self.is_in_subtrees(os.path.dirname(rel_dir), missing_subtrees):
+				counts["missing_subtrees"] += 1
+			
+			os.makedirs(os.path.join(source_path, rel_dir), exist_ok=True)
+			if not in_missing_subtree:
+				os.makedirs(os.path.join(backup_path, rel_dir), exist_ok=True)
+		
+		for file_index in range(self.__file_count):
+			
+			rel_dir = dirs[rnd.randrange(len(dirs))]
+			rel_path = os.path.join(rel_dir, "file-" + str(file_index))
+			size = rnd.randrange(64)
+			
+			in_backup = not self.is_in_subtrees(rel_dir, missing_subtrees)
+			in_source = True
+			backup_size = size
+			backup_stamp = CONST_STAMP
+			
+			roll = rnd.random()
+			if in_backup and roll < self.__missing_fraction:
+				# Half go missing from the backup, half from the source
+				if rnd.random() < 0.5:
+					in_backup = False
+					counts["missing_from_backup"] += 1
+				else:
+					in_source = False
+					counts["missing_from_source"] += 1
+			elif in_backup and roll < self.__missing_fraction + self.__modified_fraction:
+				if rnd.random() < 0.5:
+					backup_size = size + 1
+					counts["different_sizes"] += 1
+				else:
+					backup_stamp = CONST_STAMP - 3600
+					counts["newer_source"] += 1
+			
+			if in_source:
+				self.write_file(os.path.join(source_path, rel_path), size, CONST_STAMP)
+			if in_backup:
+				self.write_file(os.path.join(backup_path, rel_path), backup_size, backup_stamp)
+		
+		# Directory times last, deepest first, since adding files changes them
+		for rel_dir in reversed(dirs):
+			for tree_path in (source_path, backup_path):
+				dir_path = os.path.join(tree_path, rel_dir)
+				if os.path.isdir(dir_path):
+					os.utime(dir_path, (CONST_STAMP, CONST_STAMP))
+		
+		with open(params_path, "w") as f:
+			json.dump({"params": params, "counts": counts}, f, indent=2)
+		
+		return source_path, backup_path, counts
+	
+	# Relative paths of every directory, root ("") first, parents before children
+	def make_dirs(self):
+		
+		dirs = [""]
+		level = [""]
+		for depth in range(self.__depth):
+			next_level = []
+			for rel_dir in level:
+				for child_index in range(self.__fanout):
+					next_level.append(os.path.join(rel_dir, "dir-" + str(depth) + "-" + str(child_index)))
+			dirs.extend(next_level)
+			level = next_level
+		
+		return dirs
+	
+	@staticmethod
+	def is_in_subtrees(rel_dir, subtrees: set):
+		
+		while rel_dir:
+			if rel_dir in subtrees:
+				return True
+			rel_dir = os.path.dirname(rel_dir)
+		
+		return False
+	
+	@staticmethod
+	def write_file(path, size, stamp):
+		
+		with open(path, "wb") as f:
+			f.write(b"x" * size)
+		os.utime(path, (stamp, stamp))
+
+
+#
+def main():
+	
+	generator = TreeGenerator()
+	root = None
+	
+	setters = {
+		"--file-count": (generator.set_file_count, int),
+		"--depth": (generator.set_depth, int),
+		"--fanout": (generator.set_fanout, int),
+		"--missing-fraction": (generator.set_missing_fraction, float),
+		"--modified-fraction": (generator.set_modified_fraction, float),
+		"--missing-subtree-fraction": (generator.set_missing_subtree_fraction, float),
+		"--seed": (generator.set_seed, int),
+	}
+	
+	i = 1
+	while i < len(sys.argv):
+		arg = sys.argv[i]
+		if arg in setters and i + 1 < len(sys.argv):
+			setter, value_type = setters[arg]
+			setter(value_type(sys.argv[i + 1]))
+			i += 2
+		elif root is None and not arg.startswith("--"):
+			root = arg
+			i += 1
+		else:
+			raise Exception("Unsupported argument: " + arg)
+	
+	if root is None:
+		raise Exception("Usage: generate_tree.py <output directory> [" + " <value>] [".join(setters) + " <value>]")
+	
+	source_path, backup_path, counts = generator.generate(root)
+	
+	print("Source:", source_path)
+	print("Backup:", backup_path)
+	print(json.dumps(counts, indent=2))
+
+
+#
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+"""
+
+Benchmarks for Mike's Backup Diff
+
+Times each phase (walk, compare, clean, report) over generated trees of a few sizes,
+tracks peak memory, and flags regressions against a saved baseline
+
+"""
+
+
+#
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+#
+from generate_tree import TreeGenerator
+
+
+#
+CONST_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+#
+class BenchmarkRunner:
+	
+	def __init__(self):
+		
+		self.__scales = [1000, 10000, 100000]
+		self.__repeat = 3
+		self.__measure_memory = True
+		
+		self.__work_dir = os.path.join(tempfile.gettempdir(), "backup-diff-benchmarks")
+		self.__baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+		self.__save_baseline = False
+		
+		# A phase regresses when it's this much slower (or bigger) than the baseline,
+		# and by more than the noise floors
+		self.__tolerance = 0.25
+		self.__seconds_floor = 0.05
+		self.__bytes_floor = 1024 * 1024
+		
+		self.__module = None
+	
+	def run(self):
+		
+		self.consume_arguments()
+		
+		self.__module = self.load_backup_diff()
+		
+		results = {
+			"python": platform.python_version(),
+			"created": int(time.time()),
+			"scales": dict(),
+		}
+		
+		for scale in self.__scales:
+			results["scales"][str(scale)] = self.run_scale(scale)
+		
+		self.print_results(results)
+		
+		if self.__save_baseline:
+			with open(self.__baseline_path, "w") as f:
+				json.dump(results, f, indent=2)
+			print("Saved baseline to:", self.__baseline_path)
+			return 0
+		
+		if not os.path.isfile(self.__baseline_path):
+			print("No baseline to compare with; save one with --save-baseline")
+			return 0
+		
+		with open(self.__baseline_path) as f:
+			baseline = json.load(f)
+		
+		regressions = self.compare_with_baseline(results, baseline)
+		if regressions:
+			print("")
+			print("Regressions against", self.__baseline_path)
+			for regression in regressions:
+				print("  " + regression)
+			return 1
+		
+		print("")
+		print("No regressions against", self.__baseline_path)
+		return 0
+	
+	def consume_arguments(self):
+		
+		i = 1
+		while i < len(sys.argv):
+			
+			arg = sys.argv[i]
+			
+			if arg == "--scales":
+				i, scales = self.consume_argument_companion(i)
+				self.__scales = [int(scale) for scale in scales.split(",")]
+			
+			elif arg == "--repeat":
+				i, repeat = self.consume_argument_companion(i)
+				self.__repeat = int(repeat)
+			
+			elif arg == "--no-memory":
+				self.__measure_memory = False
+			
+			elif arg == "--work-dir":
+				i, work_dir = self.consume_argument_companion(i)
+				self.__work_dir = os.path.abspath(work_dir)
+			
+			elif arg == "--baseline":
+				i, baseline_path = self.consume_argument_companion(i)
+				self.__baseline_path = os.path.abspath(baseline_path)
+			
+			elif arg == "--save-baseline":
+				self.__save_baseline = True
+			
+			elif arg == "--tolerance":
+				i, tolerance = self.consume_argument_companion(i)
+				self.__tolerance = float(tolerance)
+			
+			else:
+				raise Exception("Unsupported argument: " + arg)
+			
+			i += 1
+	
+	@staticmethod
+	def consume_argument_companion(arg_index):
+		
+		companion_index = arg_index + 1
+		if companion_index >= len(sys.argv):
+			raise Exception("Expected argument after " + sys.argv[arg_index])
+		
+		return companion_index, sys.argv[companion_index]
+	
+	# Always the copy next to these benchmarks, not whatever else might be installed
+	@staticmethod
+	def load_backup_diff():
+		
+		sys.path.insert(0, CONST_PACKAGE_DIR)
+		import backup_diff
+		
+		return backup_diff
+	
+	def run_scale(self, scale):
+		
+		generator = TreeGenerator()
+		generator.set_file_count(scale)
+		
+		tree_dir = os.path.join(self.__work_dir, "tree-" + str(scale))
+		print("Generating tree of " + str(scale) + " files in: " + tree_dir)
+		source_path, backup_path, counts = generator.generate(tree_dir)
+		
+		# Best of a few runs for times; memory from one more run, since tracing slows everything down
+		phases = None
+		for repeat_index in range(self.__repeat):
+			run_phases = self.run_phases(source_path, backup_path, False)
+			if phases is None:
+				phases = run_phases
+			else:
+				for phase, measurements in run_phases.items():
+					phases[phase]["seconds"] = min(phases[phase]["seconds"], measurements["seconds"])
+		
+		if self.__measure_memory:
+			for phase, measurements in self.run_phases(source_path, backup_path, True).items():
+				phases[phase]["peak_bytes"] = measurements["peak_bytes"]
+		
+		return phases
+	
+	def run_phases(self, source_path, backup_path, measure_memory: bool):
+		
+		phases = dict()
+		
+		def measure(phase, function):
+			if measure_memory:
+				tracemalloc.start()
+			start = time.perf_counter()
+			function()
+			seconds = time.perf_counter() - start
+			phases[phase] = {"seconds": seconds}
+			if measure_memory:
+				phases[phase]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+		
+		bd = self.make_backup_diff(source_path, backup_path)
+		
+		# Walk once, then compare what was walked
+		measure("walk", bd.calculate_comparison_items)
+		bd.calculate_comparison_items = lambda: None
+		measure("compare", bd.calculate_difference_entries)
+		measure("clean", bd.clean_difference_entries)
+		measure("report", lambda: self.print_quietly(bd.print_report))
+		
+		# The streaming comparison walks and compares in one go
+		bd = self.make_backup_diff(source_path, backup_path, ["--streaming"])
+		measure("streaming", bd.calculate_difference_entries)
+		
+		return phases
+	
+	def make_backup_diff(self, source_path, backup_path, extra_args: list=None):
+		
+		bd = self.__module.BackupDiff()
+		bd.consume_arguments(
+			["--quiet", "--source-path", source_path, "--backup-path", backup_path] + (extra_args or [])
+		)
+		
+		return bd
+	
+	@staticmethod
+	def print_quietly(function):
+		
+		with contextlib.redirect_stdout(io.StringIO()):
+			function()
+	
+	@staticmethod
+	def print_results(results):
+		
+		print("")
+		print("{:>10} {:>10} {:>12} {:>12}".format("Scale", "Phase", "Seconds", "Peak MiB"))
+		for scale, phases in results["scales"].items():
+			for phase, measurements in phases.items():
+				peak_bytes = measurements.get("peak_bytes")
+				print("{:>10} {:>10} {:>12.4f} {:>12}".format(
+					scale, phase, measurements["seconds"],
+					"-" if peak_bytes is None else "{:.2f}".format(peak_bytes / (1024 * 1024))
+				))
+	
+	def compare_with_baseline(self, results, baseline):
+		
+		regressions = []
+		
+		for scale, phases in results["scales"].items():
+			for phase, measurements in phases.items():
+				
+				baseline_measurements = baseline.get("scales", dict()).get(scale, dict()).get(phase)
+				if baseline_measurements is None:
+					continue
+				
+				seconds = measurements["seconds"]
+				baseline_seconds = baseline_measurements["seconds"]
+				if seconds > baseline_seconds * (1 + self.__tolerance) \
+					and seconds - baseline_seconds > self.__seconds_floor:
+					regressions.append(
+						"{} files, {}: {:.4f}s, was {:.4f}s".format(scale, phase, seconds, baseline_seconds)
+					)
+				
+				peak_bytes = measurements.get("peak_bytes")
+				baseline_peak_bytes = baseline_measurements.get("peak_bytes")
+				if peak_bytes is not None and baseline_peak_bytes is not None \
+					and peak_bytes > baseline_peak_bytes * (1 + self.__tolerance) \
+					and peak_bytes - baseline_peak_bytes > self.__bytes_floor:
+					regressions.append(
+						"{} files, {}: {:.2f} MiB peak, was {:.2f} MiB".format(
+							scale, phase, peak_bytes / (1024 * 1024), baseline_peak_bytes / (1024 * 1024)
+						)
+					)
+		
+		return regressions
+
+
+#
+def main():
+	
+	runner = BenchmarkRunner()
+	sys.exit(runner.run())
+
+
+#
+if __name__ == "__main__":
+	main()
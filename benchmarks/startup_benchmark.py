@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""
+
+Startup benchmark for Mike's Backup Diff
+
+Times a fresh interpreter importing backup_diff and comparing two empty directories,
+which is most of what a quick probe from cron costs, and fails when that goes over budget
+or when modules that only some options need get imported anyway
+
+"""
+
+
+#
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+#
+CONST_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Should only be imported by the options that use them
+CONST_LAZY_MODULES = [
+	"asyncio", "concurrent.futures", "cProfile", "csv", "gzip", "hashlib",
+	"humanfriendly", "random", "shlex", "sqlite3", "subprocess",
+]
+
+# Run in the child interpreter; prints which of the lazy modules got imported
+CONST_NO_OP_SOURCE = """
+import json
+import sys
+sys.path.insert(0, sys.argv[1])
+import backup_diff
+backup_diff.BackupDiff().run(["--quiet", "--source-path", sys.argv[2], "--backup-path", sys.argv[3]])
+print(json.dumps([name for name in json.loads(sys.argv[4]) if name in sys.modules]))
+"""
+
+
+#
+class StartupBenchmark:
+	
+	def __init__(self):
+		
+		self.__repeat = 20
+		
+		# Cached bytecode is part of a normal startup, so it's allowed even if this environment turns it off
+		self.__env = dict(os.environ)
+		self.__env.pop("PYTHONDONTWRITEBYTECODE", None)
+		
+		# Milliseconds over a bare interpreter's startup, for the median no-op run
+		self.__budget_ms = 50.0
+	
+	def run(self):
+		
+		self.consume_arguments()
+		
+		with tempfile.TemporaryDirectory() as work_dir:
+			
+			source_path = os.path.join(work_dir, "source")
+			backup_path = os.path.join(work_dir, "backup")
+			os.mkdir(source_path)
+			os.mkdir(backup_path)
+			
+			no_op_args = [
+				"-c", CONST_NO_OP_SOURCE,
+				CONST_PACKAGE_DIR, source_path, backup_path, json.dumps(CONST_LAZY_MODULES)
+			]
+			
+			bare_ms = self.time_interpreter(["-c", "pass"])
+			import_ms = self.time_interpreter(
+				["-c", "import sys; sys.path.insert(0, sys.argv[1]); import backup_diff", CONST_PACKAGE_DIR]
+			)
+			no_op_ms = self.time_interpreter(no_op_args)
+			
+			result = subprocess.run([sys.executable] + no_op_args, stdout=subprocess.PIPE, env=self.__env, check=True)
+			lazy_modules_imported = json.loads(result.stdout.decode().splitlines()[-1])
+		
+		print("{:>24} {:>10}".format("Run", "Median ms"))
+		print("{:>24} {:>10.1f}".format("bare interpreter", bare_ms))
+		print("{:>24} {:>10.1f}".format("import", import_ms))
+		print("{:>24} {:>10.1f}".format("import and no-op run", no_op_ms))
+		print("")
+		
+		failed = False
+		
+		overhead_ms = no_op_ms - bare_ms
+		if overhead_ms > self.__budget_ms:
+			print("Over budget: the no-op run took {:.1f} ms more than a bare interpreter; the budget is {:.1f} ms".format(
+				overhead_ms, self.__budget_ms
+			))
+			failed = True
+		else:
+			print("Within budget: {:.1f} ms over a bare interpreter, of {:.1f} ms".format(overhead_ms, self.__budget_ms))
+		
+		if lazy_modules_imported:
+			print("Imported by a no-op run, but should only be imported when needed: " + ", ".join(lazy_modules_imported))
+			failed = True
+		
+		return 1 if failed else 0
+	
+	def consume_arguments(self):
+		
+		i = 1
+		while i < len(sys.argv):
+			
+			arg = sys.argv[i]
+			
+			if arg == "--repeat":
+				i, repeat = self.consume_argument_companion(i)
+				self.__repeat = int(repeat)
+			
+			elif arg == "--budget-ms":
+				i, budget_ms = self.consume_argument_companion(i)
+				self.__budget_ms = float(budget_ms)
+			
+			else:
+				raise Exception("Unsupported argument: " + arg)
+			
+			i += 1
+	
+	@staticmethod
+	def consume_argument_companion(arg_index):
+		
+		companion_index = arg_index + 1
+		if companion_index >= len(sys.argv):
+			raise Exception("Expected argument after " + sys.argv[arg_index])
+		
+		return companion_index, sys.argv[companion_index]
+	
+	# Median wall time of a fresh interpreter running with these arguments,
+	# after one untimed run to write any bytecode
+	def time_interpreter(self, args: list):
+		
+		subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, env=self.__env, check=True)
+		
+		times = []
+		for repeat_index in range(self.__repeat):
+			start = time.perf_counter()
+			subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, env=self.__env, check=True)
+			times.append(time.perf_counter() - start)
+		
+		times.sort()
+		
+		return times[len(times) // 2] * 1000
+
+
+#
+def main():
+	
+	benchmark = StartupBenchmark()
+	sys.exit(benchmark.run())
+
+
+#
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+
+Regression checks for Mike's Backup Diff
+
+Include/exclude rules should leave out the same items in the direct and streaming walks
+as rsync does with the same rules
+
+"""
+
+
+#
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+#
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup_diff
+
+
+#
+class PathFilterTest(unittest.TestCase):
+	
+	# Pattern, relative path, whether it's a directory, and whether rsync excludes it
+	CONST_CASES = [
+		("cache/**", "cache", True, False),
+		("cache/**", "cache/x", False, True),
+		("cache/**", "cache/x", True, True),
+		("cache/**", "a/cache/x/y", False, True),
+		("cache/*", "cache", True, False),
+		("cache/*", "cache/x", False, True),
+		("cache/*", "cache/x/y", False, False),
+		("/top/***", "top", True, True),
+		("/top/***", "top/x/y", False, True),
+		("/top/***", "a/top", True, False),
+		("a[/]b", "a/b", False, False),
+		("a[!x]b", "a/b", False, False),
+		("a[!x]b", "azb", False, True),
+		("a[.-0]b", "a/b", False, False),
+		("a[.-0]b", "a.b", False, True),
+		("dir/", "dir", False, False),
+		("dir/", "dir", True, True),
+		("*.tmp", "x/y.tmp", False, True),
+	]
+	
+	def test_patterns_match_like_rsync(self):
+		
+		for pattern, rel_path, is_dir, expected in self.CONST_CASES:
+			with self.subTest(pattern=pattern, rel_path=rel_path, is_dir=is_dir):
+				path_filter = backup_diff.PathFilter()
+				path_filter.add_rule(False, pattern)
+				self.assertEqual(path_filter.is_excluded(rel_path, is_dir), expected)
+
+
+#
+class DirectRsyncEquivalenceTest(unittest.TestCase):
+	
+	CONST_PATTERNS = ["cache/**", "cache/*", "a[/]b", "a[!x]b", "/top/***", "*.tmp"]
+	
+	def setUp(self):
+		
+		self.__work_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.__work_dir.cleanup)
+		
+		root = self.__work_dir.name
+		self.__source_path = os.path.join(root, "source")
+		self.__backup_path = os.path.join(root, "backup")
+		
+		# Everything is only in the source, so whatever isn't excluded shows up as missing from the backup
+		for rel_path in ["cache/x/y", "sub/cache/z", "a/b", "azb", "top/t", "sub/top/t", "keep.tmp", "keep"]:
+			path = os.path.join(self.__source_path, rel_path)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "w") as f:
+				f.write("source only")
+		os.makedirs(self.__backup_path)
+	
+	def compare(self, options: dict):
+		
+		result = backup_diff.compare(self.__source_path, self.__backup_path, dict(options, quiet=True, no_clean=True))
+		
+		return sorted(entry.get_item().strip("/") for entry in result if entry.get_item().strip("/"))
+	
+	def test_direct_matches_streaming(self):
+		
+		for pattern in self.CONST_PATTERNS:
+			with self.subTest(pattern=pattern):
+				self.assertEqual(
+					self.compare({"exclude": pattern}),
+					self.compare({"exclude": pattern, "streaming": True})
+				)
+	
+	@unittest.skipUnless(shutil.which("rsync"), "needs rsync")
+	def test_direct_matches_rsync(self):
+		
+		for pattern in self.CONST_PATTERNS:
+			with self.subTest(pattern=pattern):
+				self.assertEqual(
+					self.compare({"exclude": pattern}),
+					self.compare({"exclude": pattern, "rsync": True})
+				)
+
+
+#
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+
+Regression checks for Mike's Backup Diff
+
+Timeouts of the rsync runner, using shell commands in place of rsync
+
+"""
+
+
+#
+import os
+import sys
+import time
+import unittest
+
+
+#
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup_diff
+
+
+#
+class RsyncRunnerTest(unittest.TestCase):
+	
+	# A consumer taking longer than the idle timeout isn't the command going quiet
+	def test_slow_consumer_isnt_idle(self):
+		
+		runner = backup_diff.RsyncRunner(1, None, 1)
+		
+		line_count = 0
+		for line in runner.iterate_lines([["sh", "-c", "seq 1 200000"]]):
+			line_count += 1
+			if line_count == 1:
+				time.sleep(2.5)
+		
+		self.assertEqual(line_count, 200000)
+	
+	def test_quiet_command_times_out(self):
+		
+		runner = backup_diff.RsyncRunner(1, None, 0.5)
+		
+		start = time.monotonic()
+		with self.assertRaisesRegex(backup_diff.BackupDiffError, "no output"):
+			list(runner.iterate_lines([["sh", "-c", "echo first; exec sleep 30"]]))
+		
+		self.assertLess(time.monotonic() - start, 10)
+	
+	def test_long_command_times_out(self):
+		
+		runner = backup_diff.RsyncRunner(2, 0.5, None)
+		
+		with self.assertRaisesRegex(backup_diff.BackupDiffError, "still running"):
+			list(runner.iterate_lines([["sh", "-c", "while true; do echo busy; sleep 0.1; done"], ["true"]]))
+
+
+#
+if __name__ == "__main__":
+	unittest.main()
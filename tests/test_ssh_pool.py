@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+
+Regression checks for Mike's Backup Diff
+
+Shared ssh connections and remote manifests, using a stand-in ssh that runs everything on this machine
+
+"""
+
+
+#
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+
+#
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup_diff
+
+
+# With "-M -S path", listens on the control path like a ControlMaster until it's terminated;
+# otherwise runs the command with sh. Either way, notes what it did in $FAKE_SSH_LOG.
+CONST_FAKE_SSH = """#!{python}
+import os, signal, socket, subprocess, sys, time
+
+args = sys.argv[1:]
+is_master = False
+control_path = None
+key = "-"
+while args and args[0].startswith("-"):
+	arg = args.pop(0)
+	if arg == "-M":
+		is_master = True
+	elif arg in ("-S", "-o", "-i"):
+		value = args.pop(0)
+		if arg == "-S":
+			control_path = value
+		elif arg == "-i":
+			key = value
+destination = args.pop(0)
+
+def note(s):
+	with open(os.environ["FAKE_SSH_LOG"], "a") as f:
+		f.write(s + "\\n")
+
+if is_master:
+	time.sleep(0.2)
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	server.bind(control_path)
+	server.listen(16)
+	note("open " + destination + " " + key)
+	def stop(*ignored):
+		note("close " + destination + " " + key)
+		sys.exit(0)
+	signal.signal(signal.SIGTERM, stop)
+	while True:
+		server.accept()[0].close()
+
+note("run " + destination + " " + ("shared" if control_path else "separate"))
+sys.exit(subprocess.call(["sh", "-c", " ".join(args)]))
+"""
+
+
+#
+class SshPoolTest(unittest.TestCase):
+	
+	def setUp(self):
+		
+		self.__work_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.__work_dir.cleanup)
+		
+		root = self.__work_dir.name
+		
+		bin_path = os.path.join(root, "bin")
+		os.makedirs(bin_path)
+		ssh_path = os.path.join(bin_path, "ssh")
+		with open(ssh_path, "w") as f:
+			f.write(CONST_FAKE_SSH.format(python=sys.executable))
+		os.chmod(ssh_path, 0o755)
+		
+		self.__log_path = os.path.join(root, "ssh.log")
+		
+		environment = unittest.mock.patch.dict(os.environ, {
+			"PATH": bin_path + os.pathsep + os.environ.get("PATH", ""),
+			"FAKE_SSH_LOG": self.__log_path,
+		})
+		environment.start()
+		self.addCleanup(environment.stop)
+		
+		self.__key_path = os.path.join(root, "key")
+		with open(self.__key_path, "w") as f:
+			f.write("not really a key")
+		
+		# The source has a file the backup doesn't, and one with a different size
+		self.__source_path = os.path.join(root, "source")
+		self.__backup_path = os.path.join(root, "backup")
+		self.write_file(os.path.join(self.__source_path, "same"), "same")
+		self.write_file(os.path.join(self.__backup_path, "same"), "same")
+		self.write_file(os.path.join(self.__source_path, "d", "only"), "source only")
+		self.write_file(os.path.join(self.__source_path, "sized"), "longer")
+		self.write_file(os.path.join(self.__backup_path, "sized"), "short")
+		os.makedirs(os.path.join(self.__backup_path, "d"))
+		for path in [self.__source_path, self.__backup_path]:
+			for dir_path, dir_names, file_names in os.walk(path):
+				for name in dir_names + file_names:
+					os.utime(os.path.join(dir_path, name), (1000000000, 1000000000))
+			os.utime(path, (1000000000, 1000000000))
+	
+	@staticmethod
+	def write_file(path, content):
+		
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, "w") as f:
+			f.write(content)
+	
+	def read_log(self):
+		
+		if not os.path.exists(self.__log_path):
+			return []
+		
+		with open(self.__log_path) as f:
+			return f.read().splitlines()
+	
+	# One connection per host and key, however many ask for it at once, and all closed at the end
+	def test_one_connection_per_host_and_key(self):
+		
+		pool = backup_diff.SshConnectionPool()
+		
+		requests = [("one", None), ("one", None), ("one", self.__key_path), ("two", None)] * 3
+		control_paths = [None] * len(requests)
+		
+		def get_control_path(request_index):
+			host, key = requests[request_index]
+			control_paths[request_index] = pool.get_control_path(host, "me", key)
+		
+		threads = [threading.Thread(target=get_control_path, args=(i,)) for i in range(len(requests))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		
+		self.assertEqual(
+			sorted(self.read_log()),
+			sorted(["open me@one -", "open me@one " + self.__key_path, "open me@two -"])
+		)
+		
+		paths_by_request = dict()
+		for request, control_path in zip(requests, control_paths):
+			self.assertIsNotNone(control_path)
+			self.assertEqual(paths_by_request.setdefault(request, control_path), control_path)
+		self.assertEqual(len(set(paths_by_request.values())), 3)
+		
+		control_dir = pool.get_control_dir()
+		
+		pool.close()
+		
+		self.assertEqual(
+			sorted(line for line in self.read_log() if line.startswith("close ")),
+			sorted(["close me@one -", "close me@one " + self.__key_path, "close me@two -"])
+		)
+		for control_path in paths_by_request.values():
+			self.assertFalse(os.path.exists(control_path))
+		self.assertFalse(os.path.exists(control_dir))
+	
+	def compare_remote_source(self, options: dict):
+		
+		options = dict(options, quiet=True, remote_manifest=True, source_remote_host="one")
+		result = backup_diff.compare(self.__source_path, self.__backup_path, options)
+		
+		return sorted((entry.get_item(), entry.get_type_name()) for entry in result)
+	
+	def compare_locally(self):
+		
+		result = backup_diff.compare(self.__source_path, self.__backup_path, {"quiet": True})
+		
+		return sorted((entry.get_item(), entry.get_type_name()) for entry in result)
+	
+	# The "remote" walker runs through sh instead of ssh
+	def test_remote_manifest_through_shell(self):
+		
+		self.assertEqual(self.compare_remote_source({"manifest_shell": "sh -c"}), self.compare_locally())
+		self.assertEqual(self.read_log(), [])
+	
+	# The walker goes through the shared connection, which is closed once the comparison is done
+	def test_remote_manifest_through_ssh(self):
+		
+		self.assertEqual(self.compare_remote_source({}), self.compare_locally())
+		self.assertEqual(self.read_log(), ["open one -", "run one shared", "close one -"])
+
+
+#
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+
+Regression checks for Mike's Backup Diff
+
+The direct and streaming comparisons should agree when one side has a symlinked directory
+where the other has a real one
+
+"""
+
+
+#
+import os
+import sys
+import tempfile
+import unittest
+
+
+#
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup_diff
+
+
+#
+class SymlinkedDirTest(unittest.TestCase):
+	
+	def setUp(self):
+		
+		self.__work_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.__work_dir.cleanup)
+		
+		root = self.__work_dir.name
+		self.__source_path = os.path.join(root, "source")
+		self.__backup_path = os.path.join(root, "backup")
+		
+		# The source has d/f, and the backup has d -> real, which holds the same f
+		self.write_file(os.path.join(self.__source_path, "d", "f"), "same")
+		self.write_file(os.path.join(self.__source_path, "d", "sub", "g"), "same")
+		self.write_file(os.path.join(self.__source_path, "d", "only"), "source only")
+		self.write_file(os.path.join(self.__backup_path, "real", "f"), "same")
+		self.write_file(os.path.join(self.__backup_path, "real", "sub", "g"), "same")
+		os.symlink("real", os.path.join(self.__backup_path, "d"))
+		
+		# And the other way around: the source has e -> ../elsewhere, and the backup has a real e
+		self.write_file(os.path.join(root, "elsewhere", "x", "h"), "same")
+		self.write_file(os.path.join(self.__backup_path, "e", "x", "h"), "same")
+		self.write_file(os.path.join(self.__backup_path, "e", "x", "k"), "backup only")
+		os.symlink(os.path.join("..", "elsewhere"), os.path.join(self.__source_path, "e"))
+		
+		# Same times everywhere, so only what's missing shows up
+		for dir_path, dir_names, file_names in os.walk(root):
+			for name in dir_names + file_names:
+				os.utime(os.path.join(dir_path, name), (1500000000, 1500000000), follow_symlinks=False)
+	
+	@staticmethod
+	def write_file(path, content):
+		
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, "w") as f:
+			f.write(content)
+	
+	def compare(self, options: dict):
+		
+		result = backup_diff.compare(self.__source_path, self.__backup_path, dict(options, quiet=True))
+		
+		return sorted((entry.get_item(), entry.get_type_name()) for entry in result)
+	
+	def test_direct_matches_streaming(self):
+		
+		expected = [
+			("d/only", "missing_in_backup"),
+			("e/x/k", "missing_in_source"),
+			("real", "missing_in_source"),
+		]
+		
+		self.assertEqual(self.compare({"streaming": True}), expected)
+		self.assertEqual(self.compare({}), expected)
+	
+	def test_direct_matches_streaming_without_cleaning(self):
+		
+		self.assertEqual(self.compare({"no_clean": True}), self.compare({"no_clean": True, "streaming": True}))
+
+
+#
+if __name__ == "__main__":
+	unittest.main()